@@ -0,0 +1,110 @@
+"""
+Project-wide logging helpers.
+
+Every app logs through get_logger(__name__), which gives a named logger per
+module (e.g. "orders.views") configured from settings.LOGGING. Messages use
+%-style arguments so nothing is formatted unless the record is emitted.
+
+Debug output is off by default (LOG_LEVEL=INFO) but can be turned on for a
+single request by sending the X-Debug-Log header with settings.DEBUG_LOG_TOKEN,
+or with any value while settings.DEBUG is on.
+High volume debug events (one per ingredient per call) pass extra=SAMPLED and
+are sampled down by LOG_DEBUG_SAMPLE_RATE unless the request asked for them.
+"""
+import hmac
+import json
+import logging
+import random
+from contextvars import ContextVar
+from datetime import datetime, timezone
+
+from django.conf import settings
+
+
+_request_debug = ContextVar('request_debug', default=False)
+
+# Pass as extra= on high volume debug events so they can be sampled
+SAMPLED = {'sampled': True}
+
+# Attributes every LogRecord has; anything else was passed through extra=
+_RECORD_ATTRS = set(vars(logging.makeLogRecord({}))) | {'message', 'asctime', 'sampled', 'request_debug'}
+
+
+class AppLogger(logging.LoggerAdapter):
+    """Logger that can be switched to DEBUG for the current request only"""
+
+    def __init__(self, logger):
+        super().__init__(logger, {})
+
+    def isEnabledFor(self, level):
+        if _request_debug.get():
+            return True
+        return self.logger.isEnabledFor(level)
+
+    def log(self, level, msg, *args, **kwargs):
+        if not self.isEnabledFor(level):
+            return
+        if _request_debug.get():
+            kwargs['extra'] = {**(kwargs.get('extra') or {}), 'request_debug': True}
+        # Bypass the logger's own level check, which isEnabledFor already handled
+        self.logger._log(level, msg, args, **kwargs)
+
+
+def get_logger(name):
+    """Return the logger for a module, e.g. get_logger(__name__)"""
+    return AppLogger(logging.getLogger(name))
+
+
+class SamplingFilter(logging.Filter):
+    """Keeps 1 in `rate` of the records marked with extra=SAMPLED"""
+
+    def __init__(self, rate=1):
+        super().__init__()
+        self.rate = max(1, int(rate))
+
+    def filter(self, record):
+        if self.rate == 1 or not getattr(record, 'sampled', False):
+            return True
+        if getattr(record, 'request_debug', False):
+            return True
+        return random.randrange(self.rate) == 0
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats each record as a single line of JSON"""
+
+    def format(self, record):
+        data = {
+            'time': datetime.fromtimestamp(record.created, tz=timezone.utc).isoformat(),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS:
+                data[key] = value
+        if record.exc_info:
+            data['exc_info'] = self.formatException(record.exc_info)
+        return json.dumps(data, default=str)
+
+
+class RequestDebugLogMiddleware:
+    """
+    Middleware that enables debug logging for one request when it carries
+    the X-Debug-Log header matching settings.DEBUG_LOG_TOKEN (or any
+    X-Debug-Log header in development, with settings.DEBUG on)
+    """
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        expected = getattr(settings, 'DEBUG_LOG_TOKEN', '')
+        provided = request.META.get('HTTP_X_DEBUG_LOG', '')
+        if not provided or not (settings.DEBUG or (expected and hmac.compare_digest(expected, provided))):
+            return self.get_response(request)
+
+        token = _request_debug.set(True)
+        try:
+            return self.get_response(request)
+        finally:
+            _request_debug.reset(token)
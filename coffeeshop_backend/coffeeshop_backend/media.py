@@ -0,0 +1,22 @@
+"""
+Serving of locally stored media files in development (DEBUG only, see
+urls.py). In production, media is served by Cloudinary or the web server,
+which should send the same Cache-Control headers.
+
+Generated image variants (products/images.py) have content-hashed names, so
+they are marked immutable and cached by clients for a year. Other uploads can
+be replaced under the same name and are only cached briefly.
+"""
+from django.views.static import serve
+
+from products.images import VARIANT_DIR
+
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+DEFAULT_CACHE = 'public, max-age=3600'
+
+
+def serve_media(request, path, document_root=None):
+    response = serve(request, path, document_root=document_root)
+    if response.status_code == 200:
+        response['Cache-Control'] = IMMUTABLE_CACHE if path.startswith(VARIANT_DIR) else DEFAULT_CACHE
+    return response
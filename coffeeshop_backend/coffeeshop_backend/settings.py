@@ -14,6 +14,7 @@ import dj_database_url
 from pathlib import Path
 import os
 from dotenv import load_dotenv
+from corsheaders.defaults import default_headers
 import dj_database_url
 
 # Load environment variables
@@ -66,6 +67,7 @@ INSTALLED_APPS = [
     'users',
     'dashboard',
     'ingredient_inventory',
+    'jobs',
 ]
 
 REST_FRAMEWORK = {
@@ -94,6 +96,10 @@ else:
 # Enable cookies in CORS requests
 CORS_ALLOW_CREDENTIALS = True
 
+# Let clients send Idempotency-Key on order requests (see orders/idempotency.py)
+CORS_ALLOW_HEADERS = (*default_headers, 'idempotency-key')
+CORS_EXPOSE_HEADERS = ['Idempotent-Replayed']
+
 CSRF_TRUSTED_ORIGINS = [
     FRONTEND_URL,
     "http://localhost:5173",
@@ -117,6 +123,7 @@ MIDDLEWARE = [
     'users.middleware.JWTCookieMiddleware',  # Add JWT Cookie Middleware
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'coffeeshop_backend.log.RequestDebugLogMiddleware',  # Per-request debug logging
 ]
 
 ROOT_URLCONF = 'coffeeshop_backend.urls'
@@ -229,6 +236,92 @@ else:
     MEDIA_ROOT = BASE_DIR / 'media'
     print(f"⚠️ Using local storage (DEBUG={DEBUG}, CLOUD_NAME={os.environ.get('CLOUDINARY_CLOUD_NAME', 'not set')})")
 
+# Product search index
+# Each worker rebuilds its in-memory index after this many seconds so it picks
+# up changes saved by other workers (its own changes are applied immediately).
+SEARCH_INDEX_MAX_AGE = int(os.environ.get('SEARCH_INDEX_MAX_AGE', '300'))
+
+# Order stock reservations
+# Pending orders hold their ingredients for this many seconds before the
+# reservation is released (see orders/reservations.py).
+ORDER_RESERVATION_TTL = int(os.environ.get('ORDER_RESERVATION_TTL', '3600'))
+
+# Live order events (see orders/events.py and orders/stream.py)
+# The default broker only reaches clients of the same process; use
+# orders.events.PostgresBroker when running more than one worker.
+ORDER_EVENTS_BROKER = os.environ.get('ORDER_EVENTS_BROKER', 'orders.events.LocalBroker')
+ORDER_STREAM_KEEPALIVE = int(os.environ.get('ORDER_STREAM_KEEPALIVE', '15'))  # seconds between keepalive comments
+
+# Idempotency keys
+# Responses to requests sent with an Idempotency-Key header are replayed to
+# retries for this many seconds (see orders/idempotency.py).
+IDEMPOTENCY_KEY_TTL = int(os.environ.get('IDEMPOTENCY_KEY_TTL', '86400'))
+
+# Order IDs
+# Each worker thread reserves this many order numbers at a time (see orders/order_ids.py).
+ORDER_ID_BLOCK_SIZE = int(os.environ.get('ORDER_ID_BLOCK_SIZE', '50'))
+
+# Order archive
+# Completed and cancelled orders older than this many days are moved to the
+# archive tables by the archive_orders command (see orders/archive.py).
+ORDER_ARCHIVE_AFTER_DAYS = int(os.environ.get('ORDER_ARCHIVE_AFTER_DAYS', '90'))
+
+# Background jobs (see jobs/queue.py)
+# Deferred work is stored in the database and run by `python manage.py run_jobs`.
+# With JOBS_EAGER it runs in-process right after the transaction commits
+# instead, so development doesn't need a worker.
+JOBS_EAGER = os.environ.get('JOBS_EAGER', str(DEBUG)) == 'True'
+JOBS_MAX_ATTEMPTS = int(os.environ.get('JOBS_MAX_ATTEMPTS', '5'))
+JOBS_LEASE_SECONDS = int(os.environ.get('JOBS_LEASE_SECONDS', '300'))  # a running job is retried after this
+
+# Logging
+# Debug output is off unless LOG_LEVEL=DEBUG. Send the X-Debug-Log header to
+# get debug logs for a single request without changing LOG_LEVEL: any value
+# works with DEBUG on, otherwise it must match DEBUG_LOG_TOKEN.
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text' or 'json'
+LOG_DEBUG_SAMPLE_RATE = int(os.environ.get('LOG_DEBUG_SAMPLE_RATE', '1'))  # Keep 1 in N high volume debug events
+DEBUG_LOG_TOKEN = os.environ.get('DEBUG_LOG_TOKEN', '')
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'formatters': {
+        'text': {
+            'format': '{asctime} {levelname} {name} {message}',
+            'style': '{',
+        },
+        'json': {
+            '()': 'coffeeshop_backend.log.JSONFormatter',
+        },
+    },
+    'filters': {
+        'sampling': {
+            '()': 'coffeeshop_backend.log.SamplingFilter',
+            'rate': LOG_DEBUG_SAMPLE_RATE,
+        },
+    },
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+            'formatter': LOG_FORMAT,
+            'filters': ['sampling'],
+        },
+    },
+    'root': {
+        'handlers': ['console'],
+        'level': 'WARNING',
+    },
+    'loggers': {
+        app: {
+            'handlers': ['console'],
+            'level': LOG_LEVEL,
+            'propagate': False,
+        }
+        for app in ['coffeeshop_backend', 'products', 'orders', 'users', 'dashboard', 'ingredient_inventory', 'jobs']
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -15,9 +15,9 @@ Including another URLconf
     2. Add a URL to urlpatterns:  path('blog/', include('blog.urls'))
 """
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, re_path, include
 from django.conf import settings
-from django.conf.urls.static import static
+from .media import serve_media
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -28,7 +28,14 @@ urlpatterns = [
     path('', include('users.urls')),
 ]
 
-# Serve media files in all environments
+# Serve local media files in development, like the static() helper (Cloudinary serves its own URLs)
+# Production media should come from the web server or cloud storage, not the Django process
 # Note: On Render free tier, uploaded files are ephemeral and will be lost on restart
-# For production, consider using cloud storage like Cloudinary or AWS S3
-urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+if settings.DEBUG and settings.MEDIA_URL.startswith('/'):
+    urlpatterns += [
+        re_path(
+            r'^%s(?P<path>.*)$' % settings.MEDIA_URL.lstrip('/'),
+            serve_media,
+            {'document_root': settings.MEDIA_ROOT},
+        ),
+    ]
@@ -1,5 +1,5 @@
 from django.urls import path
-from .views import DashboardStatsView, SalesChartView, RecentOrdersView, OrderStatusChartView, PopularProductsView, InventoryStatusView
+from .views import DashboardStatsView, SalesChartView, RecentOrdersView, OrderStatusChartView, PopularProductsView, InventoryStatusView, OrderLifecycleView
 
 urlpatterns = [
     path('stats/', DashboardStatsView.as_view(), name='dashboard-stats'),
@@ -8,4 +8,5 @@ urlpatterns = [
     path('order-status-chart/', OrderStatusChartView.as_view(), name='order-status-chart'),
     path('popular-products/', PopularProductsView.as_view(), name='popular-products'),
     path('inventory-status/', InventoryStatusView.as_view(), name='inventory-status'),
+    path('order-lifecycle/', OrderLifecycleView.as_view(), name='order-lifecycle'),
 ]
@@ -1,19 +1,46 @@
 from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status
-from django.db.models import Sum, Count, Avg, F, Q, Value, DecimalField
-from django.db.models.functions import TruncHour, TruncDate, TruncMonth, Coalesce
+from django.db.models import Sum, Count, F, Q
+from django.db.models.functions import TruncHour, TruncDate, TruncMonth
 from django.utils import timezone
 from datetime import timedelta, datetime, time
 from decimal import Decimal
 import calendar
 from django.contrib.auth import get_user_model
 
-from orders.models import Order, OrderItem
+from orders.history import OrderHistory
+from orders.lifecycle import lifecycle_stats
 from products.models import Product
+from products.availability import get_available_stock_map
+from products.images import variant_urls
 
 User = get_user_model()
 
+# Orders that count towards sales figures
+SALES_STATUSES = ['completed', 'processing']
+# Orders shown in charts and lists, i.e. everything except cancelled
+VALID_STATUSES = ['completed', 'processing', 'pending', 'shipped', 'delivered']
+
+
+def start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+def period_totals(start=None, end=None):
+    """Order count, sales and average sale of orders placed in [start, end)"""
+    totals = OrderHistory(start, end).aggregate(
+        orders=Count('id'),
+        sales_orders=Count('id', filter=Q(status__in=SALES_STATUSES)),
+        sales=Sum('total_price', filter=Q(status__in=SALES_STATUSES)),
+    )
+    sales = totals['sales'] or Decimal('0')
+    return {
+        'orders': totals['orders'] or 0,
+        'sales': sales,
+        'average': sales / totals['sales_orders'] if totals['sales_orders'] else Decimal('0'),
+    }
+
 class DashboardStatsView(APIView):
     """
     API view to provide dashboard statistics for the frontend
@@ -26,48 +53,23 @@ class DashboardStatsView(APIView):
             current_month = today.replace(day=1)
             last_month = (current_month - timedelta(days=1)).replace(day=1)
             
-            # Total sales (all time)
-            total_sales = Order.objects.filter(
-                status__in=['completed', 'processing']
-            ).aggregate(
-                total=Sum('total_price')
-            )['total'] or Decimal('0')
-            
-            # Sales for current month
-            current_month_sales = Order.objects.filter(
-                status__in=['completed', 'processing'],
-                ordered_at__gte=current_month
-            ).aggregate(
-                total=Sum('total_price')
-            )['total'] or Decimal('0')
+            # Order counts and sales per period, each in one query per table it needs
+            all_time = period_totals()
+            current = period_totals(start_of_day(current_month))
+            previous = period_totals(start_of_day(last_month), start_of_day(current_month))
             
-            # Sales for last month
-            last_month_sales = Order.objects.filter(
-                status__in=['completed', 'processing'],
-                ordered_at__gte=last_month,
-                ordered_at__lt=current_month
-            ).aggregate(
-                total=Sum('total_price')
-            )['total'] or Decimal('0')
+            total_sales = all_time['sales']
+            current_month_sales = current['sales']
+            last_month_sales = previous['sales']
             
             # Calculate sales trend (percentage change)
             sales_trend = 0
             if last_month_sales > 0:
                 sales_trend = round(((current_month_sales - last_month_sales) / last_month_sales) * 100, 1)
             
-            # Total orders (all time)
-            total_orders = Order.objects.count()
-            
-            # Orders for current month
-            current_month_orders = Order.objects.filter(
-                ordered_at__gte=current_month
-            ).count()
-            
-            # Orders for last month
-            last_month_orders = Order.objects.filter(
-                ordered_at__gte=last_month,
-                ordered_at__lt=current_month
-            ).count()
+            total_orders = all_time['orders']
+            current_month_orders = current['orders']
+            last_month_orders = previous['orders']
             
             # Calculate orders trend
             orders_trend = 0
@@ -75,28 +77,9 @@ class DashboardStatsView(APIView):
                 orders_trend = round(((current_month_orders - last_month_orders) / last_month_orders) * 100, 1)
             
             # Average order value
-            avg_order = Order.objects.filter(
-                status__in=['completed', 'processing']
-            ).aggregate(
-                avg=Avg('total_price')
-            )['avg'] or Decimal('0')
-            
-            # Current month avg order
-            current_month_avg = Order.objects.filter(
-                status__in=['completed', 'processing'],
-                ordered_at__gte=current_month
-            ).aggregate(
-                avg=Avg('total_price')
-            )['avg'] or Decimal('0')
-            
-            # Last month avg order
-            last_month_avg = Order.objects.filter(
-                status__in=['completed', 'processing'],
-                ordered_at__gte=last_month,
-                ordered_at__lt=current_month
-            ).aggregate(
-                avg=Avg('total_price')
-            )['avg'] or Decimal('0')
+            avg_order = all_time['average']
+            current_month_avg = current['average']
+            last_month_avg = previous['average']
             
             # Calculate average order trend
             avg_trend = 0
@@ -106,11 +89,8 @@ class DashboardStatsView(APIView):
             # Low stock count
             # Consider products with less than 10 items as low stock
             # Need to check available_stock for deductable products
-            low_stock_count = 0
-            for product in Product.objects.all():
-                available = product.get_available_stock() if product.deductable else product.stock
-                if available < 10:
-                    low_stock_count += 1
+            stock_map = get_available_stock_map(Product.objects.select_related('availability'))
+            low_stock_count = sum(1 for available in stock_map.values() if available < 10)
             
             # Last month low stock count (we'll use a dummy trend here since we don't track historical stock)
             # In a real application, you would track inventory history
@@ -173,21 +153,12 @@ class SalesChartView(APIView):
         """
         # Use the current timezone-aware datetime and extract the date part
         today = timezone.now().date()
-        today_start = timezone.make_aware(datetime.combine(today, time.min))
-        today_end = timezone.make_aware(datetime.combine(today, time.max))
-        
-        # Get hourly sales for today
+        today_start = start_of_day(today)
         
         # Get hourly sales for today - include all statuses except 'cancelled'
-        hourly_sales = Order.objects.filter(
-            ordered_at__date=today,  # Use date field directly for better matching
-            # Include all valid statuses, just exclude cancelled
-            status__in=['completed', 'processing', 'pending', 'shipped', 'delivered']
-        ).annotate(
-            hour=TruncHour('ordered_at')
-        ).values('hour').annotate(
-            sales=Coalesce(Sum('total_price'), Value(0, output_field=DecimalField()), output_field=DecimalField())
-        ).order_by('hour')
+        hourly_sales = OrderHistory(
+            today_start, start_of_day(today + timedelta(days=1)), statuses=VALID_STATUSES
+        ).grouped(TruncHour('ordered_at'), sales=Sum('total_price'))
         
         # Format data for frontend
         chart_data = []
@@ -197,10 +168,9 @@ class SalesChartView(APIView):
         
         # Create a map for easier lookup
         sales_by_hour = {}
-        for item in hourly_sales:
+        for hour, item in hourly_sales.items():
             # Store by hour number (0-23)
-            hour_key = item['hour'].hour
-            sales_by_hour[hour_key] = item['sales']
+            sales_by_hour[timezone.localtime(hour).hour] = item['sales'] or Decimal('0')
             
         # Generate chart data for each business hour
         for hour in business_hours:
@@ -232,26 +202,18 @@ class SalesChartView(APIView):
         start_of_week = today - timedelta(days=today.weekday())  # Monday
         end_of_week = start_of_week + timedelta(days=6)  # Sunday
         
-        # Get orders for current week
-        
         # Get daily sales for the current week - include all statuses except 'cancelled'
-        daily_sales = Order.objects.filter(
-            ordered_at__date__range=(start_of_week, end_of_week),
-            status__in=['completed', 'processing', 'pending', 'shipped', 'delivered']
-        ).annotate(
-            day=TruncDate('ordered_at')
-        ).values('day').annotate(
-            sales=Coalesce(Sum('total_price'), Value(0, output_field=DecimalField()), output_field=DecimalField())
-        ).order_by('day')
+        daily_sales = OrderHistory(
+            start_of_day(start_of_week), start_of_day(end_of_week + timedelta(days=1)), statuses=VALID_STATUSES
+        ).grouped(TruncDate('ordered_at'), sales=Sum('total_price'))
         
         # Process sales data by day
         
         # Create a map for easier lookup
         sales_by_date = {}
-        for item in daily_sales:
+        for day, item in daily_sales.items():
             # Get the date as a string for mapping
-            date_key = item['day'].isoformat()
-            sales_by_date[date_key] = item['sales']
+            sales_by_date[day.isoformat()] = item['sales'] or Decimal('0')
         
         # Format data for frontend
         chart_data = []
@@ -277,28 +239,20 @@ class SalesChartView(APIView):
         """
         today = timezone.now().date()
         start_of_year = today.replace(month=1, day=1)
-        end_of_year = today.replace(month=12, day=31)
-        
-        # Get orders for current year
+        start_of_next_year = start_of_year.replace(year=start_of_year.year + 1)
         
         # Get monthly sales for the current year - include all statuses except 'cancelled'
-        monthly_sales = Order.objects.filter(
-            ordered_at__date__range=(start_of_year, end_of_year),
-            status__in=['completed', 'processing', 'pending', 'shipped', 'delivered']
-        ).annotate(
-            month=TruncMonth('ordered_at')
-        ).values('month').annotate(
-            sales=Coalesce(Sum('total_price'), Value(0, output_field=DecimalField()), output_field=DecimalField())
-        ).order_by('month')
+        monthly_sales = OrderHistory(
+            start_of_day(start_of_year), start_of_day(start_of_next_year), statuses=VALID_STATUSES
+        ).grouped(TruncMonth('ordered_at'), sales=Sum('total_price'))
         
         # Process sales data by month
         
         # Create a map for easier lookup
         sales_by_month = {}
-        for item in monthly_sales:
+        for month, item in monthly_sales.items():
             # Store by month number (1-12)
-            month_key = item['month'].month
-            sales_by_month[month_key] = item['sales']
+            sales_by_month[timezone.localtime(month).month] = item['sales'] or Decimal('0')
         
         # Format data for frontend
         chart_data = []
@@ -326,9 +280,7 @@ class RecentOrdersView(APIView):
         limit = int(request.query_params.get('limit', 5))
         
         # Get recent orders (exclude cancelled)
-        recent_orders = Order.objects.filter(
-            status__in=['completed', 'processing', 'pending', 'shipped', 'delivered']
-        ).order_by('-ordered_at')[:limit]
+        recent_orders = OrderHistory(statuses=VALID_STATUSES).recent(limit)
         
         # Format data for frontend
         orders_data = []
@@ -344,13 +296,8 @@ class RecentOrdersView(APIView):
             else:
                 customer_name = "Guest"
                     
-            # Get items summary
-            items = OrderItem.objects.filter(order=order)
-            if items:
-                items_text = ", ".join([f"{item.product.name} (x{item.quantity})" if item.quantity > 1 
-                                      else item.product.name for item in items])
-            else:
-                items_text = "No items"
+            # Stored on the order, so no query per order
+            items_text = order.items_summary
                 
             # Format date
             order_date = timezone.localtime(order.ordered_at)
@@ -374,9 +321,10 @@ class OrderStatusChartView(APIView):
     """
     def get(self, request):
         # Get counts for each status
-        status_counts = Order.objects.values('status').annotate(
-            count=Count('id')
-        ).order_by('status')
+        status_counts = [
+            {'status': key, 'count': item['count']}
+            for key, item in sorted(OrderHistory().grouped('status', count=Count('id')).items())
+        ]
         
         # Define standard statuses and colors
         standard_statuses = {
@@ -426,7 +374,7 @@ class PopularProductsView(APIView):
         
         # Use Django ORM to aggregate order items by product
         # We'll only count orders with status != 'cancelled'
-        valid_statuses = ['completed', 'processing', 'pending', 'shipped', 'delivered']
+        valid_statuses = VALID_STATUSES
         
         # Time period filter (default to current month)
         period = request.query_params.get('period', 'month')
@@ -443,40 +391,40 @@ class PopularProductsView(APIView):
             today = timezone.now().date()
             start_date = today.replace(month=1, day=1)  # First day of current year
         
-        # Create base queryset for order items
-        order_item_query = OrderItem.objects.filter(
-            order__status__in=valid_statuses
-        )
-        
-        # Apply date filter if applicable
-        if start_date:
-            order_item_query = order_item_query.filter(
-                order__ordered_at__gte=timezone.make_aware(datetime.combine(start_date, time.min))
-            )
+        # Order items of the period, with the date filter if applicable
+        history = OrderHistory(start_of_day(start_date) if start_date else None, statuses=valid_statuses)
         
         # Aggregate by product
-        product_stats = (
-            order_item_query
-            .values('product')
-            .annotate(
-                total_quantity=Sum('quantity'),
-                total_revenue=Sum(F('quantity') * F('price'))
-            )
-            .order_by('-total_quantity')[:limit]
-        )
+        product_stats = sorted(
+            (
+                {'product': product_id, **totals}
+                for product_id, totals in history.grouped_items(
+                    'product',
+                    total_quantity=Sum('quantity'),
+                    total_revenue=Sum(F('quantity') * F('price'))
+                ).items()
+            ),
+            key=lambda stat: stat['total_quantity'],
+            reverse=True
+        )[:limit]
         
         # If there are no results, return empty array
         if not product_stats:
             return Response([]) 
             
-        # Get product details for the results
+        # Get product details for the results in a single query
+        products = Product.objects.select_related('availability').in_bulk(
+            [stat['product'] for stat in product_stats]
+        )
+        stock_map = get_available_stock_map(products.values())
+        
         products_data = []
         for stat in product_stats:
             try:
-                product = Product.objects.get(pk=stat['product'])
+                product = products[stat['product']]
                 
                 # Determine stock status using available_stock for deductable products
-                available_stock = product.get_available_stock() if product.deductable else product.stock
+                available_stock = stock_map[product.pk]
                 
                 if available_stock <= 0:
                     status = "Out of Stock"
@@ -487,7 +435,11 @@ class PopularProductsView(APIView):
                 
                 # Get image URL if available
                 image_url = None
-                if product.image and hasattr(product.image, 'url'):
+                image_variants = variant_urls(product, request)
+                if image_variants:
+                    # Dashboard only shows a small image, so don't send the full size
+                    image_url = image_variants['thumbnail']
+                elif product.image and hasattr(product.image, 'url'):
                     image_url = request.build_absolute_uri(product.image.url)
                 
                 products_data.append({
@@ -496,11 +448,12 @@ class PopularProductsView(APIView):
                     'quantity': stat['total_quantity'],
                     'revenue': float(stat['total_revenue']),
                     'image': image_url,
+                    'image_variants': image_variants,
                     'category': 'Coffee',  # Placeholder - would come from a category field in the Product model
                     'status': status,
                     'stock': available_stock
                 })
-            except Product.DoesNotExist:
+            except KeyError:
                 continue
         
         return Response(products_data)
@@ -515,15 +468,18 @@ class InventoryStatusView(APIView):
         limit = int(request.query_params.get('limit', 0))
         
         # Get products with stock information
-        products = Product.objects.all().order_by('stock')
+        products = Product.objects.select_related('availability').order_by('stock')
         
         if limit > 0:
             products = products[:limit]
         
+        products = list(products)
+        stock_map = get_available_stock_map(products)
+        
         inventory_data = []
         for product in products:
             # Use available_stock for deductable products
-            available_stock = product.get_available_stock() if product.deductable else product.stock
+            available_stock = stock_map[product.pk]
             
             # Determine stock status based on levels
             # Using percentage of theoretical maximum stock (100 units as default)
@@ -551,3 +507,31 @@ class InventoryStatusView(APIView):
             })
         
         return Response(inventory_data)
+
+
+class OrderLifecycleView(APIView):
+    """
+    API view to provide how long orders wait and take to make, as percentiles
+    in seconds, overall and by hour of the day, product and who completed them
+    """
+    def get(self, request):
+        # Time period filter (default to current week)
+        period = request.query_params.get('period', 'week')
+        today = timezone.now().date()
+        
+        if period == 'day':
+            start_date = today
+        elif period == 'week':
+            start_date = today - timedelta(days=today.weekday())  # Monday of current week
+        elif period == 'month':
+            start_date = today.replace(day=1)
+        elif period == 'year':
+            start_date = today.replace(month=1, day=1)
+        elif period == 'all':
+            start_date = None
+        else:
+            return Response({'error': 'Invalid period'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        # Read from the durations stored on each order, see orders/lifecycle.py
+        stats = lifecycle_stats(start_of_day(start_date) if start_date else None)
+        return Response({'period': period, **stats})
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingredient_inventory', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='reserved',
+            field=models.DecimalField(decimal_places=3, default=0, editable=False, help_text="Running total of stock held by live order reservations, in the ingredient's unit", max_digits=12),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingredient_inventory', '0002_ingredient_reserved'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='ingredient',
+            name='density',
+            field=models.DecimalField(blank=True, decimal_places=4, help_text='Grams per ml, needed for recipes that measure this ingredient by volume and stock it by mass or the other way round', max_digits=8, null=True),
+        ),
+    ]
@@ -15,7 +15,9 @@ class Ingredient(models.Model):
     name = models.CharField(max_length=100)
     category = models.ForeignKey(Category, on_delete=models.SET_NULL, null=True, related_name='ingredients')
     stock = models.DecimalField(max_digits=8, decimal_places=2)
+    reserved = models.DecimalField(max_digits=12, decimal_places=3, default=0, editable=False, help_text="Running total of stock held by live order reservations, in the ingredient's unit")
     unit = models.CharField(max_length=20)  # ml, g, etc.
+    density = models.DecimalField(max_digits=8, decimal_places=4, null=True, blank=True, help_text="Grams per ml, needed for recipes that measure this ingredient by volume and stock it by mass or the other way round")
     reorder_point = models.DecimalField(max_digits=8, decimal_places=2)
     cost_per_unit = models.DecimalField(max_digits=8, decimal_places=4, default=0)
     notes = models.TextField(blank=True)
@@ -25,6 +27,21 @@ class Ingredient(models.Model):
     def __str__(self):
         return f"{self.name} ({self.stock} {self.unit})"
     
+    def save(self, *args, **kwargs):
+        # reserved is only changed through F() updates (orders.reservations.adjust_reserved);
+        # writing back the loaded value would undo reservations made since it was read
+        if not self._state.adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [name for name in update_fields if name != 'reserved']
+        super().save(*args, **kwargs)
+    
+    @property
+    def free_stock(self):
+        """Stock not held by any pending or in-progress order"""
+        return self.stock - self.reserved
+    
     @property
     def is_low_stock(self):
         return self.stock <= self.reorder_point
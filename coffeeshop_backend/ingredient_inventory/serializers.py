@@ -1,5 +1,7 @@
 from rest_framework import serializers
 from .models import Category, Ingredient
+from products.models import ProductIngredient, SubRecipeIngredient
+from products.units import ConversionError
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
@@ -14,7 +16,26 @@ class IngredientSerializer(serializers.ModelSerializer):
     class Meta:
         model = Ingredient
         fields = [
-            'id', 'name', 'category', 'category_name', 'stock', 
-            'unit', 'reorder_point', 'cost_per_unit', 'notes', 
+            'id', 'name', 'category', 'category_name', 'stock', 'reserved',
+            'unit', 'density', 'reorder_point', 'cost_per_unit', 'notes', 
             'is_low_stock', 'created_at', 'updated_at'
         ]
+    
+    def validate(self, data):
+        if self.instance is None or not {'unit', 'density'} & set(data):
+            return data
+        
+        # The recipes already using this ingredient must still convert to the new unit
+        ingredient = Ingredient(
+            pk=self.instance.pk, name=self.instance.name,
+            unit=data.get('unit', self.instance.unit),
+            density=data.get('density', self.instance.density),
+        )
+        for model in (ProductIngredient, SubRecipeIngredient):
+            for line in model.objects.filter(ingredient=self.instance):
+                line.ingredient = ingredient
+                try:
+                    line.resolve_conversion_factor()
+                except ConversionError as error:
+                    raise serializers.ValidationError({'density': f"{error}, used by {line}"})
+        return data
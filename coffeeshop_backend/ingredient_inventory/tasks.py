@@ -0,0 +1,24 @@
+"""Background jobs for ingredients, see jobs/queue.py"""
+from decimal import Decimal
+
+from coffeeshop_backend.log import get_logger
+from jobs.queue import register
+from .models import Ingredient
+
+logger = get_logger(__name__)
+
+
+@register('ingredient_inventory.low_stock_alert')
+def low_stock_alert(used):
+    """
+    Warn about ingredients that a deduction of {ingredient_id: amount} took
+    down to their reorder point. Ingredients that were already below it
+    before the deduction are not reported again.
+    """
+    for ingredient in Ingredient.objects.filter(pk__in=used):
+        amount = Decimal(used[str(ingredient.pk)])
+        if ingredient.stock <= ingredient.reorder_point < ingredient.stock + amount:
+            logger.warning(
+                "Ingredient %s is low: %s%s left, reorder point %s%s",
+                ingredient.name, ingredient.stock, ingredient.unit, ingredient.reorder_point, ingredient.unit,
+            )
@@ -0,0 +1,28 @@
+import time
+
+from django.core.management.base import BaseCommand
+from jobs.queue import run_pending
+
+
+class Command(BaseCommand):
+    help = 'Run queued background jobs, polling for new ones until stopped'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Run every due job and exit instead of polling')
+        parser.add_argument('--batch-size', type=int, default=50, help='Jobs claimed at a time')
+        parser.add_argument('--interval', type=float, default=1.0, help='Seconds to wait when no job is due')
+
+    def handle(self, *args, **options):
+        processed = 0
+        try:
+            while True:
+                claimed = run_pending(options['batch_size'])
+                processed += claimed
+                if claimed:
+                    continue
+                if options['once']:
+                    break
+                time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Ran {processed} jobs.'))
@@ -0,0 +1,126 @@
+"""
+A job queue stored in the database.
+
+Work that doesn't have to happen before a request responds (refreshing
+product availability, low-stock alerts and the like) is queued with
+enqueue() and run later by `python manage.py run_jobs`.
+
+    @register('products.refresh_availability')
+    def refresh_availability(ingredient_ids):
+        ...
+
+    enqueue('products.refresh_availability', ingredient_ids=[1, 2])
+
+The job row is written in the caller's transaction, so a job exists exactly
+when the change that queued it commits, and workers can't pick it up
+before then. Delivery is at least once: a job whose worker dies is run
+again once its lease (JOBS_LEASE_SECONDS) runs out, so handlers must be
+safe to run twice. A failing job is retried with exponential backoff up to
+JOBS_MAX_ATTEMPTS times and then kept as failed.
+
+With JOBS_EAGER (the default in development) jobs aren't stored; they run
+in-process as soon as the transaction commits, so no worker is needed.
+"""
+import json
+import random
+import traceback
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from coffeeshop_backend.log import get_logger
+from .models import Job
+
+logger = get_logger(__name__)
+
+_handlers = {}
+
+
+def register(name):
+    """Register the decorated function as the handler of jobs called name"""
+    def decorator(handler):
+        _handlers[name] = handler
+        return handler
+    return decorator
+
+
+def _run_now(name, payload):
+    try:
+        _handlers[name](**payload)
+    except Exception:
+        logger.exception("Job %s failed", name)
+
+
+def enqueue(name, **payload):
+    """
+    Queue a job to run after the current transaction commits. The payload
+    must be JSON serializable; it is passed to the handler as keyword arguments.
+    """
+    if name not in _handlers:
+        raise KeyError(f"No job handler registered for {name}")
+    # Handlers see the payload as it comes back from JSON in both modes, e.g. dict keys as strings
+    payload = json.loads(json.dumps(payload, cls=DjangoJSONEncoder))
+    if getattr(settings, 'JOBS_EAGER', False):
+        transaction.on_commit(lambda: _run_now(name, payload))
+        return None
+    return Job.objects.create(name=name, payload=payload, max_attempts=getattr(settings, 'JOBS_MAX_ATTEMPTS', 5))
+
+
+def backoff(attempts):
+    """Delay before retrying a job that has failed `attempts` times: 10s, 20s, 40s... up to an hour, with jitter"""
+    delay = min(3600, 10 * 2 ** (attempts - 1))
+    return timedelta(seconds=delay * random.uniform(0.8, 1.2))
+
+
+@transaction.atomic
+def claim(limit):
+    """Lease up to limit due jobs to this worker, oldest first"""
+    now = timezone.now()
+    # Running jobs whose lease ran out belonged to a worker that died
+    jobs = list(
+        Job.objects.select_for_update(skip_locked=True)
+        .filter(Q(status=Job.QUEUED) | Q(status=Job.RUNNING, locked_until__lte=now), run_after__lte=now)
+        .order_by('run_after')[:limit]
+    )
+    if jobs:
+        lease = timedelta(seconds=getattr(settings, 'JOBS_LEASE_SECONDS', 300))
+        Job.objects.filter(pk__in=[job.pk for job in jobs]).update(
+            status=Job.RUNNING, attempts=F('attempts') + 1, locked_until=now + lease
+        )
+        for job in jobs:
+            job.attempts += 1
+    return jobs
+
+
+def run(job):
+    """Run a claimed job, then delete it, or schedule a retry, or mark it failed. Returns True on success."""
+    try:
+        handler = _handlers[job.name]
+        with transaction.atomic():
+            handler(**job.payload)
+    except Exception:
+        error = traceback.format_exc()
+        if job.attempts >= job.max_attempts:
+            logger.error("Job %s #%s failed for good after %s attempts", job.name, job.pk, job.attempts)
+            Job.objects.filter(pk=job.pk).update(status=Job.FAILED, locked_until=None, last_error=error)
+        else:
+            retry_at = timezone.now() + backoff(job.attempts)
+            logger.warning("Job %s #%s failed, retrying at %s", job.name, job.pk, retry_at)
+            Job.objects.filter(pk=job.pk).update(
+                status=Job.QUEUED, locked_until=None, run_after=retry_at, last_error=error
+            )
+        return False
+    Job.objects.filter(pk=job.pk).delete()
+    return True
+
+
+def run_pending(limit=50):
+    """Claim and run one batch of due jobs, returning how many were claimed"""
+    jobs = claim(limit)
+    for job in jobs:
+        run(job)
+    return len(jobs)
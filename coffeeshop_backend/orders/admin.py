@@ -1,6 +1,26 @@
 from django.contrib import admin
-from .models import Order
+from .models import ArchivedOrder, Order, StockReservation
 
 admin.site.register(Order)
 
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('order', 'ingredient', 'product', 'quantity', 'expires_at', 'created_at')
+    list_filter = ('expires_at',)
+    list_select_related = ('order', 'ingredient', 'product')
+
+
+@admin.register(ArchivedOrder)
+class ArchivedOrderAdmin(admin.ModelAdmin):
+    list_display = ('order_id', 'customer_name', 'total_price', 'status', 'ordered_at')
+    list_filter = ('status', 'month')
+    search_fields = ('order_id', 'customer_name')
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
 # Register your models here.
@@ -0,0 +1,93 @@
+"""
+Moving closed orders out of the live tables.
+
+Completed and cancelled orders older than ORDER_ARCHIVE_AFTER_DAYS are
+copied, with their items and status history, into the month-keyed archive
+tables (ArchivedOrder, ArchivedOrderItem, ArchivedOrderStatusHistory) and
+deleted from Order, so the live tables only hold open and recent orders.
+Each batch is copied and deleted in one transaction, so an order is always
+in exactly one place. Rows keep their ids.
+
+Reads that may need archived orders go through orders.history.OrderHistory.
+"""
+from datetime import datetime, timedelta, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from coffeeshop_backend.log import get_logger
+from .models import (
+    ArchivedOrder, ArchivedOrderItem, ArchivedOrderStatusHistory, Order, OrderItem, OrderStatusHistory,
+)
+
+logger = get_logger(__name__)
+
+CLOSED_STATUSES = ('completed', 'cancelled')
+BATCH_SIZE = 500
+
+
+def month_key(moment):
+    """The archive month of a datetime, e.g. 202610, taken in UTC so it never depends on TIME_ZONE"""
+    moment = moment.astimezone(dt_timezone.utc)
+    return moment.year * 100 + moment.month
+
+
+def month_end(key):
+    """The first instant after archive month key"""
+    year, month = divmod(key, 100)
+    year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return datetime(year, month, 1, tzinfo=dt_timezone.utc)
+
+
+def archive_cutoff(now=None):
+    """Closed orders placed before this are archived"""
+    days = getattr(settings, 'ORDER_ARCHIVE_AFTER_DAYS', 90)
+    return (now or timezone.now()) - timedelta(days=days)
+
+
+def _copy_fields(archive_model):
+    """The live columns an archive model stores, i.e. all of its own except month"""
+    return [field.attname for field in archive_model._meta.concrete_fields if field.name != 'month']
+
+
+@transaction.atomic
+def _archive_batch(before, batch_size):
+    # Orders someone is working on right now are left for the next run
+    orders = list(
+        Order.objects.select_for_update(skip_locked=True)
+        .filter(status__in=CLOSED_STATUSES, ordered_at__lt=before)
+        .order_by('ordered_at', 'pk')
+        .values(*_copy_fields(ArchivedOrder))[:batch_size]
+    )
+    if not orders:
+        return 0
+
+    months = {order['id']: month_key(order['ordered_at']) for order in orders}
+    ArchivedOrder.objects.bulk_create([ArchivedOrder(month=months[order['id']], **order) for order in orders])
+    for live_model, archive_model in (
+        (OrderItem, ArchivedOrderItem),
+        (OrderStatusHistory, ArchivedOrderStatusHistory),
+    ):
+        rows = live_model.objects.filter(order__in=months).values(*_copy_fields(archive_model))
+        archive_model.objects.bulk_create([archive_model(month=months[row['order_id']], **row) for row in rows])
+
+    # Cascades to the items and history copied above
+    Order.objects.filter(pk__in=months).delete()
+    return len(orders)
+
+
+def archive_orders(before=None, batch_size=BATCH_SIZE):
+    """
+    Move closed orders placed before `before` (default: archive_cutoff()) to
+    the archive, batch_size orders per transaction. Returns how many moved.
+    """
+    before = before or archive_cutoff()
+    archived = 0
+    while True:
+        moved = _archive_batch(before, batch_size)
+        if not moved:
+            break
+        archived += moved
+    logger.info("Archived %s orders placed before %s", archived, before)
+    return archived
@@ -0,0 +1,209 @@
+"""
+Order events for live boards.
+
+Views publish an event when an order is created, its items change or its
+status changes. The event is sent after the transaction commits, so
+subscribers never see a change that was rolled back. Each event carries
+the order's list row (OrderListSerializer), so boards can update in place
+without fetching the order again.
+
+The broker is chosen with settings.ORDER_EVENTS_BROKER:
+
+- orders.events.LocalBroker (default) fans events out inside one process,
+  which is enough for a single worker.
+- orders.events.PostgresBroker sends events through PostgreSQL
+  LISTEN/NOTIFY, so every worker and server sees every event.
+
+A broker only needs publish(event) and subscribe(), which returns a
+Subscription.
+"""
+import asyncio
+import json
+import select
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import Count
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from coffeeshop_backend.log import get_logger
+from .models import Order
+from .serializers import OrderListSerializer
+
+logger = get_logger(__name__)
+
+ORDER_CREATED = 'order.created'
+ITEMS_CHANGED = 'order.items_changed'
+STATUS_CHANGED = 'order.status_changed'
+ORDER_DELETED = 'order.deleted'
+
+# Put in a subscription's queue when it fell behind and events were dropped
+RESYNC = object()
+
+
+class Subscription:
+    """
+    Events for one client, delivered into an asyncio queue on the client's
+    event loop. A slow client that fills its queue gets RESYNC instead of
+    the events it missed, and should fetch a fresh snapshot.
+    """
+
+    def __init__(self, broker, size):
+        self.broker = broker
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(size)
+
+    def push(self, event):
+        """Deliver an event; safe to call from any thread"""
+        try:
+            self.loop.call_soon_threadsafe(self._put, event)
+        except RuntimeError:
+            # The client's event loop is gone
+            self.close()
+
+    def _put(self, event):
+        if self.queue.full():
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            event = RESYNC
+        self.queue.put_nowait(event)
+
+    async def get(self, timeout=None):
+        """Next event, raising asyncio.TimeoutError after timeout seconds"""
+        return await asyncio.wait_for(self.queue.get(), timeout)
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    """Fans events out to the subscribers of this process"""
+    queue_size = 100
+
+    def __init__(self):
+        self._subscribers = set()
+        self._lock = threading.Lock()
+
+    def active(self):
+        """Whether anyone could receive a published event"""
+        return bool(self._subscribers)
+
+    def publish(self, event):
+        self.deliver(event)
+
+    def deliver(self, event):
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for subscription in subscribers:
+            subscription.push(event)
+
+    def subscribe(self):
+        """Start receiving events; call from the event loop that will read them"""
+        subscription = Subscription(self, self.queue_size)
+        with self._lock:
+            self._subscribers.add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            self._subscribers.discard(subscription)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Publishes with NOTIFY, and each process delivers to its own subscribers
+    from one LISTEN connection running in a background thread. Payloads are
+    limited to 8000 bytes by PostgreSQL, which a list row stays well under.
+    """
+    channel = 'order_events'
+    poll_interval = 5
+    reconnect_delay = 2
+
+    def __init__(self):
+        super().__init__()
+        self._listener = None
+
+    def active(self):
+        # Subscribers may be connected to other processes
+        return True
+
+    def publish(self, event):
+        with connections['default'].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [self.channel, json.dumps(event)])
+
+    def subscribe(self):
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='order-events', daemon=True)
+                self._listener.start()
+        return super().subscribe()
+
+    def _listen(self):
+        database = connections['default']
+        while True:
+            try:
+                conn = database.get_new_connection(database.get_connection_params())
+                conn.autocommit = True
+                with conn.cursor() as cursor:
+                    cursor.execute(f'LISTEN "{self.channel}"')
+                while True:
+                    if select.select([conn], [], [], self.poll_interval) == ([], [], []):
+                        continue
+                    conn.poll()
+                    while conn.notifies:
+                        notify = conn.notifies.pop(0)
+                        self.deliver(json.loads(notify.payload))
+            except Exception:
+                logger.exception("Order event listener failed, reconnecting")
+                time.sleep(self.reconnect_delay)
+
+
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker():
+    """The process-wide broker configured by settings.ORDER_EVENTS_BROKER"""
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                _broker = import_string(getattr(settings, 'ORDER_EVENTS_BROKER', 'orders.events.LocalBroker'))()
+    return _broker
+
+
+def order_rows(queryset):
+    """List rows as sent to boards, for orders in queryset"""
+    return OrderListSerializer(queryset.annotate(items_count=Count('items')), many=True).data
+
+
+def publish_order_event(kind, order_id):
+    """Publish an event for an order once the current transaction commits"""
+    publish_order_events(kind, [order_id])
+
+
+def publish_order_events(kind, order_ids):
+    """Publish one event per order once the current transaction commits, loading their rows in one query"""
+    order_ids = list(order_ids)
+
+    def send():
+        broker = get_broker()
+        if not broker.active() or not order_ids:
+            return
+        if kind == ORDER_DELETED:
+            orders = [{'id': order_id} for order_id in order_ids]
+        else:
+            orders = order_rows(Order.objects.filter(pk__in=order_ids).order_by('pk'))
+        for order in orders:
+            event = {'id': uuid.uuid4().hex, 'type': kind, 'at': timezone.now().isoformat(), 'order': order}
+            try:
+                broker.publish(event)
+            except Exception:
+                # Boards catch up from their next snapshot, the order change itself stands
+                logger.exception("Could not publish %s for order %s", kind, order['id'])
+
+    transaction.on_commit(send)
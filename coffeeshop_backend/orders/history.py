@@ -0,0 +1,131 @@
+"""
+Reading orders across the live and archive tables.
+
+OrderHistory answers questions about the orders placed in a date range,
+whether they are still in Order or were moved to the archive by
+orders/archive.py. The live table is always queried. The archive is only
+queried when the range starts before the end of the newest archived month,
+and then only for the months in the range, so questions about recent days
+never touch it.
+
+Results from the two tables are combined in Python, so only aggregates that
+can be added up (Sum, Count) are supported. Averages are sums divided by
+counts.
+"""
+from django.db.models import F, Max
+
+from .archive import month_end, month_key
+from .models import ArchivedOrder, ArchivedOrderItem, Order, OrderItem
+
+
+def _add(left, right):
+    if left is None:
+        return right
+    if right is None:
+        return left
+    return left + right
+
+
+def _merge(results):
+    """Add up {name: value} dicts, treating a missing or None value as nothing"""
+    merged = {}
+    for result in results:
+        for name, value in result.items():
+            merged[name] = _add(merged.get(name), value)
+    return merged
+
+
+class OrderHistory:
+    """
+    Orders placed in [start, end), optionally only those with one of the
+    given statuses. Either bound may be None for an open range.
+    """
+
+    def __init__(self, start=None, end=None, statuses=None):
+        self.start = start
+        self.end = end
+        self.statuses = statuses
+        self._archived_until = None
+
+    def archived_until(self):
+        """The end of the newest archived month, or None if nothing is archived"""
+        if self._archived_until is None:
+            # Served from the index that leads with month
+            newest = ArchivedOrder.objects.aggregate(newest=Max('month'))['newest']
+            self._archived_until = month_end(newest) if newest else False
+        return self._archived_until or None
+
+    def uses_archive(self):
+        until = self.archived_until()
+        return until is not None and (self.start is None or self.start < until)
+
+    def _order_filters(self, prefix=''):
+        filters = {}
+        if self.start is not None:
+            filters[f'{prefix}ordered_at__gte'] = self.start
+        if self.end is not None:
+            filters[f'{prefix}ordered_at__lt'] = self.end
+        if self.statuses is not None:
+            filters[f'{prefix}status__in'] = self.statuses
+        return filters
+
+    def _month_filters(self):
+        filters = {}
+        if self.start is not None:
+            filters['month__gte'] = month_key(self.start)
+        if self.end is not None:
+            filters['month__lte'] = month_key(self.end)
+        return filters
+
+    def orders(self):
+        """Querysets of the matching Order and, if needed, ArchivedOrder rows"""
+        querysets = [Order.objects.filter(**self._order_filters())]
+        if self.uses_archive():
+            querysets.append(ArchivedOrder.objects.filter(**self._month_filters(), **self._order_filters()))
+        return querysets
+
+    def items(self):
+        """Querysets of the items of the matching orders, live and, if needed, archived"""
+        querysets = [OrderItem.objects.filter(**self._order_filters('order__'))]
+        if self.uses_archive():
+            querysets.append(
+                ArchivedOrderItem.objects.filter(**self._month_filters(), **self._order_filters('order__'))
+            )
+        return querysets
+
+    def aggregate(self, **aggregates):
+        """Like QuerySet.aggregate over the matching orders, for Sum and Count"""
+        return _merge(queryset.aggregate(**aggregates) for queryset in self.orders())
+
+    def grouped(self, key, **aggregates):
+        """{key value: {name: value}} over the matching orders, key being a field name or expression"""
+        return self._grouped(self.orders(), key, aggregates)
+
+    def grouped_items(self, key, **aggregates):
+        """Like grouped, over the items of the matching orders"""
+        return self._grouped(self.items(), key, aggregates)
+
+    @staticmethod
+    def _grouped(querysets, key, aggregates):
+        groups = {}
+        for queryset in querysets:
+            rows = queryset.annotate(group_key=F(key) if isinstance(key, str) else key)
+            for row in rows.values('group_key').annotate(**aggregates).order_by():
+                group = row.pop('group_key')
+                groups[group] = _merge([groups.get(group, {}), row])
+        return groups
+
+    def recent(self, limit):
+        """The newest `limit` matching orders, Order or ArchivedOrder instances, newest first"""
+        orders = list(
+            Order.objects.filter(**self._order_filters()).select_related('customer').order_by('-ordered_at')[:limit]
+        )
+        # Archived orders are all older than the end of the newest archived month
+        if self.uses_archive() and (
+            len(orders) < limit or (orders and orders[-1].ordered_at < self.archived_until())
+        ):
+            orders += ArchivedOrder.objects.filter(**self._month_filters(), **self._order_filters()).select_related(
+                'customer'
+            ).order_by('-ordered_at')[:limit]
+            orders.sort(key=lambda order: order.ordered_at, reverse=True)
+        return orders[:limit]
@@ -0,0 +1,111 @@
+"""
+Idempotency-Key support for order endpoints.
+
+Clients on flaky connections send an Idempotency-Key header (e.g. a UUID
+made once per user action) and reuse it on every retry. The first request
+with a key runs normally and its response is stored. Any retry within
+IDEMPOTENCY_KEY_TTL seconds gets that stored response back after a single
+indexed lookup, with an Idempotent-Replayed: true header, and nothing runs
+twice.
+
+The key is claimed, the view runs and its response is stored in one
+transaction. A concurrent duplicate waits on the unique key until the first
+request commits and then replays its response, and a request that fails
+with an exception or a 5xx leaves no key behind, so it can be retried.
+Reusing a key for a different request is rejected with 422.
+"""
+import functools
+import hashlib
+import json
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from coffeeshop_backend.log import get_logger
+from .models import IdempotencyKey
+
+logger = get_logger(__name__)
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def key_ttl():
+    return timedelta(seconds=getattr(settings, 'IDEMPOTENCY_KEY_TTL', 86400))
+
+
+def _digest(*parts):
+    hasher = hashlib.sha256()
+    for part in parts:
+        hasher.update(part if isinstance(part, bytes) else str(part).encode())
+        hasher.update(b'\0')
+    return hasher.hexdigest()
+
+
+def _replay(record, request_hash):
+    if record.request_hash != request_hash:
+        return Response(
+            {'error': f'{HEADER} was already used for a different request'},
+            status=status.HTTP_422_UNPROCESSABLE_ENTITY,
+        )
+    return Response(record.response, status=record.status_code, headers={'Idempotent-Replayed': 'true'})
+
+
+def idempotent(view_method):
+    """Honour the Idempotency-Key header on a viewset method or action"""
+    @functools.wraps(view_method)
+    def wrapper(self, request, *args, **kwargs):
+        client_key = request.headers.get(HEADER)
+        if not client_key:
+            return view_method(self, request, *args, **kwargs)
+        if len(client_key) > MAX_KEY_LENGTH:
+            return Response(
+                {'error': f'{HEADER} must be at most {MAX_KEY_LENGTH} characters'},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        # Keys are per user and per endpoint, so two clients can't collide
+        user = request.user.pk if request.user.is_authenticated else 'anonymous'
+        key = _digest(user, self.basename, self.action, client_key)
+        request_hash = _digest(request.method, request.path, request.body)
+        now = timezone.now()
+
+        record = IdempotencyKey.objects.filter(key=key, expires_at__gt=now).first()
+        if record is not None:
+            return _replay(record, request_hash)
+
+        try:
+            with transaction.atomic():
+                # Claim the key first: a concurrent duplicate blocks here until we commit
+                IdempotencyKey.objects.filter(key=key, expires_at__lte=now).delete()
+                record = IdempotencyKey.objects.create(
+                    key=key, request_hash=request_hash, status_code=0, expires_at=now + key_ttl()
+                )
+                response = view_method(self, request, *args, **kwargs)
+                if response.status_code >= 500:
+                    transaction.set_rollback(True)
+                    return response
+                record.status_code = response.status_code
+                record.response = json.loads(json.dumps(response.data, cls=JSONEncoder))
+                record.save(update_fields=['status_code', 'response'])
+                return response
+        except IntegrityError:
+            # Another request with this key committed first
+            record = IdempotencyKey.objects.filter(key=key).first()
+            if record is None:
+                raise
+            logger.info("Replaying concurrent duplicate of %s.%s", self.basename, self.action)
+            return _replay(record, request_hash)
+
+    return wrapper
+
+
+def purge_expired_keys(now=None):
+    """Delete stored responses past their expiry and return how many were removed"""
+    deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+    return deleted
@@ -0,0 +1,238 @@
+"""
+Stock checks for whole baskets of order lines.
+
+Demand is aggregated across every line before comparing it with stock, so two
+drinks that share milk are checked against the same milk, and a basket costs
+the same handful of queries however many lines it has.
+"""
+from collections import defaultdict
+from decimal import Decimal
+from products.models import Product
+from products.recipes import load_product_recipes
+from ingredient_inventory.models import Ingredient
+from .models import StockReservation
+
+
+# Guards against float error turning e.g. 4.9999999 possible units into 4
+ROUNDING_TOLERANCE = 1e-9
+
+
+def lock_rows(model, pks):
+    """
+    Lock the given rows with SELECT ... FOR UPDATE and return them.
+
+    Every stock writer locks rows in the same canonical order (orders, then
+    ingredients, then products, each by ascending pk), so two transactions
+    can never wait on each other's locks in a cycle.
+    """
+    if not pks:
+        return []
+    return list(model.objects.select_for_update().filter(pk__in=set(pks)).order_by('pk'))
+
+
+class StockSnapshot:
+    """
+    Products, flattened recipes and free ingredient stock for a set of
+    products, loaded once and shared by every check on a basket. Stock
+    reserved by open orders is not free, except exclude_order's own (or
+    that of every order in exclude_orders). With lock=True the ingredient
+    and non-deductable product rows stay locked until the surrounding
+    transaction ends.
+    """
+
+    def __init__(self, product_ids, exclude_order=None, lock=False, exclude_orders=()):
+        product_ids = set(product_ids)
+        self.products = Product.objects.in_bulk(product_ids)
+        self.recipes = load_product_recipes(
+            [pk for pk, product in self.products.items() if product.deductable]
+        )
+        ingredient_ids = {ingredient_id for recipe in self.recipes.values() for ingredient_id in recipe}
+        if lock:
+            # Hold the stock rows until the transaction ends so the check and the
+            # write that follows it see the same stock
+            self.ingredients = {ingredient.pk: ingredient for ingredient in lock_rows(Ingredient, ingredient_ids)}
+            self.products.update(
+                (product.pk, product)
+                for product in lock_rows(Product, [pk for pk, product in self.products.items() if not product.deductable])
+            )
+        else:
+            self.ingredients = Ingredient.objects.in_bulk(ingredient_ids)
+
+        # Only stock not reserved by other orders is available
+        self.ingredient_stock = {pk: float(ingredient.free_stock) for pk, ingredient in self.ingredients.items()}
+        self.product_stock = {
+            pk: product.stock - product.reserved for pk, product in self.products.items() if not product.deductable
+        }
+        # Stock on hand, reserved or not, for sales that already happened (see sell)
+        self.ingredient_on_hand = {pk: float(ingredient.stock) for pk, ingredient in self.ingredients.items()}
+        self.product_on_hand = {pk: product.stock for pk, product in self.products.items() if not product.deductable}
+        exclude_ids = [order.pk for order in exclude_orders if order.pk]
+        if exclude_order is not None and exclude_order.pk:
+            exclude_ids.append(exclude_order.pk)
+        if exclude_ids:
+            # The orders' own reservations are available to them
+            for ingredient_id, product_id, quantity in StockReservation.objects.filter(
+                order__in=exclude_ids
+            ).values_list('ingredient_id', 'product_id', 'quantity'):
+                if ingredient_id in self.ingredient_stock:
+                    self.ingredient_stock[ingredient_id] += float(quantity)
+                elif product_id in self.product_stock:
+                    self.product_stock[product_id] += int(quantity)
+
+    def demand(self, lines):
+        """
+        Aggregate [(product_id, quantity)] into total ingredient demand
+        {ingredient_id: amount} and non-deductable product demand {product_id: units}
+        """
+        ingredient_demand = defaultdict(float)
+        product_demand = defaultdict(int)
+        for product_id, quantity in lines:
+            product = self.products[product_id]
+            if product.deductable:
+                for ingredient_id, amount in self.recipes.get(product_id, {}).items():
+                    ingredient_demand[ingredient_id] += amount * quantity
+            else:
+                product_demand[product_id] += quantity
+        return ingredient_demand, product_demand
+
+    def max_quantity(self, product_id, ingredient_demand=None, product_demand=None):
+        """Most units of a product that fit in stock on top of the given demand"""
+        product = self.products[product_id]
+        if not product.deductable:
+            used = (product_demand or {}).get(product_id, 0)
+            return max(0, self.product_stock[product_id] - used)
+
+        recipe = self.recipes.get(product_id)
+        if not recipe:
+            return 0
+        ingredient_demand = ingredient_demand or {}
+        possible = min(
+            (self.ingredient_stock[ingredient_id] - ingredient_demand.get(ingredient_id, 0)) / amount
+            for ingredient_id, amount in recipe.items()
+        )
+        return max(0, int(possible + ROUNDING_TOLERANCE))
+
+    def line_limits(self, lines):
+        """
+        For each (product_id, quantity) line, the most units that still fit when
+        every other line takes its share of shared ingredients and products
+        """
+        ingredient_demand, product_demand = self.demand(lines)
+        limits = []
+        for product_id, quantity in lines:
+            # Demand of every other line = total demand minus this line's share
+            own_ingredients, own_products = self.demand([(product_id, quantity)])
+            other_ingredients = {pk: amount - own_ingredients.get(pk, 0) for pk, amount in ingredient_demand.items()}
+            other_products = {pk: units - own_products.get(pk, 0) for pk, units in product_demand.items()}
+            limits.append(self.max_quantity(product_id, other_ingredients, other_products))
+        return limits
+
+    def consume(self, ingredient_demand, product_demand):
+        """Take demand out of the available stock, e.g. once an order in a batch is accepted"""
+        for ingredient_id, amount in ingredient_demand.items():
+            self.ingredient_stock[ingredient_id] -= amount
+        for product_id, units in product_demand.items():
+            self.product_stock[product_id] -= units
+
+    def sell(self, ingredient_demand, product_demand):
+        """
+        Take a sale that already happened out of the stock on hand, stopping at
+        zero like stock.DEDUCT_AVAILABLE. Returns (shortages, reserved_used):
+        the demand the stock on hand didn't cover, shaped like shortages(), and
+        the stock held for open orders that the sale used up.
+        """
+        shortages = []
+        reserved_used = []
+        for ingredient_id, required in ingredient_demand.items():
+            ingredient = self.ingredients[ingredient_id]
+            on_hand = self.ingredient_on_hand[ingredient_id]
+            taken = min(required, max(on_hand, 0))
+            if required > on_hand + ROUNDING_TOLERANCE:
+                shortages.append({
+                    'ingredient': ingredient.name,
+                    'unit': ingredient.unit,
+                    'required': round(required, 4),
+                    'available': round(on_hand, 4),
+                })
+            used = taken - max(self.ingredient_stock[ingredient_id], 0)
+            if used > ROUNDING_TOLERANCE:
+                reserved_used.append({'ingredient': ingredient.name, 'unit': ingredient.unit, 'used': round(used, 4)})
+            self.ingredient_on_hand[ingredient_id] -= taken
+            self.ingredient_stock[ingredient_id] -= taken
+        for product_id, required in product_demand.items():
+            on_hand = self.product_on_hand[product_id]
+            taken = min(required, max(on_hand, 0))
+            if required > on_hand:
+                shortages.append({
+                    'product': self.products[product_id].name,
+                    'required': required,
+                    'available': on_hand,
+                })
+            used = taken - max(self.product_stock[product_id], 0)
+            if used > 0:
+                reserved_used.append({'product': self.products[product_id].name, 'used': used})
+            self.product_on_hand[product_id] -= taken
+            self.product_stock[product_id] -= taken
+        return shortages, reserved_used
+
+    def shortages(self, ingredient_demand, product_demand):
+        """Ingredients and products whose total demand exceeds stock"""
+        shortages = []
+        for ingredient_id, required in ingredient_demand.items():
+            available = self.ingredient_stock[ingredient_id]
+            if required > available + ROUNDING_TOLERANCE:
+                ingredient = self.ingredients[ingredient_id]
+                shortages.append({
+                    'ingredient': ingredient.name,
+                    'unit': ingredient.unit,
+                    'required': round(required, 4),
+                    'available': round(max(available, 0), 4),
+                })
+        for product_id, required in product_demand.items():
+            available = self.product_stock[product_id]
+            if required > available:
+                shortages.append({
+                    'product': self.products[product_id].name,
+                    'required': required,
+                    'available': max(available, 0),
+                })
+        return shortages
+
+
+def quote_cart(lines):
+    """
+    Price and check a whole cart of [(product_id, quantity)] in one pass.
+
+    Each line reports its max_quantity: the most units that still fit when
+    every other line in the cart takes its share of the shared ingredients.
+    """
+    snapshot = StockSnapshot(product_id for product_id, _ in lines)
+    missing = [product_id for product_id, _ in lines if product_id not in snapshot.products]
+    if missing:
+        raise Product.DoesNotExist(f"Product with ID {missing[0]} not found.")
+
+    ingredient_demand, product_demand = snapshot.demand(lines)
+
+    quoted_lines = []
+    total = Decimal('0')
+    for (product_id, quantity), max_quantity in zip(lines, snapshot.line_limits(lines)):
+        product = snapshot.products[product_id]
+        line_total = product.price * quantity
+        total += line_total
+        quoted_lines.append({
+            'product': product_id,
+            'product_name': product.name,
+            'quantity': quantity,
+            'price': str(product.price),
+            'line_total': str(line_total),
+            'max_quantity': max_quantity,
+            'feasible': quantity <= max_quantity,
+        })
+
+    shortages = snapshot.shortages(ingredient_demand, product_demand)
+    return {
+        'items': quoted_lines,
+        'total_price': str(total),
+        'feasible': not shortages,
+        'shortages': shortages,
+    }
@@ -0,0 +1,130 @@
+"""
+How long orders spend in each status.
+
+Every status change adds how long the order had the status it is leaving:
+Order.pending_seconds is the wait before it was started (or completed or
+cancelled straight away) and Order.processing_seconds is the time it took to
+make, each summed over the times an order put back to pending spent there. Order.status_changed_at marks when the current status
+began, so the next change can work out its stage from the order row alone,
+without reading OrderStatusHistory. The durations are archived with the
+order.
+
+lifecycle_stats reads the durations of the completed orders in a date range
+with one query per table (live, and archive if needed) and works out the
+percentiles in Python, overall and per hour of the day, product and the
+person who completed the order.
+"""
+from collections import defaultdict
+from math import floor
+
+from django.utils import timezone
+
+from .history import OrderHistory
+
+# The field each stage's duration is kept in
+STAGE_FIELDS = {
+    'pending': 'pending_seconds',
+    'processing': 'processing_seconds',
+}
+# The fields record_transition changes
+LIFECYCLE_FIELDS = ['status', 'status_changed_at', 'pending_seconds', 'processing_seconds', 'completed_by']
+PERCENTILES = (50, 90, 95)
+
+
+def record_transition(order, new_status, changed_by=None, now=None):
+    """
+    Move an order in memory to new_status at `now`, adding how long it had
+    its current status to that stage. The caller saves LIFECYCLE_FIELDS.
+    """
+    now = now or timezone.now()
+    field = STAGE_FIELDS.get(order.status)
+    if field:
+        started = order.status_changed_at or order.ordered_at
+        setattr(order, field, (getattr(order, field) or 0.0) + max(0.0, (now - started).total_seconds()))
+    if new_status == 'completed':
+        order.completed_by = changed_by
+    order.status = new_status
+    order.status_changed_at = now
+
+
+def percentile(values, percent):
+    """The percent-th percentile of sorted values, interpolating between the closest ranks"""
+    position = (len(values) - 1) * percent / 100
+    lower = floor(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def summarize(values):
+    """{'count': n, 'p50': ..., 'p90': ..., 'p95': ...} of a list of durations in seconds"""
+    values = sorted(values)
+    summary = {'count': len(values)}
+    for percent in PERCENTILES:
+        summary[f'p{percent}'] = round(percentile(values, percent), 1) if values else None
+    return summary
+
+
+class _Stages:
+    """Durations of each stage collected for one group of orders"""
+
+    def __init__(self):
+        self.orders = 0
+        self.durations = {stage: [] for stage in STAGE_FIELDS}
+
+    def add(self, durations):
+        self.orders += 1
+        for stage, seconds in durations.items():
+            if seconds is not None:
+                self.durations[stage].append(seconds)
+
+    def summary(self):
+        return {'orders': self.orders, **{stage: summarize(values) for stage, values in self.durations.items()}}
+
+
+def lifecycle_stats(start=None, end=None):
+    """
+    Percentile stage durations of the orders completed among those placed in
+    [start, end), overall and grouped by local hour placed, product and
+    completed_by. An order counts once in each product it contains.
+    """
+    overall = _Stages()
+    by_hour = defaultdict(_Stages)
+    by_product = defaultdict(_Stages)
+    by_staff = defaultdict(_Stages)
+    product_names = {}
+    seen_orders = set()
+    seen_lines = set()
+
+    for queryset in OrderHistory(start, end, statuses=['completed']).items():
+        rows = queryset.values_list(
+            'order_id', 'product_id', 'product__name', 'order__ordered_at', 'order__completed_by',
+            'order__pending_seconds', 'order__processing_seconds',
+        ).order_by()
+        for order_id, product_id, product_name, ordered_at, completed_by, pending, processing in rows:
+            durations = {'pending': pending, 'processing': processing}
+            if (order_id, product_id) not in seen_lines:
+                seen_lines.add((order_id, product_id))
+                by_product[product_id].add(durations)
+                product_names[product_id] = product_name
+            # The rest is per order, not per item
+            if order_id in seen_orders:
+                continue
+            seen_orders.add(order_id)
+            overall.add(durations)
+            by_hour[timezone.localtime(ordered_at).hour].add(durations)
+            by_staff[completed_by].add(durations)
+
+    return {
+        'overall': overall.summary(),
+        'by_hour': [{'hour': hour, **by_hour[hour].summary()} for hour in sorted(by_hour)],
+        'by_product': sorted(
+            ({'id': product_id, 'name': product_names[product_id], **stages.summary()}
+             for product_id, stages in by_product.items()),
+            key=lambda group: group['orders'],
+            reverse=True,
+        ),
+        'by_completed_by': sorted(
+            ({'completed_by': name, **stages.summary()} for name, stages in by_staff.items()),
+            key=lambda group: group['completed_by'] or '',
+        ),
+    }
@@ -0,0 +1,22 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from orders.archive import BATCH_SIZE, archive_cutoff, archive_orders
+
+
+class Command(BaseCommand):
+    help = 'Move completed and cancelled orders older than ORDER_ARCHIVE_AFTER_DAYS to the archive tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='Archive closed orders older than this many days instead')
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Orders moved per transaction')
+
+    def handle(self, *args, **options):
+        if options['days'] is not None:
+            before = timezone.now() - timedelta(days=options['days'])
+        else:
+            before = archive_cutoff()
+
+        archived = archive_orders(before, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} orders placed before {before:%Y-%m-%d %H:%M}.'))
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from orders.models import Order
+from orders.totals import reconcile_order_totals
+
+
+class Command(BaseCommand):
+    help = 'Find orders whose stored total does not match the sum of their items and fix them'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report drifted orders')
+        parser.add_argument('--status', help='Only check orders with this status')
+
+    def handle(self, *args, **options):
+        queryset = Order.objects.all()
+        if options['status']:
+            queryset = queryset.filter(status=options['status'])
+
+        drifted = reconcile_order_totals(queryset, dry_run=options['dry_run'])
+        for _, order_id, stored, expected in drifted:
+            self.stdout.write(f'{order_id}: stored {stored}, expected {expected}')
+
+        verb = 'Found' if options['dry_run'] else 'Fixed'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {len(drifted)} orders with drifted totals.'))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from orders.reservations import release_expired_reservations, recalculate_reserved, oversold_reservations
+
+
+class Command(BaseCommand):
+    help = 'Release stock reservations of pending orders that are past their expiry'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--recalculate', action='store_true',
+            help='Also rebuild the reserved totals of ingredients and products from the reservation rows',
+        )
+
+    def handle(self, *args, **options):
+        released = release_expired_reservations()
+        self.stdout.write(self.style.SUCCESS(f'Released expired reservations of {released} orders.'))
+
+        if options['recalculate']:
+            corrections = recalculate_reserved()
+            for model, deltas in corrections.items():
+                self.stdout.write(f'Corrected reserved totals of {len(deltas)} {model} rows.')
+            for model, amounts in oversold_reservations().items():
+                if amounts:
+                    self.stdout.write(self.style.WARNING(
+                        f'{len(amounts)} {model} rows have less stock than open orders reserved: {amounts}'
+                    ))
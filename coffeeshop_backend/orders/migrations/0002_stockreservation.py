@@ -0,0 +1,28 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:21
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingredient_inventory', '0002_ingredient_reserved'),
+        ('orders', '0001_initial'),
+        ('products', '0007_product_reserved'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StockReservation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=3, max_digits=12)),
+                ('expires_at', models.DateTimeField(blank=True, db_index=True, help_text='Released automatically after this time; empty while the order is being made', null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('ingredient', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='ingredient_inventory.ingredient')),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='orders.order')),
+                ('product', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='reservations', to='products.product')),
+            ],
+        ),
+    ]
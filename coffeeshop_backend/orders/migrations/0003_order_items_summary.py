@@ -0,0 +1,35 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:26
+
+from itertools import groupby
+
+from django.db import migrations, models
+
+
+def fill_items_summaries(apps, schema_editor):
+    from orders.models import summarize_items
+
+    Order = apps.get_model('orders', 'Order')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+    rows = OrderItem.objects.order_by('order_id', 'pk').values_list('order_id', 'product__name', 'quantity')
+    # order_id is passed so its default (generate_order_id) isn't called; only items_summary is saved
+    orders = [
+        Order(pk=order_id, order_id='', items_summary=summarize_items([(name, quantity) for _, name, quantity in lines]))
+        for order_id, lines in groupby(rows, key=lambda row: row[0])
+    ]
+    Order.objects.bulk_update(orders, ['items_summary'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0002_stockreservation'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='order',
+            name='items_summary',
+            field=models.CharField(default='No items', editable=False, help_text='Kept up to date when items change, see summarize_items', max_length=255),
+        ),
+        migrations.RunPython(fill_items_summaries, migrations.RunPython.noop),
+    ]
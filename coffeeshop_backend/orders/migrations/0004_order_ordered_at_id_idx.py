@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0003_order_items_summary'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='order',
+            index=models.Index(fields=['ordered_at', 'id'], name='order_ordered_at_id_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:36
+
+import orders.models
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0005_idempotencykey'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OrderIdCounter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('prefix', models.CharField(max_length=16, unique=True)),
+                ('last_value', models.PositiveBigIntegerField(default=0)),
+            ],
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='order_id',
+            field=models.CharField(default=orders.models.generate_order_id, max_length=20, unique=True),
+        ),
+    ]
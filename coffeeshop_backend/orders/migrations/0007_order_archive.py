@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:39
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0006_order_id_counter'),
+        ('products', '0007_product_reserved'),
+        ('users', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedOrder',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('month', models.PositiveIntegerField(help_text='UTC year and month the order was placed, e.g. 202610')),
+                ('order_id', models.CharField(max_length=20, unique=True)),
+                ('customer_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('total_price', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('ordered_at', models.DateTimeField()),
+                ('items_summary', models.CharField(default='No items', max_length=255)),
+                ('customer', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='archived_orders', to='users.customer')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderItem',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('month', models.PositiveIntegerField(help_text="Same as the order's month")),
+                ('quantity', models.PositiveIntegerField()),
+                ('price', models.DecimalField(decimal_places=2, max_digits=8)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='items', to='orders.archivedorder')),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='archived_order_items', to='products.product')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='ArchivedOrderStatusHistory',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('month', models.PositiveIntegerField(help_text="Same as the order's month")),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processing', 'Processing'), ('completed', 'Completed'), ('cancelled', 'Cancelled')], max_length=20)),
+                ('changed_at', models.DateTimeField()),
+                ('changed_by', models.CharField(blank=True, max_length=100, null=True)),
+                ('order', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='status_history', to='orders.archivedorder')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='archivedorder',
+            index=models.Index(fields=['month', 'ordered_at'], name='archived_order_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorderitem',
+            index=models.Index(fields=['month', 'product'], name='archived_item_month_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='archivedorderstatushistory',
+            index=models.Index(fields=['month', 'changed_at'], name='archived_history_month_idx'),
+        ),
+    ]
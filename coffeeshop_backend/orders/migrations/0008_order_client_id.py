@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:42
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0007_order_archive'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='client_id',
+            field=models.CharField(blank=True, db_index=True, max_length=64, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='client_id',
+            field=models.CharField(blank=True, help_text='ID the POS gave an order placed offline, see orders/sync.py', max_length=64, null=True, unique=True),
+        ),
+        migrations.AlterField(
+            model_name='order',
+            name='ordered_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+    ]
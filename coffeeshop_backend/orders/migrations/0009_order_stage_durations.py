@@ -0,0 +1,78 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:52
+
+from itertools import groupby
+
+from django.db import migrations, models
+
+
+def fill_stage_durations(apps, schema_editor):
+    from orders.lifecycle import record_transition
+
+    for model_name, history_name, fields in (
+        ('Order', 'OrderStatusHistory', ['status_changed_at', 'pending_seconds', 'processing_seconds', 'completed_by']),
+        ('ArchivedOrder', 'ArchivedOrderStatusHistory', ['pending_seconds', 'processing_seconds', 'completed_by']),
+    ):
+        Order = apps.get_model('orders', model_name)
+        History = apps.get_model('orders', history_name)
+        rows = History.objects.order_by('order_id', 'changed_at', 'pk').values_list(
+            'order_id', 'order__ordered_at', 'status', 'changed_at', 'changed_by'
+        )
+        orders = []
+        for order_id, entries in groupby(rows, key=lambda row: row[0]):
+            # Replay the recorded changes, starting from pending when the order was placed
+            order = None
+            for _, ordered_at, status, changed_at, changed_by in entries:
+                if order is None:
+                    # order_id is passed so its default doesn't claim an ID block; only fields are saved
+                    order = Order(pk=order_id, order_id='', status='pending', ordered_at=ordered_at)
+                    order.status_changed_at = None
+                if status != order.status:
+                    record_transition(order, status, changed_by, changed_at)
+            orders.append(order)
+        Order.objects.bulk_update(orders, fields, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0008_order_client_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='completed_by',
+            field=models.CharField(blank=True, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='pending_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='archivedorder',
+            name='processing_seconds',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='completed_by',
+            field=models.CharField(blank=True, editable=False, max_length=100, null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='pending_seconds',
+            field=models.FloatField(blank=True, editable=False, help_text='How long the order waited before it was started, completed or cancelled', null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='processing_seconds',
+            field=models.FloatField(blank=True, editable=False, help_text='How long the order took to make once started', null=True),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='status_changed_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the order entered its current status; empty if it still has the status it was placed with', null=True),
+        ),
+        migrations.RunPython(fill_stage_durations, migrations.RunPython.noop),
+    ]
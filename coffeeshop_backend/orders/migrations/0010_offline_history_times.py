@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 08:04
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('orders', '0009_order_stage_durations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='archivedorder',
+            name='stock_shortfall',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.AddField(
+            model_name='order',
+            name='stock_shortfall',
+            field=models.BooleanField(default=False, editable=False, help_text='Completed offline without the recorded stock to cover it; its stock was used down to zero, see orders/sync.py'),
+        ),
+        migrations.AlterField(
+            model_name='orderstatushistory',
+            name='changed_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
@@ -1,13 +1,27 @@
 from django.db import models
+from django.db.models import F, Sum, Subquery, OuterRef, Value, DecimalField
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from products.models import Product
+from ingredient_inventory.models import Ingredient
 from users.models import Customer
-import uuid
 from decimal import Decimal
 
 
 def generate_order_id():
-    """Generate a unique order ID"""
-    return str(uuid.uuid4()).split('-')[0].upper()
+    """Generate a unique order ID, e.g. 261017-00A3 (see orders/order_ids.py)"""
+    from .order_ids import next_order_id
+    return next_order_id()
+
+
+def summarize_items(lines):
+    """Short description of an order's items for tables, from [(product_name, quantity)] in item order"""
+    if not lines:
+        return "No items"
+    name, quantity = lines[0]
+    if len(lines) == 1:
+        return f"{quantity}x {name}"
+    return f"{name} + {len(lines) - 1} more"
     
     
 class Order(models.Model):
@@ -17,24 +31,57 @@ class Order(models.Model):
         ("completed", "Completed"),
         ("cancelled", "Cancelled"),
     ]
-    order_id = models.CharField(max_length=10, unique=True, default=generate_order_id)
+    order_id = models.CharField(max_length=20, unique=True, default=generate_order_id)
     customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True)
     customer_name = models.CharField(max_length=100, null=True, blank=True, help_text="Name for guest customers or override")
     total_price = models.DecimalField(max_digits=10, decimal_places=2, default=0)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
-    ordered_at = models.DateTimeField(auto_now_add=True)
+    ordered_at = models.DateTimeField(default=timezone.now)
+    items_summary = models.CharField(max_length=255, default="No items", editable=False, help_text="Kept up to date when items change, see summarize_items")
+    client_id = models.CharField(max_length=64, unique=True, null=True, blank=True, help_text="ID the POS gave an order placed offline, see orders/sync.py")
+    # Stage durations, kept up to date by each status change, see orders/lifecycle.py
+    status_changed_at = models.DateTimeField(null=True, blank=True, editable=False, help_text="When the order entered its current status; empty if it still has the status it was placed with")
+    pending_seconds = models.FloatField(null=True, blank=True, editable=False, help_text="How long the order waited before it was started, completed or cancelled")
+    processing_seconds = models.FloatField(null=True, blank=True, editable=False, help_text="How long the order took to make once started")
+    completed_by = models.CharField(max_length=100, null=True, blank=True, editable=False)
+    stock_shortfall = models.BooleanField(default=False, editable=False, help_text="Completed offline without the recorded stock to cover it; its stock was used down to zero, see orders/sync.py")
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of the orders list, see orders/pagination.py
+            models.Index(fields=['ordered_at', 'id'], name='order_ordered_at_id_idx'),
+        ]
 
     def update_total_price(self):
-        """Calculate the total price based on all items"""
-        total = Decimal('0')
-        for item in self.items.all():
-            total += item.item_total
-        self.total_price = total
-        self.save()
+        """Recalculate the total price from all items in a single UPDATE"""
+        Order.objects.filter(pk=self.pk).update(total_price=items_total_subquery())
+        self.refresh_from_db(fields=['total_price'])
+
+    @classmethod
+    def add_to_total(cls, order_id, amount):
+        """Atomically add amount (may be negative) to an order's stored total"""
+        if amount:
+            cls.objects.filter(pk=order_id).update(total_price=F('total_price') + amount)
+
+    @classmethod
+    def refresh_items_summary(cls, order_id):
+        """Rebuild the stored items_summary of an order from its items"""
+        lines = list(
+            OrderItem.objects.filter(order_id=order_id).order_by('pk').values_list('product__name', 'quantity')
+        )
+        cls.objects.filter(pk=order_id).update(items_summary=summarize_items(lines))
 
     def __str__(self):
         return f"Order #{self.order_id} - {self.customer.name if self.customer else 'Guest'}"
 
+class OrderIdCounter(models.Model):
+    """Last order ID counter value handed out in a block for one day, see orders/order_ids.py"""
+    prefix = models.CharField(max_length=16, unique=True)
+    last_value = models.PositiveBigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.prefix}: {self.last_value}"
+
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, related_name='items', on_delete=models.CASCADE)
     product = models.ForeignKey(Product, on_delete=models.CASCADE)
@@ -45,6 +92,14 @@ class OrderItem(models.Model):
     def item_total(self):
         return self.price * self.quantity
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # Remember what this row contributed to its order's total when loaded
+        if 'order_id' in instance.__dict__ and 'price' in instance.__dict__ and 'quantity' in instance.__dict__:
+            instance._saved_contribution = (instance.order_id, instance.item_total)
+        return instance
+    
     def save(self, *args, **kwargs):
         # Set price from product if not already set
         if not self.price and self.product:
@@ -53,8 +108,16 @@ class OrderItem(models.Model):
         # Save the item
         super().save(*args, **kwargs)
         
-        # Update order total price
-        self.order.update_total_price()
+        # Apply only the change in this item's total to the order, at the database,
+        # so concurrent edits to other items of the same order don't overwrite each other
+        old_order_id, old_total = getattr(self, '_saved_contribution', (None, Decimal('0')))
+        if old_order_id is not None and old_order_id != self.order_id:
+            Order.add_to_total(old_order_id, -old_total)
+            Order.refresh_items_summary(old_order_id)
+            old_total = Decimal('0')
+        Order.add_to_total(self.order_id, self.item_total - old_total)
+        self._saved_contribution = (self.order_id, self.item_total)
+        Order.refresh_items_summary(self.order_id)
         
     def __str__(self):
         return f"{self.quantity} x {self.product.name} in Order #{self.order.order_id}"
@@ -63,8 +126,125 @@ class OrderItem(models.Model):
 class OrderStatusHistory(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name="status_history")
     status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
-    changed_at = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add, so orders synced from offline keep the POS's times
+    changed_at = models.DateTimeField(default=timezone.now, editable=False)
     changed_by = models.CharField(max_length=100, blank=True, null=True)  # Optionally link to user if you want
 
     def __str__(self):
-        return f"Order {self.order.order_id} changed to {self.status} at {self.changed_at}"
\ No newline at end of file
+        return f"Order {self.order.order_id} changed to {self.status} at {self.changed_at}"
+
+
+
+class StockReservation(models.Model):
+    """
+    Stock held for an order between placing it and completing or cancelling it.
+    Each row holds an amount of one ingredient (in the ingredient's unit) or a
+    number of units of one non-deductable product. The live totals are kept in
+    Ingredient.reserved and Product.reserved, see orders/reservations.py.
+    """
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='reservations')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, null=True, blank=True, related_name='reservations')
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, null=True, blank=True, related_name='reservations')
+    quantity = models.DecimalField(max_digits=12, decimal_places=3)
+    expires_at = models.DateTimeField(null=True, blank=True, db_index=True, help_text="Released automatically after this time; empty while the order is being made")
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        target = self.ingredient or self.product
+        return f"{self.quantity} of {target} for Order #{self.order.order_id}"
+
+
+class IdempotencyKey(models.Model):
+    """
+    The stored response to a request sent with an Idempotency-Key header, so
+    a retry of the same request gets the same response without running it
+    again. See orders/idempotency.py.
+    """
+    key = models.CharField(max_length=64, unique=True, help_text="SHA-256 of the client's key and the endpoint it was used on")
+    request_hash = models.CharField(max_length=64, help_text="SHA-256 of the method, path and body of the first request")
+    status_code = models.PositiveSmallIntegerField()
+    response = models.JSONField(null=True, blank=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+    def __str__(self):
+        return f"{self.key[:12]}... ({self.status_code}, expires {self.expires_at})"
+
+
+class ArchivedOrder(models.Model):
+    """
+    A closed order moved out of Order by orders/archive.py, keeping its id.
+    The archive tables are keyed by month, the UTC year and month the order
+    was placed (e.g. 202610), which leads every archive index so reads and
+    clean-ups touch only the months they need. Read them through
+    orders.history.OrderHistory rather than directly.
+    """
+    id = models.BigIntegerField(primary_key=True)
+    month = models.PositiveIntegerField(help_text="UTC year and month the order was placed, e.g. 202610")
+    order_id = models.CharField(max_length=20, unique=True)
+    customer = models.ForeignKey(Customer, on_delete=models.SET_NULL, null=True, blank=True, related_name='archived_orders')
+    customer_name = models.CharField(max_length=100, null=True, blank=True)
+    total_price = models.DecimalField(max_digits=10, decimal_places=2)
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    ordered_at = models.DateTimeField()
+    items_summary = models.CharField(max_length=255, default="No items")
+    client_id = models.CharField(max_length=64, null=True, blank=True, db_index=True)
+    pending_seconds = models.FloatField(null=True, blank=True)
+    processing_seconds = models.FloatField(null=True, blank=True)
+    completed_by = models.CharField(max_length=100, null=True, blank=True)
+    stock_shortfall = models.BooleanField(default=False)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['month', 'ordered_at'], name='archived_order_month_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order #{self.order_id}"
+
+class ArchivedOrderItem(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    month = models.PositiveIntegerField(help_text="Same as the order's month")
+    order = models.ForeignKey(ArchivedOrder, related_name='items', on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='archived_order_items')
+    quantity = models.PositiveIntegerField()
+    price = models.DecimalField(max_digits=8, decimal_places=2)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['month', 'product'], name='archived_item_month_idx'),
+        ]
+
+    @property
+    def item_total(self):
+        return self.price * self.quantity
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_id} in archived order {self.order_id}"
+
+class ArchivedOrderStatusHistory(models.Model):
+    id = models.BigIntegerField(primary_key=True)
+    month = models.PositiveIntegerField(help_text="Same as the order's month")
+    order = models.ForeignKey(ArchivedOrder, on_delete=models.CASCADE, related_name="status_history")
+    status = models.CharField(max_length=20, choices=Order.STATUS_CHOICES)
+    changed_at = models.DateTimeField()
+    changed_by = models.CharField(max_length=100, blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['month', 'changed_at'], name='archived_history_month_idx'),
+        ]
+
+    def __str__(self):
+        return f"Archived order {self.order_id} changed to {self.status} at {self.changed_at}"
+
+
+def items_total_subquery():
+    """Sum of item totals for the order in the outer query, 0 when it has no items"""
+    totals = OrderItem.objects.filter(order=OuterRef('pk')).order_by().values('order').annotate(
+        total=Sum(F('price') * F('quantity'))
+    ).values('total')
+    return Coalesce(
+        Subquery(totals, output_field=DecimalField(max_digits=10, decimal_places=2)),
+        Value(Decimal('0')),
+        output_field=DecimalField(max_digits=10, decimal_places=2),
+    )
@@ -0,0 +1,134 @@
+"""
+Short, unique, human readable order IDs.
+
+IDs look like 261017-00A3: the local date plus a per-day counter in base 36.
+Each worker thread takes a block of ORDER_ID_BLOCK_SIZE counter values at a
+time from that day's OrderIdCounter row, using one conditional UPDATE, and
+hands IDs out of the block from memory. The counter row is touched once per
+block rather than once per order, and blocks never overlap, so IDs are
+unique without retries. Values left in a block when a worker exits are
+skipped, which is harmless.
+
+A claim commits on its own. When an ID is needed inside a transaction (an
+order being created), the block is claimed on a second connection, so the
+counter row is locked for the claim only and not until the order commits.
+SQLite allows one writer at a time, so a second connection would wait for
+the order's transaction; there the block is claimed inside it instead. A
+block claimed that way is rolled back with the transaction, and is thrown
+away as soon as that is noticed, because another worker could claim the
+same values again.
+"""
+import string
+import threading
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, IntegrityError, connections, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import OrderIdCounter
+
+DIGITS = string.digits + string.ascii_uppercase
+
+_local = threading.local()
+
+
+def block_size():
+    return max(1, getattr(settings, 'ORDER_ID_BLOCK_SIZE', 50))
+
+
+def to_base36(number):
+    digits = []
+    while True:
+        number, remainder = divmod(number, 36)
+        digits.append(DIGITS[remainder])
+        if not number:
+            return ''.join(reversed(digits))
+
+
+class _Block:
+    """Counter values [next + 1, end] of one day, claimed by this thread"""
+
+    def __init__(self, prefix, start, end):
+        self.prefix = prefix
+        self.next = start
+        self.end = end
+        self.confirmed = False
+
+    def confirm(self):
+        self.confirmed = True
+
+    def usable(self, prefix):
+        if self.prefix != prefix or self.next >= self.end:
+            return False
+        if self.confirmed:
+            return True
+        # Not committed yet: only usable inside the transaction that claimed it,
+        # which is the case while its confirm() is still waiting to run on commit
+        pending = connections[DEFAULT_DB_ALIAS].run_on_commit
+        return any(callback == self.confirm for _, callback, _ in pending)
+
+
+def _claim_separately(prefix, size):
+    """Claim size values on a connection of their own, committed at once. Returns the last value claimed."""
+    connection = connections.create_connection(DEFAULT_DB_ALIAS)
+    table = connection.ops.quote_name(OrderIdCounter._meta.db_table)
+    try:
+        while True:
+            end = None
+            connection.set_autocommit(False)
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"UPDATE {table} SET last_value = last_value + %s WHERE prefix = %s", [size, prefix])
+                    if cursor.rowcount:
+                        cursor.execute(f"SELECT last_value FROM {table} WHERE prefix = %s", [prefix])
+                        end = cursor.fetchone()[0]
+                connection.commit()
+            except Exception:
+                connection.rollback()
+                raise
+            finally:
+                connection.set_autocommit(True)
+            if end is not None:
+                return end
+            # First order of the day; a concurrent worker may create the row first
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute(f"INSERT INTO {table} (prefix, last_value) VALUES (%s, 0)", [prefix])
+            except IntegrityError:
+                pass
+    finally:
+        connection.close()
+
+
+def _claim_block(prefix):
+    size = block_size()
+    connection = connections[DEFAULT_DB_ALIAS]
+    if connection.in_atomic_block and connection.vendor != 'sqlite':
+        end = _claim_separately(prefix, size)
+        block = _Block(prefix, end - size, end)
+        # Already committed
+        block.confirm()
+        return block
+
+    with transaction.atomic():
+        counters = OrderIdCounter.objects.filter(prefix=prefix)
+        if not counters.update(last_value=F('last_value') + size):
+            # First order of the day; ignore_conflicts lets concurrent workers both create it
+            OrderIdCounter.objects.bulk_create([OrderIdCounter(prefix=prefix, last_value=0)], ignore_conflicts=True)
+            counters.update(last_value=F('last_value') + size)
+        end = counters.values_list('last_value', flat=True).get()
+    block = _Block(prefix, end - size, end)
+    # Runs at once outside a transaction, otherwise when the surrounding one commits
+    transaction.on_commit(block.confirm)
+    return block
+
+
+def next_order_id():
+    """Allocate the next order ID for this worker, e.g. '261017-00A3'"""
+    prefix = timezone.localdate().strftime('%y%m%d')
+    block = getattr(_local, 'block', None)
+    if block is None or not block.usable(prefix):
+        block = _local.block = _claim_block(prefix)
+    block.next += 1
+    return f"{prefix}-{to_base36(block.next).rjust(4, '0')}"
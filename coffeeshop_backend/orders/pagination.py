@@ -0,0 +1,153 @@
+"""
+Keyset (seek) pagination.
+
+A page is fetched with WHERE (a, b) < (last_a, last_b) ORDER BY a, b LIMIT n
+instead of OFFSET, so page 1000 costs the same as page 1 as long as an
+index covers the ordering. The cursor holds the ordering values of the
+edge row of the current page, which keeps pages stable while new orders
+are being added at the top.
+"""
+import base64
+import binascii
+import json
+from datetime import date, datetime
+from decimal import Decimal
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Paginate by the values of self.ordering, whose last field must be unique
+    (e.g. the pk). Responses look like {"next": url, "previous": url, "results": [...]}.
+    """
+    ordering = ('-id',)
+    page_size = 50
+    max_page_size = 200
+    page_size_query_param = 'page_size'
+    cursor_query_param = 'cursor'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.model = queryset.model
+        self.page_size = self.get_page_size(request)
+        cursor = self.decode_cursor(request)
+        reverse = bool(cursor and cursor['reverse'])
+
+        # Walking backwards flips the ordering, the rows are put back in order below
+        ordering = [self.flip(field) for field in self.ordering] if reverse else list(self.ordering)
+        if cursor:
+            queryset = queryset.filter(self.seek_filter(ordering, cursor['values']))
+        rows = list(queryset.order_by(*ordering)[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+
+        self.has_next = (cursor is not None) if reverse else has_more
+        self.has_previous = has_more if reverse else (cursor is not None)
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return min(max(size, 1), self.max_page_size)
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(self.rows[-1], reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous:
+            return None
+        if not self.rows:
+            # Walked past the end, the previous page is simply the first one
+            return remove_query_param(self.request.build_absolute_uri(), self.cursor_query_param)
+        return self.encode_cursor(self.rows[0], reverse=True)
+
+    @staticmethod
+    def flip(field):
+        return field[1:] if field.startswith('-') else f'-{field}'
+
+    @staticmethod
+    def seek_filter(ordering, values):
+        """Rows strictly after values in the given ordering: (a < x) OR (a = x AND b < y) ..."""
+        condition = Q()
+        equal = Q()
+        for field, value in zip(ordering, values):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    @staticmethod
+    def encode_value(value):
+        # Full precision: DjangoJSONEncoder cuts datetimes to milliseconds, which would repeat rows
+        if isinstance(value, (datetime, date)):
+            return value.isoformat()
+        if isinstance(value, Decimal):
+            return str(value)
+        raise TypeError(f"Can't put {type(value).__name__} in a cursor")
+
+    def encode_cursor(self, row, reverse):
+        values = [getattr(row, field.lstrip('-')) for field in self.ordering]
+        payload = json.dumps({'v': values, 'r': reverse}, default=self.encode_value, separators=(',', ':'))
+        cursor = base64.urlsafe_b64encode(payload.encode()).decode()
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def decode_cursor(self, request):
+        """{'values': [...], 'reverse': bool} from the request's cursor, or None on the first page"""
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            values = payload['v']
+            if len(values) != len(self.ordering):
+                raise ValueError
+            values = [
+                self.model._meta.get_field(field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+            return {'values': values, 'reverse': bool(payload.get('r'))}
+        except (binascii.Error, ValueError, TypeError, KeyError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class OrderPagination(KeysetPagination):
+    """Newest orders first, backed by the (ordered_at, id) index"""
+    ordering = ('-ordered_at', '-id')
+
+
+class OrderItemPagination(KeysetPagination):
+    ordering = ('id',)
+    page_size = 100
@@ -0,0 +1,266 @@
+"""
+Stock reservations for open orders.
+
+Placing or editing an order reserves the ingredient amounts (converted to each
+ingredient's unit) and non-deductable product units it needs, so other orders
+can't promise the same stock. Completing the order turns its reservation into
+a real deduction; cancelling it, or letting a pending order sit longer than
+ORDER_RESERVATION_TTL seconds, releases it.
+
+Each reservation is a StockReservation row, and the live total per ingredient
+or product is kept as a running aggregate in Ingredient.reserved and
+Product.reserved, so availability never has to sum reservation rows.
+
+Locking: writers lock the order row first, then ingredient rows and then
+product rows, each in pk order (see inventory.lock_rows). An order's
+reservation rows are only changed while holding its order row lock.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Case, When, Value, Sum, DecimalField, IntegerField
+from django.utils import timezone
+
+from coffeeshop_backend.log import get_logger
+from ingredient_inventory.models import Ingredient
+from products.models import Product
+from jobs.queue import enqueue
+from .models import Order, StockReservation
+from .inventory import StockSnapshot, lock_rows
+
+logger = get_logger(__name__)
+
+# Reservation rows store amounts with this precision
+QUANTUM = Decimal('0.001')
+
+# Orders that hold a reservation; only pending ones expire
+OPEN_STATUSES = ('pending', 'processing')
+
+
+class InsufficientStock(ValueError):
+    """Raised when an order needs more than the stock that isn't reserved by other orders"""
+
+    def __init__(self, issues):
+        self.issues = issues
+        super().__init__('; '.join(
+            f"{issue['product']}: Available {issue['available']}, Required {issue['required']} (shortage: {issue['shortage']})"
+            for issue in issues
+        ))
+
+
+def reservation_ttl():
+    return timedelta(seconds=getattr(settings, 'ORDER_RESERVATION_TTL', 3600))
+
+
+def _quantize(amount):
+    return Decimal(str(amount)).quantize(QUANTUM)
+
+
+def adjust_reserved(model, deltas):
+    """Add {pk: delta} to model.reserved for many rows in a single UPDATE"""
+    deltas = {pk: delta for pk, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    lock_rows(model, deltas)
+    output_field = IntegerField() if model is Product else DecimalField(max_digits=12, decimal_places=3)
+    model.objects.filter(pk__in=deltas).update(reserved=F('reserved') + Case(
+        *[When(pk=pk, then=Value(delta, output_field=output_field)) for pk, delta in deltas.items()],
+        default=Value(0, output_field=output_field),
+        output_field=output_field,
+    ))
+
+
+def order_lines(order):
+    """[(product_id, quantity)] for the items of an order"""
+    return list(order.items.values_list('product_id', 'quantity'))
+
+
+def check_order_stock(order, lines=None, snapshot=None):
+    """
+    Return the stock issues that would stop an order from being reserved or
+    completed: stock held by this order's own reservation counts as available.
+    Inside a transaction the stock rows stay locked for the write that follows.
+    """
+    lines = order_lines(order) if lines is None else lines
+    snapshot = snapshot or StockSnapshot((product_id for product_id, _ in lines), exclude_order=order, lock=True)
+    issues = []
+    for (product_id, quantity), available in zip(lines, snapshot.line_limits(lines)):
+        if available < quantity:
+            issues.append({
+                'product': snapshot.products[product_id].name,
+                'available': available,
+                'required': quantity,
+                'shortage': quantity - available,
+            })
+    return issues
+
+
+@transaction.atomic
+def reserve_order(order, lines=None, snapshot=None, expires=True):
+    """
+    Make the order's reservation match its current items, raising
+    InsufficientStock if they don't fit. Pass expires=False to hold the
+    stock until the order is completed or cancelled.
+    """
+    lock_rows(Order, [order.pk])
+    if snapshot is None:
+        release_expired_reservations()
+    lines = order_lines(order) if lines is None else lines
+    snapshot = snapshot or StockSnapshot((product_id for product_id, _ in lines), exclude_order=order, lock=True)
+    issues = check_order_stock(order, lines, snapshot)
+    if issues:
+        raise InsufficientStock(issues)
+
+    reserve_orders({order: lines}, snapshot, expires=expires)
+
+
+@transaction.atomic
+def reserve_orders(order_lines, snapshot, expires=True):
+    """
+    Make the reservations of several orders match {order: [(product_id, quantity)]}
+    with one delete, one insert and one UPDATE per table. The caller has
+    locked the orders and checked the lines against a locked snapshot that
+    counts their own reservations as available, e.g.
+    StockSnapshot(..., exclude_orders=orders, lock=True).
+    Pass expires=False to hold the stock until the orders are completed or cancelled.
+    """
+    expires_at = timezone.now() + reservation_ttl() if expires else None
+    # Start from giving back whatever the orders held before
+    held = StockReservation.objects.filter(order__in=list(order_lines))
+    ingredient_deltas, product_deltas = _release_deltas(held.values_list('ingredient_id', 'product_id', 'quantity'))
+    reservations = []
+    for order, lines in order_lines.items():
+        ingredient_demand, product_demand = snapshot.demand(lines)
+        for pk, amount in ingredient_demand.items():
+            if amount > 0:
+                amount = _quantize(amount)
+                reservations.append(StockReservation(order=order, ingredient_id=pk, quantity=amount, expires_at=expires_at))
+                ingredient_deltas[pk] += amount
+        for pk, units in product_demand.items():
+            if units > 0:
+                reservations.append(StockReservation(order=order, product_id=pk, quantity=Decimal(units), expires_at=expires_at))
+                product_deltas[pk] += units
+
+    held.delete()
+    StockReservation.objects.bulk_create(reservations)
+    adjust_reserved(Ingredient, ingredient_deltas)
+    adjust_reserved(Product, product_deltas)
+    _refresh(ingredient_deltas)
+
+
+def sync_reservation(order):
+    """Re-reserve for an open order whose items changed"""
+    if order.status in OPEN_STATUSES:
+        reserve_order(order, expires=order.status == 'pending')
+
+
+def release_order(order):
+    """Drop the order's reservation, e.g. when it's cancelled"""
+    release_orders([order])
+
+
+@transaction.atomic
+def release_orders(orders, refresh=True):
+    """
+    Drop the reservations of several orders and return the ids of the
+    ingredients they held. With refresh=False the caller refreshes product
+    availability for those ingredients itself.
+    """
+    order_ids = [getattr(order, 'pk', order) for order in orders]
+    lock_rows(Order, order_ids)
+    ingredient_deltas, product_deltas = _release_deltas(
+        StockReservation.objects.filter(order__in=order_ids).values_list('ingredient_id', 'product_id', 'quantity')
+    )
+    if not ingredient_deltas and not product_deltas:
+        return set()
+
+    StockReservation.objects.filter(order__in=order_ids).delete()
+    adjust_reserved(Ingredient, ingredient_deltas)
+    adjust_reserved(Product, product_deltas)
+    if refresh:
+        _refresh(ingredient_deltas)
+    return set(ingredient_deltas)
+
+
+@transaction.atomic
+def release_expired_reservations(now=None):
+    """Release every reservation past its expiry and return how many orders were affected"""
+    now = now or timezone.now()
+    order_ids = set(StockReservation.objects.filter(expires_at__lte=now).values_list('order_id', flat=True))
+    if not order_ids:
+        return 0
+
+    # Orders locked by another transaction are being edited or completed right
+    # now; skip them rather than wait, their reservations expire next time
+    order_ids = list(
+        Order.objects.select_for_update(skip_locked=True).filter(pk__in=order_ids).order_by('pk').values_list('pk', flat=True)
+    )
+    expired = StockReservation.objects.filter(order__in=order_ids, expires_at__lte=now)
+    ingredient_deltas, product_deltas = _release_deltas(expired.values_list('ingredient_id', 'product_id', 'quantity'))
+    if not ingredient_deltas and not product_deltas:
+        return 0
+
+    expired.delete()
+    adjust_reserved(Ingredient, ingredient_deltas)
+    adjust_reserved(Product, product_deltas)
+    _refresh(ingredient_deltas)
+
+    logger.info("Released expired reservations of %s orders", len(order_ids))
+    return len(order_ids)
+
+
+@transaction.atomic
+def recalculate_reserved():
+    """Rebuild Ingredient.reserved and Product.reserved from the reservation rows, returning the corrections"""
+    corrections = {}
+    for model, field in ((Ingredient, 'ingredient'), (Product, 'product')):
+        totals = dict(
+            StockReservation.objects.filter(**{f'{field}__isnull': False})
+            .values(field).annotate(total=Sum('quantity')).values_list(field, 'total')
+        )
+        if model is Product:
+            totals = {pk: int(total) for pk, total in totals.items()}
+        current = dict(model.objects.exclude(reserved=0).values_list('pk', 'reserved'))
+        deltas = {pk: totals.get(pk, 0) - current.get(pk, 0) for pk in set(totals) | set(current)}
+        deltas = {pk: delta for pk, delta in deltas.items() if delta}
+        adjust_reserved(model, deltas)
+        corrections[model.__name__] = deltas
+    _refresh(corrections['Ingredient'])
+    return corrections
+
+
+def oversold_reservations():
+    """
+    {model name: {pk: amount}} of the ingredients and products whose stock is
+    below what open orders have reserved, e.g. after an offline sale used
+    reserved stock (see orders/sync.py). Those orders can't all be completed
+    until the stock is topped up.
+    """
+    return {
+        model.__name__: {
+            pk: reserved - stock
+            for pk, reserved, stock in model.objects.filter(reserved__gt=F('stock')).values_list('pk', 'reserved', 'stock')
+        }
+        for model in (Ingredient, Product)
+    }
+
+
+def _release_deltas(rows):
+    """Negative {ingredient_id: amount} and {product_id: units} deltas for releasing reservation rows"""
+    ingredient_deltas = defaultdict(Decimal)
+    product_deltas = defaultdict(int)
+    for ingredient_id, product_id, quantity in rows:
+        if ingredient_id:
+            ingredient_deltas[ingredient_id] -= quantity
+        else:
+            product_deltas[product_id] -= int(quantity)
+    return ingredient_deltas, product_deltas
+
+
+def _refresh(ingredient_ids):
+    # Reserved amounts change free stock, and QuerySet.update skips the signals that would refresh it
+    if ingredient_ids:
+        enqueue('products.refresh_availability', ingredient_ids=sorted(ingredient_ids))
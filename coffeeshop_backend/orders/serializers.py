@@ -1,6 +1,11 @@
 from rest_framework import serializers
-from .models import Order, OrderStatusHistory, OrderItem
-from products.models import Product
+from django.db import transaction
+from decimal import Decimal
+from datetime import timedelta
+from django.utils import timezone
+from .models import Order, OrderStatusHistory, OrderItem, summarize_items
+from .inventory import StockSnapshot
+from .reservations import reserve_order, release_expired_reservations
 from users.models import Customer
 
 class OrderStatusHistorySerializer(serializers.ModelSerializer):
@@ -20,20 +25,13 @@ class OrderItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['price', 'item_total']
 
     def validate(self, data):
-        # Check if we have enough stock
-        product = data['product']
         quantity = data['quantity']
         
         if quantity <= 0:
             raise serializers.ValidationError({"quantity": "Quantity must be greater than zero."})
         
-        # Use available_stock for validation (handles both regular and ingredient-based products)
-        available = product.get_available_stock()
-        if available < quantity:
-            raise serializers.ValidationError({
-                "quantity": f"Not enough available. Only {available} {product.name} can be made with current ingredients."
-            })
-        
+        # Stock is checked when the view re-reserves the whole order (sync_reservation),
+        # which counts the order's own reservation as available
         return data
 
 class OrderSerializer(serializers.ModelSerializer):
@@ -52,9 +50,6 @@ class OrderSerializer(serializers.ModelSerializer):
     # Add item count for table display
     items_count = serializers.SerializerMethodField()
     
-    # Add summary of items for table display
-    items_summary = serializers.SerializerMethodField()
-    
     # For bulk creation of items during order creation
     order_items = serializers.ListField(
         child=serializers.DictField(),
@@ -63,33 +58,28 @@ class OrderSerializer(serializers.ModelSerializer):
     )
     
     def get_items_count(self, obj):
-        return obj.items.count()
-    
-    def get_items_summary(self, obj):
-        items = obj.items.all()
-        if not items:
-            return "No items"
-        
-        # If only one item, return its name and quantity
-        if items.count() == 1:
-            item = items[0]
-            return f"{item.quantity}x {item.product.name}"
-        
-        # Otherwise, return first item + count of others
-        return f"{items[0].product.name} + {items.count() - 1} more"
+        # len() uses the prefetched items instead of a COUNT query per order
+        return len(obj.items.all())
     
     class Meta:
         model = Order
         fields = [
             'id', 'order_id', 'customer_id', 'customer_name', 'total_price',
             'status', 'status_display', 'status_history', 'ordered_at', 'items', 'order_items',
-            'items_count', 'items_summary'
+            'items_count', 'items_summary', 'client_id', 'stock_shortfall'
         ]
-        read_only_fields = ['total_price', 'ordered_at', 'order_id', 'status_history']
+        read_only_fields = ['total_price', 'ordered_at', 'order_id', 'status_history', 'items_summary', 'stock_shortfall']
     
+    def validate_order_items(self, value):
+        lines = CartLineSerializer(data=value, many=True)
+        lines.is_valid(raise_exception=True)
+        return lines.validated_data
+    
+    @transaction.atomic
     def create(self, validated_data):
         # Extract and remove order_items data
         order_items_data = validated_data.pop('order_items', [])
+        lines = [(item['product'], item['quantity']) for item in order_items_data]
         
         # Handle customer name logic
         # If customer (FK) exists, use its name if customer_name not provided
@@ -97,42 +87,37 @@ class OrderSerializer(serializers.ModelSerializer):
         if customer and not validated_data.get('customer_name'):
             validated_data['customer_name'] = customer.name
         
-        # Create the order without items first
-        order = Order.objects.create(**validated_data)
-        
-        # Create order items and handle stock reductions
-        for item_data in order_items_data:
-            product_id = item_data.get('product')
-            quantity = item_data.get('quantity', 1)
-            
-            # Get the product instance
-            try:
-                product = Product.objects.get(pk=product_id)
-            except Product.DoesNotExist:
+        # Load every product and its free ingredient stock once for the whole order
+        release_expired_reservations()
+        snapshot = StockSnapshot((product_id for product_id, _ in lines), lock=True)
+        for product_id, _ in lines:
+            if product_id not in snapshot.products:
                 raise serializers.ValidationError({"product": f"Product with ID {product_id} not found."})
-            
-            # Check available stock (handles both regular and ingredient-based products)
-            available = product.get_available_stock()
+        
+        # Check all lines together so products sharing ingredients can't oversell them
+        for (product_id, quantity), available in zip(lines, snapshot.line_limits(lines)):
             if available < quantity:
+                product = snapshot.products[product_id]
                 raise serializers.ValidationError(
                     {"quantity": f"Not enough available for {product.name}. Only {available} can be made with current ingredients."}
                 )
-            
-            # Reduce stock only for non-deductable products
-            # (deductable products will have their ingredients deducted when order is completed)
-            if not product.deductable:
-                product.stock -= quantity
-                product.save()
-            
-            # Create order item
-            OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                price=product.price
-            )
         
-        # The order.update_total_price() will be called by the OrderItem.save() method
+        items = [
+            OrderItem(product=snapshot.products[product_id], quantity=quantity, price=snapshot.products[product_id].price)
+            for product_id, quantity in lines
+        ]
+        validated_data['total_price'] = sum((item.item_total for item in items), Decimal('0'))
+        validated_data['items_summary'] = summarize_items([(item.product.name, item.quantity) for item in items])
+        order = Order.objects.create(**validated_data)
+        
+        for item in items:
+            item.order = order
+        # bulk_create skips OrderItem.save, the total was computed once above
+        OrderItem.objects.bulk_create(items)
+        
+        # Hold the stock until the order is completed (deducted) or cancelled (released)
+        reserve_order(order, lines, snapshot)
+        
         return order
     
     def update(self, instance, validated_data):
@@ -142,6 +127,85 @@ class OrderSerializer(serializers.ModelSerializer):
         # Update basic order fields
         instance.customer = validated_data.get('customer', instance.customer)
         instance.status = validated_data.get('status', instance.status)
-        instance.save()
+        instance.save(update_fields=['customer', 'status'])
         
         return instance
+
+class OrderListSerializer(serializers.ModelSerializer):
+    """
+    Read-only table row for an order. items_count comes from a Count
+    annotation and items_summary is stored on the order, so listing orders
+    costs a single query however many there are.
+    """
+    status_display = serializers.CharField(source='get_status_display', read_only=True)
+    items_count = serializers.IntegerField(read_only=True)
+
+    class Meta:
+        model = Order
+        fields = [
+            'id', 'order_id', 'customer_name', 'total_price', 'status', 'status_display',
+            'ordered_at', 'items_count', 'items_summary'
+        ]
+        read_only_fields = fields
+
+class BulkStatusSerializer(serializers.Serializer):
+    # Largest batch accepted in one request
+    MAX_ORDERS = 200
+    
+    ids = serializers.ListField(child=serializers.IntegerField(), allow_empty=False, max_length=MAX_ORDERS)
+    status = serializers.ChoiceField(choices=Order.STATUS_CHOICES)
+
+class CartLineSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    quantity = serializers.IntegerField(min_value=1)
+
+class OfflineStatusChangeSerializer(serializers.Serializer):
+    status = serializers.ChoiceField(choices=['processing', 'completed'])
+    changed_at = serializers.DateTimeField()
+
+class OfflineOrderSerializer(serializers.Serializer):
+    # How far ahead of the server's clock a POS clock may run
+    CLOCK_SKEW = timedelta(minutes=5)
+    
+    client_id = serializers.CharField(max_length=64)
+    ordered_at = serializers.DateTimeField()
+    customer_name = serializers.CharField(max_length=100, required=False, allow_null=True, allow_blank=True)
+    status = serializers.ChoiceField(choices=['pending', 'completed'], default='pending')
+    order_items = CartLineSerializer(many=True, allow_empty=False)
+    # The status changes the POS made offline, oldest first, ending with status
+    status_history = OfflineStatusChangeSerializer(many=True, required=False)
+    
+    def validate_ordered_at(self, value):
+        if value > timezone.now() + self.CLOCK_SKEW:
+            raise serializers.ValidationError("Order time is in the future.")
+        return value
+    
+    def validate(self, data):
+        # transitions imports events, which imports this module
+        from .transitions import refusal
+        
+        history = data.get('status_history') or []
+        if history and history[-1]['status'] != data['status']:
+            raise serializers.ValidationError({"status_history": "The last status change must be to the order's status."})
+        
+        # Same rules as status changes made online, starting from pending when the order was taken
+        status, since = 'pending', data['ordered_at']
+        for change in history:
+            error = refusal(status, change['status'])
+            if error:
+                raise serializers.ValidationError({"status_history": error})
+            if change['changed_at'] < since or change['changed_at'] > timezone.now() + self.CLOCK_SKEW:
+                raise serializers.ValidationError(
+                    {"status_history": "Status changes must be in time order, between the order time and now."}
+                )
+            status, since = change['status'], change['changed_at']
+        return data
+
+class OrderSyncSerializer(serializers.Serializer):
+    # Largest offline queue accepted in one request
+    MAX_ORDERS = 500
+    
+    orders = OfflineOrderSerializer(many=True, allow_empty=False, max_length=MAX_ORDERS)
+
+class CartQuoteSerializer(serializers.Serializer):
+    items = CartLineSerializer(many=True, allow_empty=False)
@@ -0,0 +1,27 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, pre_delete
+from django.dispatch import receiver
+from .models import Order, OrderItem
+from .reservations import release_order, release_orders
+
+
+@receiver(post_delete, sender=OrderItem)
+def order_item_deleted(sender, instance, origin=None, **kwargs):
+    # The total doesn't matter when the whole order is being deleted
+    origin_model = getattr(origin, 'model', type(origin))
+    if origin_model is Order:
+        return
+    Order.add_to_total(instance.order_id, -instance.item_total)
+    Order.refresh_items_summary(instance.order_id)
+
+
+@receiver(pre_delete, sender=Order)
+def order_deleted(sender, instance, origin=None, **kwargs):
+    # Give back reserved stock before the reservation rows are cascade deleted
+    if isinstance(origin, QuerySet):
+        # Sent once per order of a queryset delete: release all of them together the first time
+        if not getattr(origin, '_reservations_released', False):
+            origin._reservations_released = True
+            release_orders(list(origin.values_list('pk', flat=True)))
+        return
+    release_order(instance)
@@ -0,0 +1,141 @@
+"""
+Stock deduction and return for orders.
+
+The demand of every item in one or more orders is first aggregated per
+ingredient (sub-recipes flattened, amounts in the ingredient's unit) and per
+non-deductable product. Each table is then changed with a single UPDATE whose
+WHERE clause only matches rows with enough stock. If fewer rows match than
+were asked for, the whole change is rolled back, so stock never goes negative
+and a completion costs the same handful of statements however large it is.
+"""
+from decimal import Decimal, ROUND_HALF_UP
+from functools import reduce
+from operator import or_
+
+from django.db import transaction
+from django.db.models import F, Q, Case, When, Value, DecimalField, IntegerField
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from coffeeshop_backend.log import get_logger
+from ingredient_inventory.models import Ingredient
+from products.models import Product
+from jobs.queue import enqueue
+from .models import Order, OrderItem
+from .inventory import StockSnapshot, lock_rows
+from .reservations import release_orders
+
+logger = get_logger(__name__)
+
+DEDUCT = 'deduct'
+RETURN = 'return'
+# Deduct what there is, stopping at zero, for sales that already happened (see orders/sync.py)
+DEDUCT_AVAILABLE = 'deduct_available'
+
+# Ingredient.stock is stored with two decimal places
+STOCK_QUANTUM = Decimal('0.01')
+
+
+class StockShortage(ValueError):
+    """Raised when a deduction would take some balance below zero"""
+
+
+def _stock_amount(amount):
+    return Decimal(str(amount)).quantize(STOCK_QUANTUM, rounding=ROUND_HALF_UP)
+
+
+def _update_stock(model, amounts, action, output_field):
+    """
+    Apply {pk: amount} to model.stock in one UPDATE and return how many rows
+    changed. Deductions only touch rows that have at least the amount in stock;
+    DEDUCT_AVAILABLE takes rows that don't down to zero.
+    """
+    lock_rows(model, amounts)
+    queryset = model.objects.filter(pk__in=amounts)
+    if action == DEDUCT:
+        queryset = queryset.filter(reduce(or_, (Q(pk=pk, stock__gte=amount) for pk, amount in amounts.items())))
+    change = Case(
+        *[When(pk=pk, then=Value(amount, output_field=output_field)) for pk, amount in amounts.items()],
+        default=Value(0, output_field=output_field),
+        output_field=output_field,
+    )
+    if action == RETURN:
+        stock = F('stock') + change
+    elif action == DEDUCT_AVAILABLE:
+        stock = Greatest(F('stock') - change, Value(0, output_field=output_field))
+    else:
+        stock = F('stock') - change
+    return queryset.update(stock=stock, updated_at=timezone.now())
+
+
+def _shortage_message(snapshot, ingredient_amounts, product_amounts):
+    """Describe the first ingredient or product that lacks the stock to deduct"""
+    stock = dict(Ingredient.objects.filter(pk__in=ingredient_amounts).values_list('pk', 'stock'))
+    for pk, required in ingredient_amounts.items():
+        if stock.get(pk, 0) < required:
+            ingredient = snapshot.ingredients[pk]
+            return f"Not enough {ingredient.name} in stock. Required: {required}{ingredient.unit}, Available: {stock.get(pk, 0)}{ingredient.unit}"
+    stock = dict(Product.objects.filter(pk__in=product_amounts).values_list('pk', 'stock'))
+    for pk, required in product_amounts.items():
+        if stock.get(pk, 0) < required:
+            return f"Not enough {snapshot.products[pk].name} in stock. Required: {required}, Available: {stock.get(pk, 0)}"
+    return "Not enough stock"
+
+
+@transaction.atomic
+def apply_order_stock(orders, action, release_reservations=False, lines=None, snapshot=None):
+    """
+    Deduct (action='deduct') or return (action='return') the stock used by
+    the items of the given orders, all in one transaction. DEDUCT_AVAILABLE
+    deducts what there is instead of failing. Raises
+    StockShortage without changing anything if a deduction doesn't fit.
+    With release_reservations the orders' reservations are dropped in the
+    same transaction, as they have become real deductions.
+    Callers that already loaded the orders' [(product_id, quantity)] lines
+    and a StockSnapshot covering them can pass both to skip reloading.
+    Returns a description of each change, e.g. ["Milk (-400.0ml)"].
+    """
+    # Lock order: orders, then ingredients, then products (see inventory.lock_rows)
+    lock_rows(Order, [order.pk for order in orders])
+    if lines is None:
+        lines = list(OrderItem.objects.filter(order__in=orders).values_list('product_id', 'quantity'))
+    if not lines:
+        if release_reservations:
+            release_orders(orders)
+        return []
+
+    snapshot = snapshot or StockSnapshot(product_id for product_id, _ in lines)
+    ingredient_demand, product_demand = snapshot.demand(lines)
+    ingredient_amounts = {pk: _stock_amount(amount) for pk, amount in ingredient_demand.items() if amount > 0}
+    product_amounts = {pk: units for pk, units in product_demand.items() if units > 0}
+
+    try:
+        with transaction.atomic():
+            if ingredient_amounts:
+                updated = _update_stock(Ingredient, ingredient_amounts, action, DecimalField(max_digits=8, decimal_places=2))
+                if updated != len(ingredient_amounts):
+                    raise StockShortage()
+            if product_amounts:
+                updated = _update_stock(Product, product_amounts, action, IntegerField())
+                if updated != len(product_amounts):
+                    raise StockShortage()
+            released = release_orders(orders, refresh=False) if release_reservations else set()
+    except StockShortage:
+        message = _shortage_message(snapshot, ingredient_amounts, product_amounts)
+        logger.warning("Stock %s failed: %s", action, message)
+        raise StockShortage(message)
+
+    # QuerySet.update skips the Ingredient signals that would refresh availability
+    changed = set(ingredient_amounts) | released
+    if changed:
+        enqueue('products.refresh_availability', ingredient_ids=sorted(changed))
+    if action != RETURN and ingredient_amounts:
+        enqueue('ingredient_inventory.low_stock_alert', used=ingredient_amounts)
+
+    sign = '+' if action == RETURN else '-'
+    changes = [
+        f"{snapshot.ingredients[pk].name} ({sign}{amount}{snapshot.ingredients[pk].unit})"
+        for pk, amount in ingredient_amounts.items()
+    ]
+    changes += [f"{snapshot.products[pk].name} ({sign}{units})" for pk, units in product_amounts.items()]
+    return changes
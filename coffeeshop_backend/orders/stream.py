@@ -0,0 +1,74 @@
+"""
+Server-sent event stream of open orders for kitchen and counter boards.
+
+GET /api/orders/stream/ first sends a "snapshot" event listing every open
+order, then one event per change (see orders/events.py) as it happens. A
+"snapshot" is sent again whenever the client falls too far behind. Comment
+lines keep idle connections open through proxies. Serve the app over ASGI
+so a waiting client doesn't hold a worker thread.
+"""
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import JsonResponse, StreamingHttpResponse
+from rest_framework.exceptions import AuthenticationFailed
+
+from users.authentication import CookieJWTAuthentication
+from .events import RESYNC, get_broker, order_rows
+from .models import Order
+from .reservations import OPEN_STATUSES
+
+
+def sse(event, data, event_id=None):
+    """Format one server-sent event"""
+    lines = [f'event: {event}']
+    if event_id:
+        lines.append(f'id: {event_id}')
+    lines.append(f'data: {json.dumps(data)}')
+    return '\n'.join(lines) + '\n\n'
+
+
+def open_orders_snapshot():
+    return list(order_rows(Order.objects.filter(status__in=OPEN_STATUSES).order_by('ordered_at', 'id')))
+
+
+def authenticate(request):
+    try:
+        result = CookieJWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        return None
+    return result[0] if result else None
+
+
+async def order_stream(request):
+    user = await sync_to_async(authenticate)(request)
+    if user is None:
+        return JsonResponse({'error': 'Authentication credentials were not provided.'}, status=401)
+
+    keepalive = getattr(settings, 'ORDER_STREAM_KEEPALIVE', 15)
+    # Subscribe before taking the snapshot so no change falls between the two
+    subscription = get_broker().subscribe()
+
+    async def events():
+        try:
+            yield sse('snapshot', await sync_to_async(open_orders_snapshot)())
+            while True:
+                try:
+                    event = await subscription.get(timeout=keepalive)
+                except asyncio.TimeoutError:
+                    yield ': keepalive\n\n'
+                    continue
+                if event is RESYNC:
+                    yield sse('snapshot', await sync_to_async(open_orders_snapshot)())
+                else:
+                    yield sse(event['type'], event, event['id'])
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(events(), content_type='text/event-stream')
+    response['Cache-Control'] = 'no-cache'
+    # Stop nginx style proxies from buffering the stream
+    response['X-Accel-Buffering'] = 'no'
+    return response
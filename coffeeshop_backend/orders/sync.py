@@ -0,0 +1,179 @@
+"""
+Uploading orders the POS took while it was offline.
+
+The POS gives every order it queues a client_id (a UUID) and the time it was
+taken, and later uploads the whole queue in one request. Orders are matched
+on client_id, so uploading the same queue again, or an order that already
+reached the server before the connection dropped, never creates it twice.
+
+The batch is ingested in one transaction. New orders are checked one after
+another in the order they were taken against one locked stock snapshot.
+Orders that name unknown products are rejected. A pending order is reserved
+from the stock other orders haven't reserved, and rejected if that doesn't
+cover it. A completed one is a sale that already happened, so it is taken
+from the stock on hand, reserved or not, down to zero: it is recorded with
+stock_shortfall set if the stock on hand didn't cover it, and with a warning
+if it used stock reserved for open orders, which leaves those reservations
+oversold (see reservations.oversold_reservations).
+
+The accepted orders' stock effects are then applied together: completed orders are deducted
+with one aggregated UPDATE per table (see orders/stock.py) and pending
+orders are reserved with one insert (see orders/reservations.py). Orders,
+items and history are bulk inserted, the history with the times the POS
+recorded, which also give the orders' stage durations (see orders/lifecycle.py).
+"""
+from decimal import Decimal
+
+from django.db import transaction
+
+from coffeeshop_backend.log import get_logger
+from .transitions import shortage_text
+from .events import ORDER_CREATED, publish_order_events
+from .inventory import StockSnapshot
+from .lifecycle import record_transition
+from .models import ArchivedOrder, Order, OrderItem, OrderStatusHistory, summarize_items
+from .reservations import release_expired_reservations, reserve_orders
+from .stock import apply_order_stock, DEDUCT_AVAILABLE
+
+logger = get_logger(__name__)
+
+CREATED = 'created'
+DUPLICATE = 'duplicate'
+REJECTED = 'rejected'
+
+
+def _reserved_text(reserved_used):
+    return '; '.join(
+        f"{used['ingredient']}: {used['used']}{used['unit']}" if 'ingredient' in used else f"{used['product']}: {used['used']}"
+        for used in reserved_used
+    )
+
+
+def _existing(client_ids):
+    """{client_id: result} for orders that were already uploaded, live or archived"""
+    existing = {}
+    for model in (Order, ArchivedOrder):
+        for client_id, pk, order_id in model.objects.filter(client_id__in=client_ids).values_list(
+            'client_id', 'pk', 'order_id'
+        ):
+            existing[client_id] = {'outcome': DUPLICATE, 'id': pk, 'order_id': order_id}
+    return existing
+
+
+@transaction.atomic
+def ingest_orders(entries, changed_by=None):
+    """
+    Create the orders in entries, validated OfflineOrderSerializer data,
+    skipping any whose client_id is already known.
+
+    Returns {client_id: result} in the order given, e.g.
+    {'outcome': 'created', 'id': 12, 'order_id': '261017-00A3'},
+    {'outcome': 'duplicate', 'id': 9, ...} or {'outcome': 'rejected', 'error': '...'}.
+    Completed orders recorded with a stock shortfall, or that used stock
+    reserved for open orders, also have a 'warning'.
+    Raises IntegrityError if another upload creates one of the orders first.
+    """
+    # The first entry wins when the queue holds a client_id twice
+    unique = {}
+    for entry in entries:
+        unique.setdefault(entry['client_id'], entry)
+    entries = unique
+    results = _existing(list(entries))
+
+    new_entries = sorted(
+        (entry for client_id, entry in entries.items() if client_id not in results),
+        key=lambda entry: entry['ordered_at'],
+    )
+    release_expired_reservations()
+    snapshot = StockSnapshot(
+        {line['product'] for entry in new_entries for line in entry['order_items']}, lock=True
+    )
+
+    accepted = []
+    for entry in new_entries:
+        lines = [(line['product'], line['quantity']) for line in entry['order_items']]
+        missing = [product_id for product_id, _ in lines if product_id not in snapshot.products]
+        if missing:
+            results[entry['client_id']] = {'outcome': REJECTED, 'error': f"Product with ID {missing[0]} not found."}
+            continue
+        ingredient_demand, product_demand = snapshot.demand(lines)
+        # Later orders only get what this one leaves
+        if entry['status'] == 'completed':
+            shortages, reserved_used = snapshot.sell(ingredient_demand, product_demand)
+        else:
+            shortages, reserved_used = snapshot.shortages(ingredient_demand, product_demand), []
+            if shortages:
+                results[entry['client_id']] = {
+                    'outcome': REJECTED, 'error': f"Not enough stock: {shortage_text(shortages)}",
+                }
+                continue
+            snapshot.consume(ingredient_demand, product_demand)
+        accepted.append((entry, lines, shortages, reserved_used))
+
+    orders = []
+    items = []
+    history = []
+    warnings = {}
+    for entry, lines, shortages, reserved_used in accepted:
+        order_items = [
+            OrderItem(product=snapshot.products[product_id], quantity=quantity, price=snapshot.products[product_id].price)
+            for product_id, quantity in lines
+        ]
+        order = Order(
+            client_id=entry['client_id'],
+            customer_name=entry.get('customer_name'),
+            status='pending',
+            ordered_at=entry['ordered_at'],
+            total_price=sum((item.item_total for item in order_items), Decimal('0')),
+            items_summary=summarize_items([(item.product.name, item.quantity) for item in order_items]),
+            stock_shortfall=bool(shortages),
+        )
+        changes = entry.get('status_history') or []
+        if not changes and entry['status'] != 'pending':
+            # When it was completed isn't known; record it at the order time, without stage durations
+            changes = [{'status': entry['status'], 'changed_at': entry['ordered_at']}]
+            order.status, order.completed_by = entry['status'], changed_by
+        else:
+            for change in changes:
+                record_transition(order, change['status'], changed_by, change['changed_at'])
+        orders.append(order)
+        items.append(order_items)
+        history.append([
+            OrderStatusHistory(order=order, status=change['status'], changed_at=change['changed_at'], changed_by=changed_by)
+            for change in changes
+        ])
+        warning = []
+        if shortages:
+            warning.append(f"Recorded with a stock shortfall: {shortage_text(shortages)}")
+        if reserved_used:
+            warning.append(f"Used stock reserved for open orders: {_reserved_text(reserved_used)}")
+        if warning:
+            warnings[entry['client_id']] = '; '.join(warning)
+
+    if orders:
+        Order.objects.bulk_create(orders)
+        for order, order_items, order_history in zip(orders, items, history):
+            for row in order_items + order_history:
+                row.order = order
+        # bulk_create skips OrderItem.save, the totals were computed above
+        OrderItem.objects.bulk_create([item for order_items in items for item in order_items])
+        OrderStatusHistory.objects.bulk_create([row for order_history in history for row in order_history])
+
+        completed = [order for order in orders if order.status == 'completed']
+        if completed:
+            # Already sold, so stock on hand that was counted short is taken down to zero rather than refused
+            apply_order_stock(completed, DEDUCT_AVAILABLE)
+        reserve_orders(
+            {order: lines for order, (_, lines, _, _) in zip(orders, accepted) if order.status == 'pending'}, snapshot
+        )
+        publish_order_events(ORDER_CREATED, [order.pk for order in orders])
+
+    for order in orders:
+        results[order.client_id] = {'outcome': CREATED, 'id': order.pk, 'order_id': order.order_id}
+        if order.client_id in warnings:
+            results[order.client_id]['warning'] = warnings[order.client_id]
+    for client_id, warning in warnings.items():
+        logger.warning("Synced offline order %s: %s", client_id, warning)
+
+    logger.info("Synced %s offline orders: %s new of %s", len(entries), len(orders), len(new_entries))
+    return {client_id: results[client_id] for client_id in entries}
@@ -0,0 +1,35 @@
+"""
+Order total verification.
+
+Order.total_price is maintained incrementally (see OrderItem.save and the
+OrderItem delete signal). Writes that bypass those paths, such as
+QuerySet.update on items or manual database edits, can make it drift from
+the sum of its items. reconcile_order_totals finds and fixes that drift with
+one query to find the orders and one UPDATE to fix them.
+"""
+from django.db.models import F
+
+from coffeeshop_backend.log import get_logger
+from .models import Order, items_total_subquery
+
+logger = get_logger(__name__)
+
+
+def find_drifted_orders(queryset=None):
+    """[(order pk, order_id, stored total, expected total)] for orders whose total doesn't match their items"""
+    queryset = Order.objects.all() if queryset is None else queryset
+    return list(
+        queryset.annotate(expected_total=items_total_subquery())
+        .exclude(total_price=F('expected_total'))
+        .values_list('pk', 'order_id', 'total_price', 'expected_total')
+    )
+
+
+def reconcile_order_totals(queryset=None, dry_run=False):
+    """Fix the stored total of every drifted order and return what was found"""
+    drifted = find_drifted_orders(queryset)
+    for pk, order_id, stored, expected in drifted:
+        logger.warning("Order %s total drifted: stored %s, items sum to %s", order_id, stored, expected)
+    if drifted and not dry_run:
+        Order.objects.filter(pk__in=[pk for pk, _, _, _ in drifted]).update(total_price=items_total_subquery())
+    return drifted
@@ -0,0 +1,209 @@
+"""
+Order status changes.
+
+Which status changes are allowed, and what each one does to stock, is
+declared once in TRANSITIONS. Every way of changing a status (update_status,
+a PUT or PATCH of the order, cancel_order and bulk_status) goes through
+change_statuses, so they all follow the same rules.
+
+A change locks the orders, then loads their items and one StockSnapshot of
+the products, recipes and ingredients involved, with the stock rows locked
+(orders first, then ingredients, then products; see inventory.lock_rows).
+Every check and every stock write works from that snapshot: orders are
+checked one after another in pk order, each against what the earlier ones
+left, and the stock effects of the whole batch are applied with one
+aggregated write per table (see orders/stock.py and orders/reservations.py).
+Statuses and stage durations (see orders/lifecycle.py) are set with one
+bulk_update and the history is written with one bulk_create. Orders that
+can't make the change are reported and left as they were, while the rest
+go ahead.
+"""
+from collections import defaultdict
+
+from django.db import transaction
+from django.utils import timezone
+
+from coffeeshop_backend.log import get_logger
+from .events import STATUS_CHANGED, publish_order_events
+from .inventory import StockSnapshot
+from .lifecycle import LIFECYCLE_FIELDS, record_transition
+from .models import Order, OrderItem, OrderStatusHistory, StockReservation
+from .reservations import release_expired_reservations, release_orders, reservation_ttl, reserve_orders
+from .stock import apply_order_stock, DEDUCT
+
+logger = get_logger(__name__)
+
+# What a transition does to the order's stock
+HOLD = 'hold'  # check the stock and keep it reserved, without expiry, until the order is completed
+REQUEUE = 'requeue'  # keep the reserved stock, expiring again like any pending order's
+RELEASE = 'release'  # give the reserved stock back
+
+# (from status, to status): stock effect. Anything not listed is refused.
+TRANSITIONS = {
+    ('pending', 'processing'): HOLD,
+    ('processing', 'pending'): REQUEUE,
+    ('pending', 'completed'): DEDUCT,
+    ('processing', 'completed'): DEDUCT,
+    ('pending', 'cancelled'): RELEASE,
+}
+
+# Why transitions that aren't allowed are refused. Completed and cancelled
+# orders are closed: reopening them was allowed before, but left their stock
+# deducted or released with nothing to undo it.
+REFUSALS = {
+    ('processing', 'cancelled'): 'Cannot cancel order while it is being processed',
+    ('completed', 'cancelled'): 'Cannot cancel completed order',
+    ('completed', 'pending'): 'Cannot reopen completed order, its stock has been used',
+    ('completed', 'processing'): 'Cannot reopen completed order, its stock has been used',
+    ('cancelled', 'pending'): 'Cannot reopen cancelled order, place a new one instead',
+    ('cancelled', 'processing'): 'Cannot reopen cancelled order, place a new one instead',
+    ('cancelled', 'completed'): 'Cannot complete cancelled order, place a new one instead',
+}
+
+# What a failed stock check is reported as, per effect
+SHORTAGE_ERRORS = {
+    HOLD: 'Cannot start order due to insufficient stock',
+    DEDUCT: 'Cannot complete order due to insufficient stock',
+}
+
+
+class TransitionError(ValueError):
+    """Raised by change_status when an order can't move to the requested status"""
+
+
+def refusal(old_status, new_status):
+    """Why an order can't move from old_status to new_status, or None if it can"""
+    if (old_status, new_status) in TRANSITIONS:
+        return None
+    return REFUSALS.get((old_status, new_status), f"Cannot change order status from {old_status} to {new_status}")
+
+
+def shortage_text(shortages):
+    return '; '.join(
+        f"{shortage.get('ingredient') or shortage.get('product')}: "
+        f"Available {shortage['available']}, Required {shortage['required']}"
+        for shortage in shortages
+    )
+
+
+def _check_stock(orders, effect, results):
+    """
+    Check orders that need stock against one locked snapshot and apply the
+    effect to the ones that fit. Returns (accepted orders, ingredient_changes).
+    """
+    lines = defaultdict(list)
+    for order_id, product_id, quantity in OrderItem.objects.filter(order__in=orders).values_list(
+        'order_id', 'product_id', 'quantity'
+    ):
+        lines[order_id].append((product_id, quantity))
+
+    # Expired reservations of other orders shouldn't count against these
+    release_expired_reservations()
+    snapshot = StockSnapshot(
+        {product_id for order_lines in lines.values() for product_id, _ in order_lines},
+        exclude_orders=orders,
+        lock=True,
+    )
+    accepted = []
+    for order in orders:
+        ingredient_demand, product_demand = snapshot.demand(lines[order.pk])
+        shortages = snapshot.shortages(ingredient_demand, product_demand)
+        if shortages:
+            results[order.pk] = {
+                'id': order.pk, 'success': False,
+                'error': f"{SHORTAGE_ERRORS[effect]}: {shortage_text(shortages)}",
+            }
+            continue
+        snapshot.consume(ingredient_demand, product_demand)
+        accepted.append(order)
+
+    if not accepted:
+        return [], []
+    if effect == DEDUCT:
+        # One aggregated deduction for all of them, consuming their reservations
+        accepted_lines = [line for order in accepted for line in lines[order.pk]]
+        return accepted, apply_order_stock(
+            accepted, DEDUCT, release_reservations=True, lines=accepted_lines, snapshot=snapshot
+        )
+    reserve_orders({order: lines[order.pk] for order in accepted}, snapshot, expires=False)
+    return accepted, []
+
+
+@transaction.atomic
+def change_statuses(order_ids, new_status, changed_by=None):
+    """
+    Move the given orders to new_status in one transaction.
+
+    Returns (results, ingredient_changes, history): one result per distinct
+    id, in the order given, e.g. {'id': 3, 'success': True, 'old_status':
+    'pending'} or {'id': 4, 'success': False, 'error': '...'}, the
+    aggregated stock changes made for completed orders, and the new
+    OrderStatusHistory row of each changed order by order pk.
+    """
+    order_ids = list(dict.fromkeys(order_ids))
+    # Orders are locked first and in pk order, like every other stock writer
+    orders = list(Order.objects.select_for_update().filter(pk__in=order_ids).order_by('pk'))
+    results = {}
+    by_effect = defaultdict(list)
+    for order in orders:
+        if order.status == new_status:
+            results[order.pk] = {
+                'id': order.pk, 'success': True, 'old_status': order.status, 'message': 'Status unchanged',
+            }
+            continue
+        error = refusal(order.status, new_status)
+        if error:
+            results[order.pk] = {'id': order.pk, 'success': False, 'error': error}
+        else:
+            by_effect[TRANSITIONS[(order.status, new_status)]].append(order)
+
+    ingredient_changes = []
+    changed = []
+    for effect, effect_orders in by_effect.items():
+        if effect == RELEASE:
+            # Nothing was deducted yet, just give back what they reserved
+            release_orders(effect_orders)
+        elif effect == REQUEUE:
+            StockReservation.objects.filter(order__in=effect_orders).update(
+                expires_at=timezone.now() + reservation_ttl()
+            )
+        else:
+            effect_orders, effect_changes = _check_stock(effect_orders, effect, results)
+            ingredient_changes += effect_changes
+        changed += effect_orders
+
+    history = {}
+    old_statuses = {order.pk: order.status for order in changed}
+    if changed:
+        now = timezone.now()
+        for order in changed:
+            record_transition(order, new_status, changed_by, now)
+        Order.objects.bulk_update(changed, LIFECYCLE_FIELDS)
+        entries = OrderStatusHistory.objects.bulk_create(
+            [OrderStatusHistory(order=order, status=new_status, changed_by=changed_by) for order in changed]
+        )
+        history = {entry.order_id: entry for entry in entries}
+        publish_order_events(STATUS_CHANGED, list(history))
+    for order in changed:
+        results[order.pk] = {'id': order.pk, 'success': True, 'old_status': old_statuses[order.pk]}
+
+    logger.info("Moved %s of %s orders to %s", len(changed), len(order_ids), new_status)
+    missing = {'success': False, 'error': 'Order not found'}
+    return [results.get(pk, {'id': pk, **missing}) for pk in order_ids], ingredient_changes, history
+
+
+def change_status(order, new_status, changed_by=None):
+    """
+    Move one order to new_status, raising TransitionError if it can't, and
+    update the instance to match. Returns (history_entry, ingredient_changes),
+    history_entry being None if the order already had that status.
+    """
+    results, ingredient_changes, history = change_statuses([order.pk], new_status, changed_by)
+    if not results[0]['success']:
+        raise TransitionError(results[0]['error'])
+    entry = history.get(order.pk)
+    if entry:
+        # entry.order is the locked copy the change was made on
+        for field in LIFECYCLE_FIELDS:
+            setattr(order, field, getattr(entry.order, field))
+    return entry, ingredient_changes
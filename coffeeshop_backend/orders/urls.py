@@ -1,11 +1,14 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import OrderViewSet, OrderItemViewSet
+from .views import OrderViewSet, OrderItemViewSet, CartQuoteView
+from .stream import order_stream
 
 router = DefaultRouter()
 router.register(r'orders', OrderViewSet)
 router.register(r'order-items', OrderItemViewSet)
 
 urlpatterns = [
+    path('quote/', CartQuoteView.as_view(), name='cart-quote'),
+    path('stream/', order_stream, name='order-stream'),
     path('', include(router.urls)),
 ]
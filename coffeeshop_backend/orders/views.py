@@ -1,17 +1,33 @@
 from rest_framework import viewsets, status, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
-from django.db import transaction
-from django.db.models import F
-from .models import Order, OrderStatusHistory, OrderItem
-from .serializers import OrderSerializer, OrderStatusHistorySerializer, OrderItemSerializer
-from products.models import Product, ProductIngredient
-from ingredient_inventory.models import Ingredient
+from rest_framework.views import APIView
+from django.db import IntegrityError, transaction
+from django.db.models import Count
+from .models import Order, OrderItem
+from .serializers import (
+    OrderSerializer, OrderListSerializer, OrderStatusHistorySerializer, OrderItemSerializer, CartQuoteSerializer,
+    BulkStatusSerializer, OrderSyncSerializer,
+)
+from .inventory import quote_cart
+from .pagination import OrderPagination, OrderItemPagination
+from .events import ORDER_CREATED, ITEMS_CHANGED, ORDER_DELETED, publish_order_event
+from .stock import StockShortage
+from .transitions import change_status, change_statuses, TransitionError
+from .sync import ingest_orders, CREATED, DUPLICATE, REJECTED
+from .idempotency import idempotent
+from .reservations import InsufficientStock, reserve_order, sync_reservation
+from products.models import Product
 from decimal import Decimal
+from collections import Counter
+from coffeeshop_backend.log import get_logger
+
+logger = get_logger(__name__)
 
 class OrderItemViewSet(viewsets.ModelViewSet):
-    queryset = OrderItem.objects.all()
+    queryset = OrderItem.objects.select_related('product')
     serializer_class = OrderItemSerializer
+    pagination_class = OrderItemPagination
     
     def get_queryset(self):
         queryset = super().get_queryset()
@@ -33,200 +49,182 @@ class OrderItemViewSet(viewsets.ModelViewSet):
                 raise serializers.ValidationError({"order": "Order is required"})
         else:
             try:
-                order = Order.objects.get(pk=order_id)
+                order = Order.objects.select_for_update().get(pk=order_id)
                 serializer.validated_data['order'] = order
             except Order.DoesNotExist:
                 raise serializers.ValidationError({"order": "Order not found"})
         
-        # Only allow adding items to pending/preparing orders
-        if order.status not in ['pending', 'preparing']:
+        # Only allow adding items to pending orders
+        if order.status != 'pending':
             raise serializers.ValidationError(
                 {"order": f"Cannot add items to order with status: {order.status}"}
             )
         
-        # Check if there's enough stock (validation only, no deduction)
         product = serializer.validated_data['product']
-        quantity = serializer.validated_data['quantity']
         
-        available = product.get_available_stock()
-        if available < quantity:
-            raise serializers.ValidationError({
-                "quantity": f"Not enough available. Only {available} {product.name} can be made with current ingredients."
-            })
-                                                                                                                                                                                                                                                                                                                                                                                                                  
-        # Save with current price - no stock changes during creation
+        # Save with current price and reserve stock for the grown order (no deduction until completed)
         serializer.save(price=product.price)
+        self.sync_order_reservation(order)
+        publish_order_event(ITEMS_CHANGED, order.pk)
+    
+    @transaction.atomic
+    def perform_update(self, serializer):
+        item = serializer.save()
+        self.sync_order_reservation(item.order)
+        publish_order_event(ITEMS_CHANGED, item.order_id)
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        order = instance.order
+        instance.delete()
+        self.sync_order_reservation(order)
+        publish_order_event(ITEMS_CHANGED, order.pk)
+    
+    def sync_order_reservation(self, order):
+        try:
+            sync_reservation(order)
+        except InsufficientStock as e:
+            raise serializers.ValidationError({"quantity": not_enough_message(e)})
+
+
+def not_enough_message(error):
+    """User facing message for the first line of an order that doesn't fit in stock"""
+    issue = error.issues[0]
+    return f"Not enough available. Only {issue['available']} {issue['product']} can be made with current ingredients."
+
+
+class CartQuoteView(APIView):
+    """
+    Price and validate a whole cart against shared ingredient stock in one call
+    """
+    def post(self, request):
+        serializer = CartQuoteSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        lines = [(line['product'], line['quantity']) for line in serializer.validated_data['items']]
+        
+        try:
+            return Response(quote_cart(lines))
+        except Product.DoesNotExist as e:
+            return Response({'error': str(e)}, status=status.HTTP_404_NOT_FOUND)
 
 
 class OrderViewSet(viewsets.ModelViewSet):
     queryset = Order.objects.all()
     serializer_class = OrderSerializer
+    pagination_class = OrderPagination
     
     def get_queryset(self):
         queryset = super().get_queryset()
+        if self.action == 'list':
+            # Table rows only need the item count; the summary is stored on the order
+            return queryset.annotate(items_count=Count('items'))
         # Include related items for better performance
-        return queryset.prefetch_related('items', 'status_history')
+        return queryset.prefetch_related('items__product', 'status_history')
+    
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return OrderListSerializer
+        return OrderSerializer
+    
+    def get_locked_object(self):
+        """get_object() with the order row locked until the transaction ends"""
+        order = self.get_object()
+        # Locking the order first serializes every status change and item edit on it
+        return Order.objects.select_for_update().get(pk=order.pk)
+    
+    @idempotent
+    def create(self, request, *args, **kwargs):
+        return super().create(request, *args, **kwargs)
+    
+    def perform_create(self, serializer):
+        order = serializer.save()
+        publish_order_event(ORDER_CREATED, order.pk)
+    
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        order_id = instance.pk
+        instance.delete()
+        publish_order_event(ORDER_DELETED, order_id)
     
+    @transaction.atomic
     def perform_update(self, serializer):
-        instance = self.get_object()
-        old_status = instance.status
-        new_status = serializer.validated_data.get('status', old_status)
-        
-        # Prevent cancellation during processing
-        if old_status in ['processing', 'preparing'] and new_status == 'cancelled':
-            raise serializers.ValidationError(
-                {"status": "Cannot cancel order while it's being processed"}
-            )
+        instance = self.get_locked_object()
+        new_status = serializer.validated_data.get('status', instance.status)
         
-        # Handle stock deduction only when marking as completed
-        if new_status == 'completed' and old_status != 'completed':
-            # Check if all products have enough stock
-            stock_issues = []
-            
-            print(f"Checking stock for order {instance.id}:")
-            for item in instance.items.all():
-                if item.product.deductable:
-                    available = item.product.get_available_stock()
-                    print(f"  Product: {item.product.name}, Available: {available}, Required: {item.quantity}")
-                    if available < item.quantity:
-                        stock_issues.append({
-                            'product': item.product.name,
-                            'available': available,
-                            'required': item.quantity,
-                            'shortage': item.quantity - available
-                        })
-                else:
-                    # For non-deductable products, check direct stock
-                    if item.product.stock < item.quantity:
-                        stock_issues.append({
-                            'product': item.product.name,
-                            'available': item.product.stock,
-                            'required': item.quantity,
-                            'shortage': item.quantity - item.product.stock
-                        })
-            
-            if stock_issues:
-                error_messages = []
-                for issue in stock_issues:
-                    error_messages.append(
-                        f"{issue['product']}: Available {issue['available']}, Required {issue['required']} (shortage: {issue['shortage']})"
-                    )
-                raise serializers.ValidationError({
-                    "status": f"Cannot complete order due to insufficient stock: {'; '.join(error_messages)}"
-                })
-            
+        # Status changes follow the same rules and stock effects as update_status
+        if new_status != instance.status:
             try:
-                self.process_ingredients(instance, 'deduct')
-            except ValueError as e:
+                change_status(instance, new_status, changed_by=self.username())
+            except (TransitionError, StockShortage) as e:
                 raise serializers.ValidationError({"status": str(e)})
         
-        # Handle stock return when cancelling from non-processing states
-        elif new_status == 'cancelled' and old_status not in ['processing', 'preparing']:
-            self.process_ingredients(instance, 'return')
-        
-        updated_instance = serializer.save()
+        # Save onto the locked row so a status read before the lock isn't written back
+        serializer.instance = instance
+        serializer.save()
+    
+    def username(self):
+        return self.request.user.username if self.request.user.is_authenticated else None
+    
+    @action(detail=False, methods=['post'])
+    def bulk_status(self, request):
+        """Move many orders to one status at once, e.g. {"ids": [1, 2, 3], "status": "completed"}"""
+        serializer = BulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         
-        # Create status history
-        if old_status != new_status:
-            username = None
-            if hasattr(self.request, 'user') and self.request.user.is_authenticated:
-                username = self.request.user.username
-                
-            OrderStatusHistory.objects.create(
-                order=updated_instance,
-                status=new_status,
+        try:
+            results, ingredient_changes, _ = change_statuses(
+                serializer.validated_data['ids'], serializer.validated_data['status'], changed_by=self.username()
             )
+        except StockShortage as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        failed = sum(1 for result in results if not result['success'])
+        return Response({
+            'status': serializer.validated_data['status'],
+            'updated': len(results) - failed,
+            'failed': failed,
+            'results': results,
+            'ingredient_changes': ingredient_changes
+        }, status=status.HTTP_207_MULTI_STATUS if failed else status.HTTP_200_OK)
     
-    @transaction.atomic
-    def process_ingredients(self, order, action):
-        """Process ingredients for an order based on action type (deduct or return)"""
-        if order.status == 'cancelled' and action == 'deduct':
-            raise ValueError("Cannot process ingredients for cancelled order")
-            
-        order_items = OrderItem.objects.filter(order=order)
-        processed_ingredients = []
+    @action(detail=False, methods=['post'])
+    def sync(self, request):
+        """
+        Upload orders taken while the POS was offline, e.g.
+        {"orders": [{"client_id": "...", "ordered_at": "...", "status": "completed",
+                     "order_items": [{"product": 1, "quantity": 2}],
+                     "status_history": [{"status": "completed", "changed_at": "..."}]}]}
+        """
+        serializer = OrderSyncSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
         
-        for item in order_items:
-            product = item.product
-            quantity = item.quantity
-            
-            if product.deductable:
-                product_ingredients = ProductIngredient.objects.filter(product=product)
-                
-                for pi in product_ingredients:
-                    ingredient = pi.ingredient
-                    required_amount = pi.quantity * quantity
-                    required_unit = pi.required_unit
-                    ingredient_unit = ingredient.unit
-                    
-                    # Convert required_amount to ingredient's base unit
-                    conversion_factors = {
-                        'g': {'kg': 0.001, 'mg': 1000, 'g': 1, 'tsp': 0.2, 'tbsp': 0.067},
-                        'kg': {'g': 1000, 'mg': 1000000, 'kg': 1, 'tsp': 200, 'tbsp': 67},
-                        'ml': {'l': 0.001, 'cl': 0.1, 'ml': 1, 'tsp': 0.2, 'tbsp': 0.067},
-                        'l': {'ml': 1000, 'cl': 10, 'l': 1, 'tsp': 200, 'tbsp': 67},
-                        'pcs': {'pcs': 1, 'dozen': 0.0833, 'unit': 1},
-                        'tbsp': {'tbsp': 1, 'tsp': 3, 'ml': 15, 'g': 15},
-                        'tsp': {'tsp': 1, 'tbsp': 0.333333, 'ml': 5, 'g': 5},
-                    }
-                    
-                    # Convert required amount to ingredient's base unit
-                    required_in_base_unit = float(required_amount)
-                    req_unit_lower = str(required_unit).lower().strip()
-                    ing_unit_lower = str(ingredient_unit).lower().strip()
-                    
-                    if req_unit_lower != ing_unit_lower:
-                        # Special coffee conversion
-                        if (ing_unit_lower, req_unit_lower) in [('kg', 'ml'), ('g', 'ml')]:
-                            if ing_unit_lower == 'kg' and req_unit_lower == 'ml':
-                                required_in_base_unit = float(required_amount) / 2500  # ml to kg
-                            elif ing_unit_lower == 'g' and req_unit_lower == 'ml':
-                                required_in_base_unit = float(required_amount) / 2.5  # ml to g
-                        elif req_unit_lower in conversion_factors and ing_unit_lower in conversion_factors[req_unit_lower]:
-                            # Convert from required unit to ingredient unit
-                            required_in_base_unit = float(required_amount) * conversion_factors[req_unit_lower][ing_unit_lower]
-                    
-                    if action == 'deduct':
-                        print(f"  Deducting {ingredient.name}: {required_amount}{required_unit} → {required_in_base_unit}{ingredient_unit}")
-                        print(f"    Current stock: {ingredient.stock}{ingredient_unit}")
-                        
-                        if ingredient.stock < required_in_base_unit:
-                            error_msg = f"Not enough {ingredient.name} in stock. Required: {required_in_base_unit}{ingredient_unit}, Available: {ingredient.stock}{ingredient_unit}"
-                            print(f"    ERROR: {error_msg}")
-                            raise ValueError(error_msg)
-                        
-                        ingredient.stock = F('stock') - required_in_base_unit
-                        ingredient.save()
-                        print(f"    Deducted successfully")
-                        processed_ingredients.append(f"{ingredient.name} (-{required_in_base_unit}{ingredient_unit})")
-                        
-                    elif action == 'return':
-                        ingredient.stock = F('stock') + required_amount
-                        ingredient.save()
-                        processed_ingredients.append(f"{ingredient.name} (+{required_amount})")
-            else:
-                # Handle non-deductable products
-                if action == 'deduct':
-                    if product.stock < quantity:
-                        raise ValueError(
-                            f"Not enough {product.name} in stock. "
-                            f"Required: {quantity}, Available: {product.stock}"
-                        )
-                    product.stock = F('stock') - quantity
-                    product.save()
-                    processed_ingredients.append(f"{product.name} (-{quantity})")
-                elif action == 'return':
-                    product.stock = F('stock') + quantity
-                    product.save()
-                    processed_ingredients.append(f"{product.name} (+{quantity})")
+        try:
+            results = ingest_orders(serializer.validated_data['orders'], changed_by=self.username())
+        except StockShortage as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        except IntegrityError:
+            # Another upload of the same queue got there first; a retry reports its orders as duplicates
+            return Response(
+                {'error': 'Some of these orders are being uploaded by another request, please retry'},
+                status=status.HTTP_409_CONFLICT
+            )
         
-        return processed_ingredients
+        counts = Counter(result['outcome'] for result in results.values())
+        return Response({
+            'created': counts[CREATED],
+            'duplicates': counts[DUPLICATE],
+            'rejected': counts[REJECTED],
+            # Completed sales recorded although the stock on hand didn't cover them or was reserved
+            'warnings': sum('warning' in result for result in results.values()),
+            'results': results
+        }, status=status.HTTP_207_MULTI_STATUS if counts[REJECTED] else status.HTTP_200_OK)
     
     @action(detail=True, methods=['patch'])
+    @idempotent
     @transaction.atomic
     def update_status(self, request, pk=None):
         """Special endpoint to update just the status of an order"""
-        order = self.get_object()
+        order = self.get_locked_object()
         
         # Validate the status is valid
         if 'status' not in request.data:
@@ -240,100 +238,30 @@ class OrderViewSet(viewsets.ModelViewSet):
             )
         
         old_status = order.status
+        if old_status == new_status:
+            return Response({'message': 'Status unchanged'}, status=status.HTTP_200_OK)
         
-        # Prevent cancellation during processing/preparing
-        if old_status in ['processing', 'preparing'] and new_status == 'cancelled':
-            return Response(
-                {'error': 'Cannot cancel order while it is being processed or prepared'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        # Checks the transition and the stock, then applies its stock effect, see orders/transitions.py
+        try:
+            history_entry, ingredient_changes = change_status(order, new_status, changed_by=self.username())
+        except (TransitionError, StockShortage) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
-        # Only update if status has changed
-        if order.status != new_status:
-            ingredient_changes = []
-            
-            # Check stock availability before completing
-            if new_status == "completed" and old_status != "completed":
-                stock_issues = []
-                
-                print(f"Checking stock for order {order.id}:")
-                for item in order.items.all():
-                    if item.product.deductable:
-                        available = item.product.get_available_stock()
-                        print(f"  Product: {item.product.name}, Available: {available}, Required: {item.quantity}")
-                        if available < item.quantity:
-                            stock_issues.append({
-                                'product': item.product.name,
-                                'available': available,
-                                'required': item.quantity,
-                                'shortage': item.quantity - available
-                            })
-                    else:
-                        if item.product.stock < item.quantity:
-                            stock_issues.append({
-                                'product': item.product.name,
-                                'available': item.product.stock,
-                                'required': item.quantity,
-                                'shortage': item.quantity - item.product.stock
-                            })
-                
-                if stock_issues:
-                    error_messages = []
-                    for issue in stock_issues:
-                        error_messages.append(
-                            f"{issue['product']}: Available {issue['available']}, Required {issue['required']} (shortage: {issue['shortage']})"
-                        )
-                    return Response(
-                        {'error': f"Cannot complete order due to insufficient stock: {'; '.join(error_messages)}"},
-                        status=status.HTTP_400_BAD_REQUEST
-                    )
-            
-            # Process ingredient stock changes based on status change
-            try:
-                # If new status is completed, deduct ingredients
-                if new_status == "completed" and old_status != "completed":
-                    print(f"Deducting ingredients for order {order.id}")
-                    ingredient_changes = self.process_ingredients(order, "deduct")
-                    print(f"Successfully deducted: {ingredient_changes}")
-                
-                # If cancelling from non-processing states, return ingredients
-                if new_status == "cancelled" and old_status not in ["processing", "preparing", "completed"]:
-                    ingredient_changes = self.process_ingredients(order, "return")
-                    
-                # Update order status
-                order.status = new_status
-                order.save()
-                
-                # Create history entry
-                username = None
-                if request.user.is_authenticated:
-                    username = request.user.username
-                    
-                history_entry = OrderStatusHistory.objects.create(
-                    order=order,
-                    status=new_status,
-                    changed_by=username
-                )
-                
-                return Response({
-                    'success': True,
-                    'message': f'Status updated from {old_status} to {new_status}',
-                    'status': new_status,
-                    'status_display': order.get_status_display(),
-                    'history_entry': OrderStatusHistorySerializer(history_entry).data,
-                    'ingredient_changes': ingredient_changes
-                })
-            except Exception as e:
-                # If any errors occur during stock processing, don't change the status
-                return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
-        else:
-            return Response({'message': 'Status unchanged'}, status=status.HTTP_200_OK)
+        return Response({
+            'success': True,
+            'message': f'Status updated from {old_status} to {new_status}',
+            'status': new_status,
+            'status_display': order.get_status_display(),
+            'history_entry': OrderStatusHistorySerializer(history_entry).data,
+            'ingredient_changes': ingredient_changes
+        })
 
     @action(detail=True, methods=['post'])
+    @idempotent
     @transaction.atomic
     def add_item(self, request, pk=None):
         """Add a new item to a pending order"""
-        order = self.get_object()
+        order = self.get_locked_object()
         
         # Only allow modifications for pending orders
         if order.status != "pending":
@@ -355,26 +283,25 @@ class OrderViewSet(viewsets.ModelViewSet):
         try:
             product = Product.objects.get(pk=product_id)
             quantity = int(quantity)
+            if quantity <= 0:
+                raise ValueError
             
-            # Check available stock
-            available = product.get_available_stock()
-            if available < quantity:
-                return Response(
-                    {'error': f'Not enough available. Only {available} {product.name} can be made with current ingredients.'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Create order item
-            order_item = OrderItem.objects.create(
-                order=order,
-                product=product,
-                quantity=quantity,
-                price=product.price
-            )
+            # Create order item and reserve stock for it, undoing both if it doesn't fit
+            try:
+                with transaction.atomic():
+                    order_item = OrderItem.objects.create(
+                        order=order,
+                        product=product,
+                        quantity=quantity,
+                        price=product.price
+                    )
+                    reserve_order(order)
+                    publish_order_event(ITEMS_CHANGED, order.pk)
+            except InsufficientStock as e:
+                return Response({'error': not_enough_message(e)}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Update order total
-            order.refresh_from_db()
-            order.update_total_price()
+            # The item's save already added its total to the order at the database
+            order.refresh_from_db(fields=['total_price'])
             
             return Response({
                 'success': True,
@@ -398,7 +325,7 @@ class OrderViewSet(viewsets.ModelViewSet):
     @transaction.atomic
     def update_item(self, request, pk=None):
         """Update an existing item in a pending order"""
-        order = self.get_object()
+        order = self.get_locked_object()
         
         # Only allow modifications for pending orders
         if order.status != "pending":
@@ -427,21 +354,18 @@ class OrderViewSet(viewsets.ModelViewSet):
             
             order_item = OrderItem.objects.get(pk=item_id, order=order)
             
-            # Check available stock for the new quantity
-            available = order_item.product.get_available_stock()
-            if available < new_quantity:
-                return Response(
-                    {'error': f'Not enough available. Only {available} {order_item.product.name} can be made with current ingredients.'}, 
-                    status=status.HTTP_400_BAD_REQUEST
-                )
-            
-            # Update quantity
-            order_item.quantity = new_quantity
-            order_item.save()
+            # Update quantity and the order's reservation, undoing both if it doesn't fit
+            try:
+                with transaction.atomic():
+                    order_item.quantity = new_quantity
+                    order_item.save()
+                    reserve_order(order)
+                    publish_order_event(ITEMS_CHANGED, order.pk)
+            except InsufficientStock as e:
+                return Response({'error': not_enough_message(e)}, status=status.HTTP_400_BAD_REQUEST)
             
-            # Update order total
-            order.refresh_from_db()
-            order.update_total_price()
+            # The item's save already added its total to the order at the database
+            order.refresh_from_db(fields=['total_price'])
             
             return Response({
                 'success': True,
@@ -462,23 +386,11 @@ class OrderViewSet(viewsets.ModelViewSet):
             )
 
     @action(detail=True, methods=['post'])
+    @idempotent
     @transaction.atomic
     def cancel_order(self, request, pk=None):
         """Custom endpoint for safe order cancellation"""
-        order = self.get_object()
-        
-        # Check if order can be cancelled
-        if order.status in ['processing', 'preparing']:
-            return Response(
-                {'error': 'Cannot cancel order while it is being processed'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if order.status == 'completed':
-            return Response(
-                {'error': 'Cannot cancel completed order'}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        order = self.get_locked_object()
         
         if order.status == 'cancelled':
             return Response(
@@ -486,20 +398,14 @@ class OrderViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
+        # Gives back the reserved stock; processing and completed orders can't be cancelled
         try:
-            # Cancel the order and return ingredients
-            serializer = self.get_serializer(order, data={'status': 'cancelled'}, partial=True)
-            serializer.is_valid(raise_exception=True)
-            self.perform_update(serializer)
-            
-            return Response({
-                'success': True,
-                'message': 'Order cancelled successfully',
-                'order': serializer.data
-            })
-            
-        except serializers.ValidationError as e:
-            return Response(
-                {'error': str(e.detail)}, 
-                status=status.HTTP_400_BAD_REQUEST
-            )
+            change_status(order, 'cancelled', changed_by=self.username())
+        except TransitionError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'success': True,
+            'message': 'Order cancelled successfully',
+            'order': self.get_serializer(order).data
+        })
@@ -1,19 +1,47 @@
 from django.contrib import admin
-from .models import Product, ProductIngredient
+from .models import Product, ProductIngredient, SubRecipe, SubRecipeIngredient, SubRecipeComponent, ProductSubRecipe
 
 class ProductIngredientInline(admin.TabularInline):
     model = ProductIngredient
     extra = 1
 
+class ProductSubRecipeInline(admin.TabularInline):
+    model = ProductSubRecipe
+    extra = 1
+
+class SubRecipeIngredientInline(admin.TabularInline):
+    model = SubRecipeIngredient
+    extra = 1
+
+class SubRecipeComponentInline(admin.TabularInline):
+    model = SubRecipeComponent
+    fk_name = 'parent'
+    extra = 1
+
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
-    list_display = ('name', 'price', 'stock', 'deductable', 'created_at')
+    list_display = ('name', 'price', 'stock', 'available_stock', 'deductable', 'created_at')
     list_filter = ('deductable', 'created_at')
     search_fields = ('name', 'description')
-    inlines = [ProductIngredientInline]
+    inlines = [ProductIngredientInline, ProductSubRecipeInline]
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).select_related('availability')
+    
+    @admin.display(description='Available stock')
+    def available_stock(self, obj):
+        # availability is joined in get_queryset, so this doesn't query per row
+        return obj.get_available_stock()
 
 @admin.register(ProductIngredient)
 class ProductIngredientAdmin(admin.ModelAdmin):
     list_display = ('product', 'ingredient', 'quantity')
     list_filter = ('product', 'ingredient')
     search_fields = ('product__name', 'ingredient__name')
+
+
+@admin.register(SubRecipe)
+class SubRecipeAdmin(admin.ModelAdmin):
+    list_display = ('name', 'updated_at')
+    search_fields = ('name', 'description')
+    inlines = [SubRecipeIngredientInline, SubRecipeComponentInline]
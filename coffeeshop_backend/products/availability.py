@@ -0,0 +1,118 @@
+"""
+Bulk availability engine.
+
+Loads the recipes and ingredient stock for any number of products in two
+queries and computes how many units of each product can be made, so whole
+menu views never fall back to per-product queries.
+"""
+from .models import Product, ProductAvailability
+from .recipes import load_product_recipes, products_using_ingredients
+from ingredient_inventory.models import Ingredient
+from coffeeshop_backend.log import get_logger, SAMPLED
+import logging
+
+logger = get_logger(__name__)
+
+
+# Guards against float error turning e.g. 4.9999999 possible units into 4
+ROUNDING_TOLERANCE = 1e-9
+
+
+def load_requirements(product_ids=None):
+    """
+    Build the requirement matrix {product_id: {ingredient_id: amount}} where
+    amount is expressed in the ingredient's own unit (sub-recipes flattened),
+    plus the vector of free ingredient stock {ingredient_id: stock - reserved}.
+    """
+    requirements = load_product_recipes(product_ids)
+
+    ingredient_ids = set()
+    for recipe in requirements.values():
+        ingredient_ids.update(recipe)
+    # Stock held by pending orders' reservations can't be promised again
+    stock = {
+        pk: float(value - reserved)
+        for pk, value, reserved in Ingredient.objects.filter(pk__in=ingredient_ids).values_list('pk', 'stock', 'reserved')
+    }
+    return requirements, stock
+
+
+def compute_available_stock(product_ids=None):
+    """
+    Return {product_id: units that can be made} for deductable products.
+    Products without a recipe can't be made and get 0.
+    """
+    products = Product.objects.filter(deductable=True)
+    if product_ids is not None:
+        products = products.filter(pk__in=set(product_ids))
+    product_ids = list(products.values_list('pk', flat=True))
+
+    requirements, stock = load_requirements(product_ids)
+
+    result = {}
+    for product_id in product_ids:
+        recipe = requirements.get(product_id)
+        if not recipe:
+            result[product_id] = 0
+            continue
+        possible = min(stock[ingredient_id] / amount for ingredient_id, amount in recipe.items())
+        result[product_id] = max(0, int(possible + ROUNDING_TOLERANCE))
+
+        if logger.isEnabledFor(logging.DEBUG):
+            for ingredient_id, amount in recipe.items():
+                logger.debug(
+                    "Product %s: ingredient %s stock %s, required %s per unit",
+                    product_id, ingredient_id, stock[ingredient_id], amount, extra=SAMPLED,
+                )
+            logger.debug("Product %s: %s units available", product_id, result[product_id])
+    return result
+
+
+def refresh_products(product_ids):
+    """Recalculate and persist availability for the given products in one pass"""
+    available = compute_available_stock(product_ids)
+    # Rows are written in pk order so concurrent refreshes lock them in the same order
+    ProductAvailability.objects.bulk_create(
+        [ProductAvailability(product_id=pk, available_stock=value) for pk, value in sorted(available.items())],
+        update_conflicts=True,
+        unique_fields=['product'],
+        update_fields=['available_stock', 'updated_at'],
+    )
+    return available
+
+
+def refresh_for_ingredients(ingredient_ids):
+    """Recalculate availability for every product that uses one of the ingredients"""
+    refresh_products(products_using_ingredients(ingredient_ids))
+
+
+def get_available_stock_map(products):
+    """
+    Return {product_id: available stock} for a list of products.
+    Uses the materialized records (prefetched or fetched in one query) and
+    only computes the ones that are missing.
+    """
+    products = list(products)
+    result = {}
+    missing = []
+    for product in products:
+        if not product.deductable:
+            result[product.pk] = product.get_available_stock()
+        elif Product.availability.is_cached(product):
+            try:
+                result[product.pk] = product.availability.available_stock
+            except ProductAvailability.DoesNotExist:
+                missing.append(product.pk)
+        else:
+            missing.append(product.pk)
+
+    if missing:
+        stored = dict(
+            ProductAvailability.objects.filter(product_id__in=missing)
+            .values_list('product_id', 'available_stock')
+        )
+        result.update(stored)
+        unknown = [pk for pk in missing if pk not in stored]
+        if unknown:
+            result.update(refresh_products(unknown))
+    return result
@@ -0,0 +1,85 @@
+"""
+Product image variants.
+
+When a product image is uploaded we generate a small set of resized JPEGs
+once, named after a hash of their content. Because a name never points at
+different bytes, the files can be cached by clients forever (see
+coffeeshop_backend.media.serve_media) and POS tablets only download the size
+they actually display.
+"""
+import hashlib
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from coffeeshop_backend.log import get_logger
+
+logger = get_logger(__name__)
+
+# Variant name -> maximum (width, height), aspect ratio is preserved
+VARIANTS = {
+    'thumbnail': (160, 160),
+    'card': (480, 480),
+    'full': (1200, 1200),
+}
+
+VARIANT_DIR = 'products/variants/'
+JPEG_QUALITY = 82
+
+
+def _render(source, size):
+    """Return JPEG bytes of source scaled down to fit within size"""
+    image = source.copy()
+    image.thumbnail(size, Image.LANCZOS)
+    buffer = BytesIO()
+    image.save(buffer, format='JPEG', quality=JPEG_QUALITY, optimize=True, progressive=True)
+    return buffer.getvalue()
+
+
+def generate_variants(product):
+    """
+    Generate every variant for product.image and return
+    {'source': image name, variant: storage path}. Returns {} if the
+    product has no image or it can't be read.
+    """
+    if not product.image:
+        return {}
+
+    storage = product.image.storage
+    try:
+        with product.image.open('rb') as image_file:
+            source = ImageOps.exif_transpose(Image.open(image_file))
+            source = source.convert('RGB')
+    except (OSError, ValueError):
+        logger.warning("Could not read image %s for product %s", product.image.name, product.pk)
+        return {}
+
+    variants = {'source': product.image.name}
+    for name, size in VARIANTS.items():
+        content = _render(source, size)
+        digest = hashlib.sha256(content).hexdigest()[:16]
+        path = f'{VARIANT_DIR}{digest}-{name}.jpg'
+        # Same bytes always hash to the same name, so an existing file can be reused
+        if not storage.exists(path):
+            path = storage.save(path, ContentFile(content))
+        variants[name] = path
+    return variants
+
+
+def variant_urls(product, request=None):
+    """Absolute URLs for each generated variant of product.image"""
+    if not product.image or product.image_variants.get('source') != product.image.name:
+        return {}
+
+    storage = product.image.storage
+    urls = {}
+    for name in VARIANTS:
+        path = product.image_variants.get(name)
+        if not path:
+            continue
+        url = storage.url(path)
+        if request is not None and not url.startswith('http'):
+            url = request.build_absolute_uri(url)
+        urls[name] = url
+    return urls
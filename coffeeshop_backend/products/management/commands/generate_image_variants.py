@@ -0,0 +1,20 @@
+from django.core.management.base import BaseCommand
+from products.models import Product
+from products.images import generate_variants
+
+
+class Command(BaseCommand):
+    help = 'Generate thumbnail, card and full size variants for product images'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Regenerate variants that already exist')
+
+    def handle(self, *args, **options):
+        count = 0
+        for product in Product.objects.exclude(image='').exclude(image__isnull=True):
+            if not options['force'] and product.image_variants.get('source') == product.image.name:
+                continue
+            variants = generate_variants(product)
+            Product.objects.filter(pk=product.pk).update(image_variants=variants)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(f'Generated image variants for {count} products.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from products.models import Product
+from products.availability import refresh_products
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the materialized available stock for all deductable products'
+
+    def handle(self, *args, **options):
+        product_ids = list(Product.objects.filter(deductable=True).values_list('pk', flat=True))
+        refresh_products(product_ids)
+        self.stdout.write(
+            self.style.SUCCESS(f'Refreshed availability for {len(product_ids)} products.')
+        )
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:09
+
+from django.db import migrations, models
+
+
+def resolve_conversion_factors(apps, schema_editor):
+    from products import units
+
+    ProductIngredient = apps.get_model('products', 'ProductIngredient')
+    rows = list(ProductIngredient.objects.select_related('ingredient'))
+    for row in rows:
+        factor = units.conversion_factor(row.required_unit, row.ingredient.unit)
+        row.conversion_factor = factor if factor is not None else 1.0
+    ProductIngredient.objects.bulk_update(rows, ['conversion_factor'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('products', '0003_product_availability'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='productingredient',
+            name='conversion_factor',
+            field=models.FloatField(default=1, editable=False, help_text="Multiplier from required_unit to the ingredient's unit, resolved on save"),
+        ),
+        migrations.RunPython(resolve_conversion_factors, migrations.RunPython.noop),
+    ]
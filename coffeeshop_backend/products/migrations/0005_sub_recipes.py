@@ -0,0 +1,74 @@
+# Generated by Django 5.2.18 on 2026-10-17 07:12
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ingredient_inventory', '0001_initial'),
+        ('products', '0004_productingredient_conversion_factor'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SubRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('description', models.TextField(blank=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='SubRecipeIngredient',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('required_unit', models.CharField(default='g', help_text='Unit for the required quantity (e.g., ml, g, kg)', max_length=10)),
+                ('conversion_factor', models.FloatField(default=1, editable=False, help_text="Multiplier from required_unit to the ingredient's unit, resolved on save")),
+                ('quantity', models.DecimalField(decimal_places=2, help_text='Quantity of ingredient used per portion', max_digits=8)),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sub_recipe_ingredients', to='ingredient_inventory.ingredient')),
+                ('sub_recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sub_recipe_ingredients', to='products.subrecipe')),
+            ],
+            options={
+                'verbose_name': 'Sub-recipe Ingredient',
+                'verbose_name_plural': 'Sub-recipe Ingredients',
+                'unique_together': {('sub_recipe', 'ingredient')},
+            },
+        ),
+        migrations.AddField(
+            model_name='subrecipe',
+            name='ingredients',
+            field=models.ManyToManyField(blank=True, related_name='sub_recipes', through='products.SubRecipeIngredient', to='ingredient_inventory.ingredient'),
+        ),
+        migrations.CreateModel(
+            name='ProductSubRecipe',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, help_text='Portions of the sub-recipe used per product unit', max_digits=8)),
+                ('product', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_sub_recipes', to='products.product')),
+                ('sub_recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='product_sub_recipes', to='products.subrecipe')),
+            ],
+            options={
+                'verbose_name': 'Product Sub-recipe',
+                'verbose_name_plural': 'Product Sub-recipes',
+                'unique_together': {('product', 'sub_recipe')},
+            },
+        ),
+        migrations.CreateModel(
+            name='SubRecipeComponent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('quantity', models.DecimalField(decimal_places=2, help_text='Portions of the sub-recipe used per portion of the parent', max_digits=8)),
+                ('parent', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='components', to='products.subrecipe')),
+                ('sub_recipe', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='used_in', to='products.subrecipe')),
+            ],
+            options={
+                'verbose_name': 'Sub-recipe Component',
+                'verbose_name_plural': 'Sub-recipe Components',
+                'unique_together': {('parent', 'sub_recipe')},
+            },
+        ),
+    ]
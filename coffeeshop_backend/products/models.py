@@ -1,119 +1,66 @@
 from django.db import models
+from django.core.exceptions import ValidationError
 from ingredient_inventory.models import Ingredient
-from decimal import Decimal
-import math
+from . import units
+from coffeeshop_backend.log import get_logger
+
+logger = get_logger(__name__)
 
 class Product(models.Model):
     name = models.CharField(max_length=100)
     price = models.DecimalField(max_digits=6, decimal_places=2)
     stock = models.PositiveIntegerField()
+    reserved = models.PositiveIntegerField(default=0, editable=False, help_text="Units of a non-deductable product held by live order reservations")
     description = models.TextField(blank=True)
     image = models.ImageField(upload_to='products/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False, help_text="Resized copies of image, see products/images.py")
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     deductable = models.BooleanField(default=False, help_text="If checked, selling this product will deduct ingredients from inventory")
     ingredients = models.ManyToManyField(Ingredient, through='ProductIngredient', related_name='products', blank=True)
 
+    def save(self, *args, **kwargs):
+        # reserved is only changed through F() updates (orders.reservations.adjust_reserved);
+        # writing back the loaded value would undo reservations made since it was read
+        if not self._state.adding:
+            update_fields = kwargs.get('update_fields')
+            if update_fields is None:
+                update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+            kwargs['update_fields'] = [name for name in update_fields if name != 'reserved']
+        super().save(*args, **kwargs)
+
     def get_available_stock(self):
+        """
+        Return available stock based on either:
+        - For deductable products: The materialized ProductAvailability record
+        - For non-deductable products: The product's stock field minus reserved units
+        """
+        if not self.deductable:
+            return max(0, self.stock - self.reserved)
+        
+        try:
+            return self.availability.available_stock
+        except ProductAvailability.DoesNotExist:
+            # No record yet (e.g. product created before the table existed)
+            return self.refresh_availability()
+    
+    def refresh_availability(self):
+        """Recalculate and persist the availability record for this product"""
+        from .availability import refresh_products
+        return refresh_products([self.pk]).get(self.pk, 0)
+    
+    def calculate_available_stock(self):
         """
         Calculate available stock based on either:
         - For deductable products: The maximum possible units based on available ingredients
-        - For non-deductable products: The product's stock field
+        - For non-deductable products: The product's stock field minus reserved units
         """
         if not self.deductable:
-            # For non-deductable products, just return the stock field
-            return self.stock
+            # For non-deductable products, just return the unreserved stock
+            return max(0, self.stock - self.reserved)
         
-        # For deductable products, calculate based on ingredients
-        available_units = float('inf')
-        
-        # Get all ingredients for this product
-        product_ingredients = self.product_ingredients.select_related('ingredient').all()
-        
-        # If no ingredients defined, product can't be made
-        if not product_ingredients.exists():
-            return 0
-        
-        # Debug: Print current ingredients
-        print(f"Calculating stock for {self.name}:")
-        
-        # Check each ingredient
-        for product_ingredient in product_ingredients:
-            ingredient = product_ingredient.ingredient
-            required_amount = float(product_ingredient.quantity)
-            required_unit = str(product_ingredient.required_unit).lower().strip()
-            ingredient_unit = str(ingredient.unit).lower().strip()
-            ingredient_stock = float(ingredient.stock)
-            
-            print(f"  Ingredient: {ingredient.name}")
-            print(f"    Stock: {ingredient_stock} {ingredient_unit}")
-            print(f"    Required: {required_amount} {required_unit}")
-            
-            if required_amount <= 0:
-                print(f"    SKIP: Required amount is {required_amount}")
-                continue
-            
-            # Unit conversion with special handling for coffee
-            # Format: 'from_unit': {'to_unit': multiplier}
-            # Example: 1kg = 1000g, so kg->g multiplier is 1000
-            conversion_factors = {
-                'g': {'kg': 0.001, 'mg': 1000, 'g': 1, 'tsp': 0.2, 'tbsp': 0.067},
-                'kg': {'g': 1000, 'mg': 1000000, 'kg': 1, 'tsp': 200, 'tbsp': 67},
-                'ml': {'l': 0.001, 'cl': 0.1, 'ml': 1, 'tsp': 0.2, 'tbsp': 0.067},
-                'l': {'ml': 1000, 'cl': 10, 'l': 1, 'tsp': 200, 'tbsp': 67},
-                'pcs': {'pcs': 1, 'dozen': 0.0833, 'unit': 1},
-                'tbsp': {'tbsp': 1, 'tsp': 3, 'ml': 15, 'g': 15},
-                'tsp': {'tsp': 1, 'tbsp': 0.333333, 'ml': 5, 'g': 5},
-            }
-            
-            # Special conversion for coffee beans: ml to kg
-            # Approximate: 1ml coffee beans ≈ 0.4g (varies by grind and bean density)
-            special_conversions = {
-                ('kg', 'ml'): 0.0004,  # 1ml = 0.0004kg = 0.4g
-                ('g', 'ml'): 0.4,     # 1ml = 0.4g
-            }
-            
-            # Calculate converted stock with special handling
-            converted_stock = ingredient_stock
-            conversion_found = False
-            
-            # Try standard conversion first
-            if ingredient_unit == required_unit:
-                converted_stock = ingredient_stock
-                conversion_found = True
-            elif ingredient_unit in conversion_factors and required_unit in conversion_factors[ingredient_unit]:
-                conversion_factor = conversion_factors[ingredient_unit][required_unit]
-                converted_stock = ingredient_stock * conversion_factor
-                print(f"    Standard conversion: {ingredient_stock} {ingredient_unit} = {converted_stock} {required_unit}")
-                conversion_found = True
-            elif (ingredient_unit, required_unit) in [('kg', 'ml'), ('g', 'ml')]:
-                # Special coffee beans conversion: mass to volume
-                if ingredient_unit == 'kg' and required_unit == 'ml':
-                    converted_stock = ingredient_stock * 2500  # 1kg ≈ 2500ml coffee beans
-                    print(f"    Coffee conversion: {ingredient_stock}kg = {converted_stock}ml")
-                    conversion_found = True
-                elif ingredient_unit == 'g' and required_unit == 'ml':
-                    converted_stock = ingredient_stock * 2.5  # 1g ≈ 2.5ml coffee beans
-                    print(f"    Coffee conversion: {ingredient_stock}g = {converted_stock}ml")
-                    conversion_found = True
-            
-            if not conversion_found:
-                print(f"    WARNING: No conversion available: {ingredient_unit} to {required_unit}")
-                print(f"    Assuming 1:1 ratio for calculation")
-                # Use 1:1 ratio as fallback instead of skipping
-                converted_stock = ingredient_stock
-            
-            # Calculate possible units
-            possible_units = converted_stock / required_amount
-            possible_units = max(0, int(possible_units))
-            
-            print(f"    Can make: {possible_units} units")
-            
-            available_units = min(available_units, possible_units)
-        
-        result = max(0, int(available_units))
-        print(f"  FINAL: {result} units available")
-        return result
+        from .availability import compute_available_stock
+        return compute_available_stock([self.pk]).get(self.pk, 0)
     
     @property
     def available_stock(self):
@@ -124,11 +71,62 @@ class Product(models.Model):
         return self.name
 
 
-class ProductIngredient(models.Model):
+class IngredientLine(models.Model):
+    """
+    Shared behaviour for recipe rows that use an amount of a raw ingredient.
+    Subclasses define the `ingredient` and `quantity` fields.
+    """
+    required_unit = models.CharField(max_length=10, help_text="Unit for the required quantity (e.g., ml, g, kg)", default='g')
+    conversion_factor = models.FloatField(default=1, editable=False, help_text="Multiplier from required_unit to the ingredient's unit, resolved on save")
+    
+    class Meta:
+        abstract = True
+    
+    def resolve_conversion_factor(self):
+        """
+        Look up the required_unit -> ingredient unit factor in the unit registry.
+        Raises units.ConversionError between volume and mass when the
+        ingredient has no density.
+        """
+        ingredient = self.ingredient
+        factor = units.conversion_factor(self.required_unit, ingredient.unit, ingredient.density)
+        if factor is None and units.needs_density(self.required_unit, ingredient.unit):
+            raise units.ConversionError(
+                f"Can't convert {self.required_unit} to {ingredient.unit} for {ingredient.name} without its density"
+            )
+        if factor is None:
+            logger.warning(
+                "No conversion available: %s to %s for %s, assuming 1:1 ratio",
+                self.required_unit, ingredient.unit, ingredient.name,
+            )
+            factor = 1.0
+        self.conversion_factor = factor
+        return self.conversion_factor
+    
+    def clean(self):
+        if self.ingredient_id is None:
+            return
+        try:
+            self.resolve_conversion_factor()
+        except units.ConversionError as error:
+            raise ValidationError({'required_unit': str(error)})
+    
+    def save(self, *args, **kwargs):
+        self.resolve_conversion_factor()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = set(kwargs['update_fields']) | {'conversion_factor'}
+        super().save(*args, **kwargs)
+    
+    @property
+    def amount_in_ingredient_unit(self):
+        """Quantity needed per unit, expressed in the ingredient's unit"""
+        return float(self.quantity) * self.conversion_factor
+
+
+class ProductIngredient(IngredientLine):
     product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product_ingredients')
     ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='product_ingredients')
     quantity = models.DecimalField(max_digits=8, decimal_places=2, help_text="Quantity of ingredient used per product unit")
-    required_unit = models.CharField(max_length=10, help_text="Unit for the required quantity (e.g., ml, g, kg)", default='g')
     
     class Meta:
         unique_together = ('product', 'ingredient')
@@ -138,3 +136,85 @@ class ProductIngredient(models.Model):
     def __str__(self):
         return f"{self.product.name} - {self.ingredient.name}: {self.quantity} {self.required_unit}"
 
+
+class SubRecipe(models.Model):
+    """
+    A shared intermediate such as an espresso shot, a syrup or cold brew
+    concentrate. Products use portions of it instead of repeating its
+    ingredients, and sub-recipes can themselves use other sub-recipes.
+    """
+    name = models.CharField(max_length=100, unique=True)
+    description = models.TextField(blank=True)
+    ingredients = models.ManyToManyField(Ingredient, through='SubRecipeIngredient', related_name='sub_recipes', blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    def __str__(self):
+        return self.name
+
+
+class SubRecipeIngredient(IngredientLine):
+    sub_recipe = models.ForeignKey(SubRecipe, on_delete=models.CASCADE, related_name='sub_recipe_ingredients')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE, related_name='sub_recipe_ingredients')
+    quantity = models.DecimalField(max_digits=8, decimal_places=2, help_text="Quantity of ingredient used per portion")
+    
+    class Meta:
+        unique_together = ('sub_recipe', 'ingredient')
+        verbose_name = "Sub-recipe Ingredient"
+        verbose_name_plural = "Sub-recipe Ingredients"
+    
+    def __str__(self):
+        return f"{self.sub_recipe.name} - {self.ingredient.name}: {self.quantity} {self.required_unit}"
+
+
+class SubRecipeComponent(models.Model):
+    """A sub-recipe used inside another sub-recipe"""
+    parent = models.ForeignKey(SubRecipe, on_delete=models.CASCADE, related_name='components')
+    sub_recipe = models.ForeignKey(SubRecipe, on_delete=models.CASCADE, related_name='used_in')
+    quantity = models.DecimalField(max_digits=8, decimal_places=2, help_text="Portions of the sub-recipe used per portion of the parent")
+    
+    class Meta:
+        unique_together = ('parent', 'sub_recipe')
+        verbose_name = "Sub-recipe Component"
+        verbose_name_plural = "Sub-recipe Components"
+    
+    def clean(self):
+        from .recipes import creates_cycle
+        if creates_cycle(self.parent_id, self.sub_recipe_id):
+            raise ValidationError({'sub_recipe': "A sub-recipe can't contain itself, directly or indirectly."})
+    
+    def __str__(self):
+        return f"{self.parent.name} - {self.sub_recipe.name}: {self.quantity}"
+
+
+class ProductSubRecipe(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE, related_name='product_sub_recipes')
+    sub_recipe = models.ForeignKey(SubRecipe, on_delete=models.CASCADE, related_name='product_sub_recipes')
+    quantity = models.DecimalField(max_digits=8, decimal_places=2, help_text="Portions of the sub-recipe used per product unit")
+    
+    class Meta:
+        unique_together = ('product', 'sub_recipe')
+        verbose_name = "Product Sub-recipe"
+        verbose_name_plural = "Product Sub-recipes"
+    
+    def __str__(self):
+        return f"{self.product.name} - {self.sub_recipe.name}: {self.quantity}"
+
+
+class ProductAvailability(models.Model):
+    """
+    Materialized available stock for deductable products.
+    Kept up to date by the signals in products/signals.py whenever an
+    ingredient's stock or a product's recipe changes.
+    """
+    product = models.OneToOneField(Product, on_delete=models.CASCADE, primary_key=True, related_name='availability')
+    available_stock = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        verbose_name = "Product Availability"
+        verbose_name_plural = "Product Availability"
+    
+    def __str__(self):
+        return f"{self.product.name}: {self.available_stock} available"
+
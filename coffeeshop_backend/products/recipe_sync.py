@@ -0,0 +1,94 @@
+"""
+Recipe sync.
+
+Makes the ProductIngredient rows of one or many products match a submitted
+recipe by diffing against the existing rows: only new ingredients are
+inserted, changed rows updated and dropped ones deleted, with a fixed number
+of queries however long the recipes are. Everything happens in one
+transaction, so concurrent readers never see a product without its recipe.
+"""
+from django.db import transaction
+
+from ingredient_inventory.models import Ingredient
+from .models import ProductIngredient
+from .units import ConversionError
+from .availability import refresh_products
+from .search import index as search_index
+from .signals import defer_recipe_signals
+
+
+def sync_product_recipes(recipes):
+    """
+    recipes: {product_id: [{'ingredient': id, 'quantity': Decimal, 'required_unit': unit or None}]}
+    with one entry per ingredient. A missing required_unit defaults to the
+    ingredient's own unit, and an optional 'item' is the submitted data
+    echoed back in errors.
+
+    Returns (results, errors) where results is
+    {product_id: {'created': [rows], 'updated': [rows], 'deleted': count}}
+    and errors lists the submitted rows whose ingredient doesn't exist or
+    whose required_unit can't be converted to the ingredient's unit.
+    """
+    ingredient_ids = {row['ingredient'] for rows in recipes.values() for row in rows}
+    ingredients = Ingredient.objects.in_bulk(ingredient_ids)
+
+    errors = []
+    results = {}
+    to_create = []
+    to_update = []
+    to_delete = []
+
+    with transaction.atomic(), defer_recipe_signals():
+        existing = {}
+        for line in ProductIngredient.objects.select_for_update().filter(product_id__in=recipes):
+            existing[(line.product_id, line.ingredient_id)] = line
+
+        for product_id, rows in recipes.items():
+            result = results[product_id] = {'created': [], 'updated': [], 'deleted': 0}
+            submitted = set()
+            for row in rows:
+                ingredient = ingredients.get(row['ingredient'])
+                if ingredient is None:
+                    errors.append({"error": f"Ingredient with ID {row['ingredient']} not found", "item": row.get('item', row)})
+                    continue
+                submitted.add(ingredient.pk)
+                required_unit = row.get('required_unit') or ingredient.unit
+
+                line = existing.get((product_id, ingredient.pk))
+                try:
+                    if line is None:
+                        line = ProductIngredient(
+                            product_id=product_id, ingredient=ingredient,
+                            quantity=row['quantity'], required_unit=required_unit,
+                        )
+                        line.resolve_conversion_factor()
+                        to_create.append(line)
+                        result['created'].append(line)
+                    elif line.quantity != row['quantity'] or line.required_unit != required_unit:
+                        line.ingredient = ingredient
+                        line.quantity = row['quantity']
+                        line.required_unit = required_unit
+                        line.resolve_conversion_factor()
+                        to_update.append(line)
+                        result['updated'].append(line)
+                except ConversionError as error:
+                    # An existing row is left as it was
+                    errors.append({"error": str(error), "item": row.get('item', row)})
+
+            for (line_product_id, ingredient_id), line in existing.items():
+                if line_product_id == product_id and ingredient_id not in submitted:
+                    to_delete.append(line.pk)
+                    result['deleted'] += 1
+
+        if to_delete:
+            ProductIngredient.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            ProductIngredient.objects.bulk_update(to_update, ['quantity', 'required_unit', 'conversion_factor'])
+        if to_create:
+            ProductIngredient.objects.bulk_create(to_create)
+
+        # Bulk writes skip the per-row signals, so refresh every product once here
+        refresh_products(list(recipes))
+        search_index.mark_stale(recipes)
+
+    return results, errors
@@ -0,0 +1,145 @@
+"""
+Recipe graph.
+
+Products use raw ingredients directly (ProductIngredient) and portions of
+shared sub-recipes (ProductSubRecipe). Sub-recipes use raw ingredients and
+other sub-recipes in turn. This module flattens that graph into the amount of
+each raw ingredient needed per product unit, expanding every sub-recipe once
+no matter how many products share it.
+"""
+from collections import defaultdict, deque
+from .models import ProductIngredient, ProductSubRecipe, SubRecipeIngredient, SubRecipeComponent
+
+
+class RecipeCycleError(ValueError):
+    """Raised when sub-recipes contain each other"""
+
+
+def _component_graph():
+    """{parent_id: [(sub_recipe_id, portions)]} for every nested sub-recipe"""
+    graph = defaultdict(list)
+    for parent_id, sub_recipe_id, quantity in SubRecipeComponent.objects.filter(
+        quantity__gt=0
+    ).values_list('parent_id', 'sub_recipe_id', 'quantity'):
+        graph[parent_id].append((sub_recipe_id, float(quantity)))
+    return graph
+
+
+def _reachable(graph, roots):
+    """All nodes reachable from roots, including the roots themselves"""
+    seen = set(roots)
+    queue = deque(roots)
+    while queue:
+        node = queue.popleft()
+        for child, _ in graph.get(node, ()):
+            if child not in seen:
+                seen.add(child)
+                queue.append(child)
+    return seen
+
+
+def expand_sub_recipes(sub_recipe_ids):
+    """
+    Return {sub_recipe_id: {ingredient_id: amount per portion}} for the given
+    sub-recipes and everything nested in them, amounts in ingredient units.
+
+    Nodes are expanded in topological order (nested sub-recipes before the
+    ones using them) so each is computed exactly once. Costs two queries.
+    """
+    graph = _component_graph()
+    nodes = _reachable(graph, set(sub_recipe_ids))
+
+    own = defaultdict(dict)
+    for sub_recipe_id, ingredient_id, quantity, factor in SubRecipeIngredient.objects.filter(
+        sub_recipe_id__in=nodes, quantity__gt=0
+    ).values_list('sub_recipe_id', 'ingredient_id', 'quantity', 'conversion_factor'):
+        own[sub_recipe_id][ingredient_id] = float(quantity) * factor
+
+    # Kahn's algorithm on the reversed edges: a node is ready once all of
+    # the sub-recipes it uses have been expanded
+    pending = {node: len(graph.get(node, ())) for node in nodes}
+    users = defaultdict(list)
+    for parent in nodes:
+        for child, _ in graph.get(parent, ()):
+            users[child].append(parent)
+    ready = deque(node for node, count in pending.items() if count == 0)
+
+    expanded = {}
+    while ready:
+        node = ready.popleft()
+        totals = dict(own.get(node, {}))
+        for child, portions in graph.get(node, ()):
+            for ingredient_id, amount in expanded[child].items():
+                totals[ingredient_id] = totals.get(ingredient_id, 0) + amount * portions
+        expanded[node] = totals
+        for parent in users[node]:
+            pending[parent] -= 1
+            if pending[parent] == 0:
+                ready.append(parent)
+
+    if len(expanded) != len(nodes):
+        raise RecipeCycleError("Sub-recipes contain each other: %s" % sorted(set(nodes) - set(expanded)))
+    return expanded
+
+
+def load_product_recipes(product_ids=None):
+    """
+    Return {product_id: {ingredient_id: amount per product unit}} with every
+    sub-recipe flattened into raw ingredients, amounts in ingredient units.
+    """
+    direct = ProductIngredient.objects.filter(quantity__gt=0)
+    uses = ProductSubRecipe.objects.filter(quantity__gt=0)
+    if product_ids is not None:
+        direct = direct.filter(product_id__in=set(product_ids))
+        uses = uses.filter(product_id__in=set(product_ids))
+
+    recipes = defaultdict(dict)
+    for product_id, ingredient_id, quantity, factor in direct.values_list(
+        'product_id', 'ingredient_id', 'quantity', 'conversion_factor'
+    ):
+        recipes[product_id][ingredient_id] = float(quantity) * factor
+
+    uses = list(uses.values_list('product_id', 'sub_recipe_id', 'quantity'))
+    if uses:
+        expanded = expand_sub_recipes({sub_recipe_id for _, sub_recipe_id, _ in uses})
+        for product_id, sub_recipe_id, portions in uses:
+            recipe = recipes[product_id]
+            for ingredient_id, amount in expanded[sub_recipe_id].items():
+                recipe[ingredient_id] = recipe.get(ingredient_id, 0) + amount * float(portions)
+    return recipes
+
+
+def creates_cycle(parent_id, sub_recipe_id):
+    """Whether using sub_recipe_id inside parent_id would make a sub-recipe contain itself"""
+    if parent_id is None or sub_recipe_id is None:
+        return False
+    return parent_id in _reachable(_component_graph(), {sub_recipe_id})
+
+
+def sub_recipes_using(sub_recipe_ids):
+    """The given sub-recipes plus every sub-recipe that (indirectly) contains one of them"""
+    parents = defaultdict(list)
+    for parent_id, sub_recipe_id in SubRecipeComponent.objects.values_list('parent_id', 'sub_recipe_id'):
+        parents[sub_recipe_id].append((parent_id, None))
+    return _reachable(parents, set(sub_recipe_ids))
+
+
+def products_using_sub_recipes(sub_recipe_ids):
+    """Ids of products that use one of the sub-recipes, directly or nested"""
+    return set(ProductSubRecipe.objects.filter(
+        sub_recipe_id__in=sub_recipes_using(sub_recipe_ids)
+    ).values_list('product_id', flat=True))
+
+
+def products_using_ingredients(ingredient_ids):
+    """Ids of products whose flattened recipe includes one of the ingredients"""
+    ingredient_ids = set(ingredient_ids)
+    product_ids = set(ProductIngredient.objects.filter(
+        ingredient_id__in=ingredient_ids
+    ).values_list('product_id', flat=True))
+    sub_recipe_ids = set(SubRecipeIngredient.objects.filter(
+        ingredient_id__in=ingredient_ids
+    ).values_list('sub_recipe_id', flat=True))
+    if sub_recipe_ids:
+        product_ids |= products_using_sub_recipes(sub_recipe_ids)
+    return product_ids
@@ -0,0 +1,191 @@
+"""
+In-memory product search for POS lookup.
+
+Each worker process keeps an index of product names, descriptions and the
+names of the ingredients and sub-recipes they use, so "oat" finds every drink
+made with oat milk. Query words match indexed words by prefix, and fall back
+to trigram similarity so small typos ("capucino") still find results.
+
+The index is built lazily on the first search. Signals (products/signals.py)
+mark changed products stale and only those are reindexed before the next
+search. Changes made in other worker processes are picked up when the index
+is older than SEARCH_INDEX_MAX_AGE seconds.
+"""
+import re
+import threading
+import time
+from collections import defaultdict
+
+from django.conf import settings
+
+from ingredient_inventory.models import Ingredient
+from .models import Product, ProductSubRecipe
+from .recipes import load_product_recipes
+
+
+# Field weights used for ranking
+NAME_WEIGHT = 3.0
+INGREDIENT_WEIGHT = 2.0
+DESCRIPTION_WEIGHT = 1.0
+
+# Bonus for a query word matching an indexed word exactly instead of by prefix
+EXACT_MATCH_BONUS = 1.0
+
+MAX_PREFIX_LENGTH = 12
+MIN_TRIGRAM_SIMILARITY = 0.4
+
+_WORD_RE = re.compile(r'\w+')
+
+
+def tokenize(text):
+    return _WORD_RE.findall(str(text or '').lower())
+
+
+def trigrams(word):
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class ProductSearchIndex:
+    def __init__(self, max_age=None):
+        self.max_age = max_age
+        self._lock = threading.RLock()
+        self._built_at = None
+        self._stale = set()
+        self._postings = defaultdict(dict)    # word -> {product_id: weight}
+        self._prefixes = defaultdict(set)     # prefix -> words
+        self._trigrams = defaultdict(set)     # trigram -> words
+        self._doc_words = {}                  # product_id -> words
+
+    def mark_stale(self, product_ids):
+        """Reindex these products before the next search"""
+        with self._lock:
+            self._stale.update(product_ids)
+
+    def clear(self):
+        with self._lock:
+            self._built_at = None
+            self._stale.clear()
+            self._postings.clear()
+            self._prefixes.clear()
+            self._trigrams.clear()
+            self._doc_words.clear()
+
+    def _load_documents(self, product_ids=None):
+        """{product_id: {word: weight}} for the given products (all when None)"""
+        products = Product.objects.all()
+        uses = ProductSubRecipe.objects.all()
+        if product_ids is not None:
+            products = products.filter(pk__in=product_ids)
+            uses = uses.filter(product_id__in=product_ids)
+        products = list(products.values_list('pk', 'name', 'description'))
+
+        recipes = load_product_recipes([pk for pk, _, _ in products])
+        ingredient_ids = {ingredient_id for recipe in recipes.values() for ingredient_id in recipe}
+        ingredient_names = dict(Ingredient.objects.filter(pk__in=ingredient_ids).values_list('pk', 'name'))
+
+        sub_recipe_names = defaultdict(list)
+        for product_id, name in uses.values_list('product_id', 'sub_recipe__name'):
+            sub_recipe_names[product_id].append(name)
+
+        documents = {}
+        for pk, name, description in products:
+            words = {}
+            fields = [(description, DESCRIPTION_WEIGHT)]
+            fields += [(ingredient_names.get(ingredient_id), INGREDIENT_WEIGHT) for ingredient_id in recipes.get(pk, {})]
+            fields += [(sub_recipe_name, INGREDIENT_WEIGHT) for sub_recipe_name in sub_recipe_names[pk]]
+            fields.append((name, NAME_WEIGHT))
+            for text, weight in fields:
+                for word in tokenize(text):
+                    words[word] = max(words.get(word, 0), weight)
+            documents[pk] = words
+        return documents
+
+    def _remove(self, product_id):
+        for word in self._doc_words.pop(product_id, ()):
+            postings = self._postings.get(word)
+            if postings is None:
+                continue
+            postings.pop(product_id, None)
+            if not postings:
+                del self._postings[word]
+                for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                    self._prefixes[word[:length]].discard(word)
+                for trigram in trigrams(word):
+                    self._trigrams[trigram].discard(word)
+
+    def _add(self, product_id, words):
+        for word, weight in words.items():
+            if word not in self._postings:
+                for length in range(1, min(len(word), MAX_PREFIX_LENGTH) + 1):
+                    self._prefixes[word[:length]].add(word)
+                for trigram in trigrams(word):
+                    self._trigrams[trigram].add(word)
+            self._postings[word][product_id] = weight
+        self._doc_words[product_id] = set(words)
+
+    def _ensure_current(self):
+        expired = self.max_age is not None and self._built_at is not None and time.monotonic() - self._built_at > self.max_age
+        if self._built_at is None or expired:
+            documents = self._load_documents()
+            self.clear()
+            for product_id, words in documents.items():
+                self._add(product_id, words)
+            self._built_at = time.monotonic()
+        elif self._stale:
+            stale, self._stale = self._stale, set()
+            documents = self._load_documents(stale)
+            for product_id in stale:
+                self._remove(product_id)
+                if product_id in documents:
+                    self._add(product_id, documents[product_id])
+
+    def _matches(self, query_word):
+        """{product_id: score} for one query word"""
+        scores = {}
+        prefix = query_word[:MAX_PREFIX_LENGTH]
+        words = [word for word in self._prefixes.get(prefix, ()) if word.startswith(query_word)]
+
+        if not words:
+            # No prefix match, look for similarly spelled words instead
+            query_trigrams = trigrams(query_word)
+            candidates = set()
+            for trigram in query_trigrams:
+                candidates |= self._trigrams.get(trigram, set())
+            for word in candidates:
+                word_trigrams = trigrams(word)
+                similarity = len(query_trigrams & word_trigrams) / len(query_trigrams | word_trigrams)
+                if similarity >= MIN_TRIGRAM_SIMILARITY:
+                    for product_id, weight in self._postings[word].items():
+                        scores[product_id] = max(scores.get(product_id, 0), weight * similarity)
+            return scores
+
+        for word in words:
+            bonus = EXACT_MATCH_BONUS if word == query_word else 0
+            for product_id, weight in self._postings[word].items():
+                scores[product_id] = max(scores.get(product_id, 0), weight + bonus)
+        return scores
+
+    def search(self, query, limit=20):
+        """Return [(product_id, score)] matching every word of query, best first"""
+        query_words = tokenize(query)
+        if not query_words:
+            return []
+
+        with self._lock:
+            self._ensure_current()
+            totals = None
+            for query_word in query_words:
+                scores = self._matches(query_word)
+                if totals is None:
+                    totals = scores
+                else:
+                    totals = {pk: totals[pk] + score for pk, score in scores.items() if pk in totals}
+                if not totals:
+                    return []
+
+        ranked = sorted(totals.items(), key=lambda item: (-item[1], item[0]))
+        return ranked[:limit]
+
+
+index = ProductSearchIndex(max_age=getattr(settings, 'SEARCH_INDEX_MAX_AGE', 300))
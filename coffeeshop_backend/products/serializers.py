@@ -1,5 +1,9 @@
 from rest_framework import serializers
-from .models import Product, ProductIngredient
+from .models import Product, ProductIngredient, SubRecipe, SubRecipeIngredient, SubRecipeComponent, ProductSubRecipe
+from .availability import get_available_stock_map
+from .recipes import creates_cycle
+from .images import variant_urls
+from .units import ConversionError
 from ingredient_inventory.serializers import IngredientSerializer
 
 class ProductIngredientSerializer(serializers.ModelSerializer):
@@ -11,19 +15,99 @@ class ProductIngredientSerializer(serializers.ModelSerializer):
         model = ProductIngredient
         fields = ['id', 'ingredient', 'ingredient_name', 'ingredient_unit', 'quantity', 'required_unit']
 
+def validate_conversion(serializer, data):
+    """Refuse a recipe line whose required_unit can't be converted to its ingredient's unit"""
+    instance = serializer.instance
+    line = serializer.Meta.model(
+        ingredient=data.get('ingredient', getattr(instance, 'ingredient', None)),
+        required_unit=data.get('required_unit', getattr(instance, 'required_unit', 'g')),
+    )
+    if line.ingredient is None:
+        return data
+    try:
+        line.resolve_conversion_factor()
+    except ConversionError as error:
+        raise serializers.ValidationError({'required_unit': str(error)})
+    return data
+
 class ProductIngredientWriteSerializer(serializers.ModelSerializer):
     class Meta:
         model = ProductIngredient
         fields = ['ingredient', 'quantity', 'required_unit']
+    
+    def validate(self, data):
+        return validate_conversion(self, data)
+
+class SubRecipeIngredientSerializer(serializers.ModelSerializer):
+    ingredient_name = serializers.ReadOnlyField(source='ingredient.name')
+    ingredient_unit = serializers.ReadOnlyField(source='ingredient.unit')
+    
+    class Meta:
+        model = SubRecipeIngredient
+        fields = ['id', 'sub_recipe', 'ingredient', 'ingredient_name', 'ingredient_unit', 'quantity', 'required_unit']
+    
+    def validate(self, data):
+        return validate_conversion(self, data)
+
+class SubRecipeComponentSerializer(serializers.ModelSerializer):
+    sub_recipe_name = serializers.ReadOnlyField(source='sub_recipe.name')
+    
+    class Meta:
+        model = SubRecipeComponent
+        fields = ['id', 'parent', 'sub_recipe', 'sub_recipe_name', 'quantity']
+    
+    def validate(self, data):
+        parent = data.get('parent', getattr(self.instance, 'parent', None))
+        sub_recipe = data.get('sub_recipe', getattr(self.instance, 'sub_recipe', None))
+        if parent and sub_recipe and creates_cycle(parent.pk, sub_recipe.pk):
+            raise serializers.ValidationError({'sub_recipe': "A sub-recipe can't contain itself, directly or indirectly."})
+        return data
+
+class ProductSubRecipeSerializer(serializers.ModelSerializer):
+    sub_recipe_name = serializers.ReadOnlyField(source='sub_recipe.name')
+    
+    class Meta:
+        model = ProductSubRecipe
+        fields = ['id', 'product', 'sub_recipe', 'sub_recipe_name', 'quantity']
+
+class SubRecipeSerializer(serializers.ModelSerializer):
+    sub_recipe_ingredients = SubRecipeIngredientSerializer(many=True, read_only=True)
+    components = SubRecipeComponentSerializer(many=True, read_only=True)
+    
+    class Meta:
+        model = SubRecipe
+        fields = ['id', 'name', 'description', 'sub_recipe_ingredients', 'components', 'created_at', 'updated_at']
+
+class ProductListSerializer(serializers.ListSerializer):
+    """Resolves available stock for the whole list at once instead of per product"""
+    
+    def to_representation(self, data):
+        products = data.all() if hasattr(data, 'all') else data
+        products = list(products)
+        self.child.available_stock_map = get_available_stock_map(products)
+        return super().to_representation(products)
 
 class ProductSerializer(serializers.ModelSerializer):
     product_ingredients = ProductIngredientSerializer(many=True, read_only=True)
-    available_stock = serializers.IntegerField(source='get_available_stock', read_only=True)
+    product_sub_recipes = ProductSubRecipeSerializer(many=True, read_only=True)
+    available_stock = serializers.SerializerMethodField()
+    image_variants = serializers.SerializerMethodField()
     
     class Meta:
         model = Product
-        fields = ['id', 'name', 'price', 'stock', 'available_stock', 'description', 'image', 
-                  'deductable', 'created_at', 'updated_at', 'product_ingredients']
+        list_serializer_class = ProductListSerializer
+        fields = ['id', 'name', 'price', 'stock', 'reserved', 'available_stock', 'description', 'image', 'image_variants', 
+                  'deductable', 'created_at', 'updated_at', 'product_ingredients', 'product_sub_recipes']
+    
+    def get_available_stock(self, obj):
+        stock_map = getattr(self, 'available_stock_map', None)
+        if stock_map is not None and obj.pk in stock_map:
+            return stock_map[obj.pk]
+        return obj.get_available_stock()
+    
+    def get_image_variants(self, obj):
+        # Thumbnail, card and full size URLs; empty until variants are generated
+        return variant_urls(obj, self.context.get('request'))
     
     def to_representation(self, instance):
         data = super().to_representation(instance)
@@ -0,0 +1,161 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from ingredient_inventory.models import Ingredient
+from .models import Product, ProductIngredient, SubRecipe, SubRecipeIngredient, SubRecipeComponent, ProductSubRecipe
+from .availability import refresh_products, refresh_for_ingredients
+from .recipes import products_using_sub_recipes, products_using_ingredients
+from .images import generate_variants
+from .search import index as search_index
+from .units import ConversionError
+from coffeeshop_backend.log import get_logger
+
+logger = get_logger(__name__)
+
+
+_recipe_signals_deferred = ContextVar('recipe_signals_deferred', default=False)
+
+
+@contextmanager
+def defer_recipe_signals():
+    """
+    Skip the per-row refreshes recipe signals would do, for bulk writers that
+    refresh availability and the search index for every affected product
+    themselves once they are done
+    """
+    token = _recipe_signals_deferred.set(True)
+    try:
+        yield
+    finally:
+        _recipe_signals_deferred.reset(token)
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_saved(sender, instance, update_fields=None, **kwargs):
+    # Only stock, unit and density affect how many products can be made
+    if update_fields and not {'stock', 'unit', 'density'} & set(update_fields):
+        return
+    if not update_fields or {'unit', 'density'} & set(update_fields):
+        sync_conversion_factors(instance)
+    refresh_for_ingredients([instance.pk])
+
+
+def sync_conversion_factors(ingredient):
+    """Re-resolve the stored conversion factors of recipes using this ingredient"""
+    for model in (ProductIngredient, SubRecipeIngredient):
+        changed = []
+        for line in model.objects.filter(ingredient=ingredient):
+            line.ingredient = ingredient
+            old_factor = line.conversion_factor
+            try:
+                factor = line.resolve_conversion_factor()
+            except ConversionError as error:
+                # IngredientSerializer refuses such changes, this is a change made elsewhere (e.g. the admin)
+                logger.error("%s, keeping its old conversion factor for %s", error, line)
+                continue
+            if factor != old_factor:
+                changed.append(line)
+        if changed:
+            model.objects.bulk_update(changed, ['conversion_factor'])
+
+
+@receiver(post_save, sender=ProductIngredient)
+@receiver(post_delete, sender=ProductIngredient)
+def product_ingredient_changed(sender, instance, origin=None, **kwargs):
+    if _recipe_signals_deferred.get():
+        return
+    # Nothing to refresh when the recipe goes away because the product itself is deleted
+    origin_model = getattr(origin, 'model', type(origin))
+    if origin_model is Product:
+        return
+    refresh_products([instance.product_id])
+
+
+@receiver(post_save, sender=ProductSubRecipe)
+@receiver(post_delete, sender=ProductSubRecipe)
+def product_sub_recipe_changed(sender, instance, origin=None, **kwargs):
+    origin_model = getattr(origin, 'model', type(origin))
+    if origin_model is Product:
+        return
+    refresh_products([instance.product_id])
+
+
+@receiver(post_save, sender=SubRecipeIngredient)
+@receiver(post_delete, sender=SubRecipeIngredient)
+def sub_recipe_ingredient_changed(sender, instance, **kwargs):
+    refresh_products(products_using_sub_recipes([instance.sub_recipe_id]))
+
+
+@receiver(post_save, sender=SubRecipeComponent)
+@receiver(post_delete, sender=SubRecipeComponent)
+def sub_recipe_component_changed(sender, instance, **kwargs):
+    refresh_products(products_using_sub_recipes([instance.parent_id]))
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, created=False, update_fields=None, **kwargs):
+    if not instance.deductable:
+        return
+    if update_fields and 'deductable' not in update_fields:
+        return
+    refresh_products([instance.pk])
+
+
+@receiver(post_save, sender=Product)
+def product_image_saved(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'image' not in update_fields:
+        return
+    # Only regenerate when a different image was uploaded
+    source = instance.image.name if instance.image else None
+    if instance.image_variants.get('source') == source:
+        return
+    instance.image_variants = generate_variants(instance)
+    Product.objects.filter(pk=instance.pk).update(image_variants=instance.image_variants)
+
+
+# Search index: mark affected products stale, they are reindexed on the next search
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+def product_search_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and not {'name', 'description'} & set(update_fields):
+        return
+    search_index.mark_stale([instance.pk])
+
+
+@receiver(post_save, sender=ProductIngredient)
+@receiver(post_delete, sender=ProductIngredient)
+@receiver(post_save, sender=ProductSubRecipe)
+@receiver(post_delete, sender=ProductSubRecipe)
+def recipe_search_changed(sender, instance, **kwargs):
+    if _recipe_signals_deferred.get():
+        return
+    search_index.mark_stale([instance.product_id])
+
+
+@receiver(post_save, sender=SubRecipeIngredient)
+@receiver(post_delete, sender=SubRecipeIngredient)
+def sub_recipe_ingredient_search_changed(sender, instance, **kwargs):
+    search_index.mark_stale(products_using_sub_recipes([instance.sub_recipe_id]))
+
+
+@receiver(post_save, sender=SubRecipeComponent)
+@receiver(post_delete, sender=SubRecipeComponent)
+def sub_recipe_component_search_changed(sender, instance, **kwargs):
+    search_index.mark_stale(products_using_sub_recipes([instance.parent_id]))
+
+
+@receiver(post_save, sender=SubRecipe)
+def sub_recipe_search_changed(sender, instance, update_fields=None, **kwargs):
+    if update_fields and 'name' not in update_fields:
+        return
+    search_index.mark_stale(products_using_sub_recipes([instance.pk]))
+
+
+@receiver(post_save, sender=Ingredient)
+def ingredient_search_changed(sender, instance, update_fields=None, **kwargs):
+    # Stock changes on every completed order and don't affect search
+    if update_fields and 'name' not in update_fields:
+        return
+    search_index.mark_stale(products_using_ingredients([instance.pk]))
@@ -0,0 +1,9 @@
+"""Background jobs for products, see jobs/queue.py"""
+from jobs.queue import register
+from .availability import refresh_for_ingredients
+
+
+@register('products.refresh_availability')
+def refresh_availability(ingredient_ids):
+    """Recalculate stored availability for every product that uses one of the ingredients"""
+    refresh_for_ingredients(ingredient_ids)
@@ -1,3 +1,42 @@
+from decimal import Decimal
+
 from django.test import TestCase
 
-# Create your tests here.
+from ingredient_inventory.models import Ingredient
+from .models import Product, ProductIngredient
+from . import units
+
+
+class UnitConversionTests(TestCase):
+    def test_units_of_the_same_kind_convert(self):
+        self.assertEqual(units.conversion_factor('l', 'ml'), 1000)
+        self.assertEqual(units.conversion_factor('Kilograms', 'g'), 1000)
+        self.assertEqual(units.conversion_factor('tbsp', 'tsp'), 3)
+
+    def test_volume_and_mass_are_not_connected_without_density(self):
+        for from_unit, to_unit in [('ml', 'g'), ('l', 'kg'), ('tsp', 'g'), ('g', 'tbsp')]:
+            self.assertIsNone(units.conversion_factor(from_unit, to_unit))
+            self.assertTrue(units.needs_density(from_unit, to_unit))
+        with self.assertRaises(units.ConversionError):
+            units.convert(10, 'ml', 'g')
+
+    def test_density_converts_between_volume_and_mass(self):
+        self.assertAlmostEqual(units.conversion_factor('ml', 'g', Decimal('1.03')), 1.03)
+        self.assertAlmostEqual(units.conversion_factor('l', 'kg', Decimal('1.03')), 1.03)
+        self.assertAlmostEqual(units.conversion_factor('tsp', 'g', Decimal('0.4')), 2.0)
+        self.assertAlmostEqual(units.conversion_factor('kg', 'ml', Decimal('0.4')), 2500)
+
+    def test_recipe_lines_use_their_own_ingredient_density(self):
+        product = Product.objects.create(name="Latte", price=Decimal('100'), stock=0)
+        milk = Ingredient.objects.create(name="Milk", stock=10, unit='kg', reorder_point=0, density=Decimal('1.03'))
+        beans = Ingredient.objects.create(name="Beans", stock=10, unit='g', reorder_point=0, density=Decimal('0.4'))
+        milk_line = ProductIngredient.objects.create(product=product, ingredient=milk, quantity=200, required_unit='ml')
+        beans_line = ProductIngredient.objects.create(product=product, ingredient=beans, quantity=45, required_unit='ml')
+        self.assertAlmostEqual(milk_line.amount_in_ingredient_unit, 0.206)
+        self.assertAlmostEqual(beans_line.amount_in_ingredient_unit, 18)
+
+    def test_recipe_line_without_density_is_refused(self):
+        product = Product.objects.create(name="Latte", price=Decimal('100'), stock=0)
+        milk = Ingredient.objects.create(name="Milk", stock=10, unit='g', reorder_point=0)
+        with self.assertRaises(units.ConversionError):
+            ProductIngredient.objects.create(product=product, ingredient=milk, quantity=200, required_unit='ml')
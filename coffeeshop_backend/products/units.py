@@ -0,0 +1,135 @@
+"""
+Unit conversion registry.
+
+Units are nodes in a graph and every registered conversion is an edge, so a
+factor between any two connected units is found by walking the graph once.
+Recipes store the resolved factor (see ProductIngredient.conversion_factor)
+so hot paths never have to look anything up.
+
+Volume and mass are not connected: how many grams a millilitre weighs
+depends on the ingredient, so crossing between them needs that ingredient's
+density (Ingredient.density, grams per ml).
+"""
+from collections import deque
+from functools import lru_cache
+
+
+# Alternative spellings accepted for the canonical unit names
+ALIASES = {
+    'gram': 'g', 'grams': 'g', 'gr': 'g',
+    'kilogram': 'kg', 'kilograms': 'kg', 'kilo': 'kg', 'kilos': 'kg',
+    'milligram': 'mg', 'milligrams': 'mg',
+    'milliliter': 'ml', 'milliliters': 'ml', 'millilitre': 'ml', 'millilitres': 'ml',
+    'centiliter': 'cl', 'centilitre': 'cl',
+    'liter': 'l', 'liters': 'l', 'litre': 'l', 'litres': 'l',
+    'teaspoon': 'tsp', 'teaspoons': 'tsp',
+    'tablespoon': 'tbsp', 'tablespoons': 'tbsp',
+    'pc': 'pcs', 'piece': 'pcs', 'pieces': 'pcs', 'units': 'unit',
+}
+
+# Format: (from_unit, to_unit, multiplier) meaning 1 from_unit = multiplier to_unit
+# Reverse directions are added automatically.
+CONVERSIONS = [
+    # Mass
+    ('mg', 'g', 0.001),
+    ('kg', 'g', 1000),
+    # Volume
+    ('cl', 'ml', 10),
+    ('l', 'ml', 1000),
+    ('tsp', 'ml', 5),
+    ('tbsp', 'ml', 15),
+    ('tbsp', 'tsp', 3),
+    # Count
+    ('unit', 'pcs', 1),
+    ('dozen', 'pcs', 12),
+]
+
+# The units density converts between, 1 VOLUME_UNIT = density MASS_UNIT
+VOLUME_UNIT = 'ml'
+MASS_UNIT = 'g'
+
+_graph = {}
+
+
+def register(from_unit, to_unit, multiplier):
+    """Add a conversion edge (and its inverse) to the registry"""
+    from_unit, to_unit = normalize(from_unit), normalize(to_unit)
+    _graph.setdefault(from_unit, {})[to_unit] = float(multiplier)
+    _graph.setdefault(to_unit, {})[from_unit] = 1 / float(multiplier)
+    _graph_factor.cache_clear()
+
+
+class ConversionError(ValueError):
+    """Raised when an amount can't be converted between two units"""
+
+
+def normalize(unit):
+    """Canonical lower-case name for a unit"""
+    unit = str(unit).lower().strip()
+    return ALIASES.get(unit, unit)
+
+
+def needs_density(from_unit, to_unit):
+    """Whether one unit is a volume and the other a mass"""
+    def kind(unit):
+        if _graph_factor(unit, VOLUME_UNIT) is not None:
+            return 'volume'
+        if _graph_factor(unit, MASS_UNIT) is not None:
+            return 'mass'
+        return None
+    return {kind(from_unit), kind(to_unit)} == {'volume', 'mass'}
+
+
+def conversion_factor(from_unit, to_unit, density=None):
+    """
+    Multiplier that converts an amount in from_unit into to_unit, or None if
+    the units aren't connected. With a density (grams per ml) volume and mass
+    units are connected through it as well.
+    """
+    factor = _graph_factor(from_unit, to_unit)
+    if factor is not None or not density:
+        return factor
+    density = float(density)
+    to_mass = _graph_factor(from_unit, VOLUME_UNIT), _graph_factor(MASS_UNIT, to_unit)
+    if None not in to_mass:
+        return to_mass[0] * density * to_mass[1]
+    to_volume = _graph_factor(from_unit, MASS_UNIT), _graph_factor(VOLUME_UNIT, to_unit)
+    if None not in to_volume:
+        return to_volume[0] / density * to_volume[1]
+    return None
+
+
+@lru_cache(maxsize=None)
+def _graph_factor(from_unit, to_unit):
+    """
+    conversion_factor along the registered edges only. Uses the path with the
+    fewest conversions so direct (more precise) edges win over chained ones.
+    """
+    from_unit, to_unit = normalize(from_unit), normalize(to_unit)
+    if from_unit == to_unit:
+        return 1.0
+
+    queue = deque([(from_unit, 1.0)])
+    visited = {from_unit}
+    while queue:
+        unit, factor = queue.popleft()
+        for neighbour, multiplier in _graph.get(unit, {}).items():
+            if neighbour in visited:
+                continue
+            if neighbour == to_unit:
+                return factor * multiplier
+            visited.add(neighbour)
+            queue.append((neighbour, factor * multiplier))
+    return None
+
+
+def convert(amount, from_unit, to_unit, density=None):
+    """Convert amount between units, raising ConversionError when they aren't connected"""
+    factor = conversion_factor(from_unit, to_unit, density)
+    if factor is None:
+        raise ConversionError(f"Can't convert {from_unit} to {to_unit}")
+    return float(amount) * factor
+
+
+for _conversion in CONVERSIONS:
+    register(*_conversion)
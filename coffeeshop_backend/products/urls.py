@@ -1,11 +1,19 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProductViewSet, ProductIngredientView
+from .views import (
+    ProductViewSet, ProductIngredientView, SubRecipeViewSet, SubRecipeIngredientViewSet,
+    SubRecipeComponentViewSet, ProductSubRecipeViewSet, ProductRecipeBulkView,
+)
 
 router = DefaultRouter()
 router.register(r'products', ProductViewSet)
+router.register(r'sub-recipes', SubRecipeViewSet)
+router.register(r'sub-recipe-ingredients', SubRecipeIngredientViewSet)
+router.register(r'sub-recipe-components', SubRecipeComponentViewSet)
+router.register(r'product-sub-recipes', ProductSubRecipeViewSet)
 
 urlpatterns = [
     path('', include(router.urls)),
+    path('product-ingredients/bulk/', ProductRecipeBulkView.as_view(), name='product-ingredients-bulk'),
     path('product-ingredients/<int:product_id>/', ProductIngredientView.as_view(), name='product-ingredients'),
 ]
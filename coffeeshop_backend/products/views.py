@@ -4,13 +4,19 @@ from rest_framework.response import Response
 from rest_framework.views import APIView
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
-from .models import Product, ProductIngredient
-from ingredient_inventory.models import Ingredient
-from .serializers import ProductSerializer, ProductDetailSerializer, ProductIngredientSerializer
-from decimal import Decimal
+from .models import Product, ProductIngredient, SubRecipe, SubRecipeIngredient, SubRecipeComponent, ProductSubRecipe
+from .serializers import (
+    ProductSerializer, ProductDetailSerializer, ProductIngredientSerializer, SubRecipeSerializer,
+    SubRecipeIngredientSerializer, SubRecipeComponentSerializer, ProductSubRecipeSerializer,
+)
+from .search import index as search_index
+from .recipe_sync import sync_product_recipes
+from decimal import Decimal, InvalidOperation
 
 class ProductViewSet(viewsets.ModelViewSet):
-    queryset = Product.objects.all()
+    queryset = Product.objects.select_related('availability').prefetch_related(
+        'product_ingredients__ingredient', 'product_sub_recipes__sub_recipe'
+    )
     serializer_class = ProductSerializer
     permission_classes = [IsAuthenticated]
     
@@ -43,6 +49,78 @@ class ProductViewSet(viewsets.ModelViewSet):
                 
         return response
 
+    @action(detail=False, methods=['get'])
+    def search(self, request):
+        """Search products by name, description, ingredient or sub-recipe (?q=oat&limit=20)"""
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response({'error': 'Query parameter q is required'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+        except ValueError:
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+
+        ranked = search_index.search(query, limit=limit)
+        products = self.get_queryset().in_bulk([product_id for product_id, _ in ranked])
+        # Keep the ranking order, skipping products deleted since they were indexed
+        results = [products[product_id] for product_id, _ in ranked if product_id in products]
+        serializer = self.get_serializer(results, many=True)
+        return Response(serializer.data)
+
+class SubRecipeViewSet(viewsets.ModelViewSet):
+    queryset = SubRecipe.objects.prefetch_related('sub_recipe_ingredients__ingredient', 'components__sub_recipe')
+    serializer_class = SubRecipeSerializer
+    permission_classes = [IsAuthenticated]
+
+
+class SubRecipeIngredientViewSet(viewsets.ModelViewSet):
+    queryset = SubRecipeIngredient.objects.select_related('ingredient')
+    serializer_class = SubRecipeIngredientSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        
+        # Filter by sub_recipe if provided in query params
+        sub_recipe_id = self.request.query_params.get('sub_recipe')
+        if sub_recipe_id:
+            queryset = queryset.filter(sub_recipe_id=sub_recipe_id)
+            
+        return queryset
+
+
+class SubRecipeComponentViewSet(viewsets.ModelViewSet):
+    queryset = SubRecipeComponent.objects.select_related('sub_recipe')
+    serializer_class = SubRecipeComponentSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        
+        # Filter by parent sub-recipe if provided in query params
+        parent_id = self.request.query_params.get('parent')
+        if parent_id:
+            queryset = queryset.filter(parent_id=parent_id)
+            
+        return queryset
+
+
+class ProductSubRecipeViewSet(viewsets.ModelViewSet):
+    queryset = ProductSubRecipe.objects.select_related('sub_recipe')
+    serializer_class = ProductSubRecipeSerializer
+    permission_classes = [IsAuthenticated]
+    
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        
+        # Filter by product if provided in query params
+        product_id = self.request.query_params.get('product')
+        if product_id:
+            queryset = queryset.filter(product_id=product_id)
+            
+        return queryset
+
+
 class ProductIngredientView(APIView):
     """
     API endpoint to manage ingredients associated with a product
@@ -51,62 +129,114 @@ class ProductIngredientView(APIView):
     def get(self, request, product_id):
         """Get all ingredients for a specific product"""
         product = get_object_or_404(Product, id=product_id)
-        product_ingredients = ProductIngredient.objects.filter(product=product)
+        product_ingredients = ProductIngredient.objects.filter(product=product).select_related('ingredient')
         serializer = ProductIngredientSerializer(product_ingredients, many=True)
         return Response(serializer.data)
     
     def post(self, request, product_id):
-        """Update ingredients for a specific product"""
+        """Replace the ingredients of a specific product"""
         product = get_object_or_404(Product, id=product_id)
         
-        # First delete all existing product-ingredient associations
-        ProductIngredient.objects.filter(product=product).delete()
-        
         # Extract ingredients data from request
-        ingredients_data = request.data.get('ingredients', [])
-        created_items = []
+        rows, errors = parse_recipe_rows(request.data.get('ingredients', []))
+        results, missing = sync_product_recipes({product.id: rows})
+        errors += missing
+        result = results[product.id]
+        
+        return Response({
+            "created": ProductIngredientSerializer(result['created'], many=True).data,
+            "updated": ProductIngredientSerializer(result['updated'], many=True).data,
+            "deleted": result['deleted'],
+            "errors": errors if errors else None,
+            "message": f"Added {len(result['created'])}, updated {len(result['updated'])} and removed {result['deleted']} ingredients for product {product.name}"
+        }, status=status.HTTP_201_CREATED if not errors else status.HTTP_207_MULTI_STATUS)
+
+
+class ProductRecipeBulkView(APIView):
+    """
+    API endpoint to replace the ingredients of many products at once, e.g.
+    {"products": [{"product": 1, "ingredients": [{"ingredient": 2, "quantity": 18, "required_unit": "g"}]}]}
+    """
+    
+    def post(self, request):
+        entries = request.data.get('products', [])
+        if not isinstance(entries, list) or not entries:
+            return Response({"error": "products must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        product_ids = [entry.get('product') for entry in entries if isinstance(entry, dict)]
+        products = Product.objects.in_bulk([pk for pk in product_ids if isinstance(pk, int)])
+        
+        recipes = {}
         errors = []
+        for entry in entries:
+            product_id = entry.get('product') if isinstance(entry, dict) else None
+            if product_id not in products:
+                errors.append({"error": f"Product with ID {product_id} not found", "item": entry})
+                continue
+            if product_id in recipes:
+                errors.append({"error": f"Product with ID {product_id} submitted more than once", "item": entry})
+                continue
+            rows, row_errors = parse_recipe_rows(entry.get('ingredients', []))
+            recipes[product_id] = rows
+            errors += row_errors
         
-        for item in ingredients_data:
-            try:
-                ingredient_id = item.get('ingredient')
-                quantity = item.get('quantity')
-                
-                if not ingredient_id or not quantity:
-                    errors.append({"error": "Missing ingredient_id, quantity, or required_unit", "item": item})
-                    continue
-                
-                # Convert quantity to Decimal
-                try:
-                    quantity = Decimal(str(quantity))
-                except:
-                    errors.append({"error": "Invalid quantity format", "item": item})
-                    continue
-                
-                # Get the ingredient
-                try:
-                    ingredient = Ingredient.objects.get(id=ingredient_id)
-                except Ingredient.DoesNotExist:
-                    errors.append({"error": f"Ingredient with ID {ingredient_id} not found", "item": item})
-                    continue
-                
-                # Extract required_unit
-                required_unit = item.get('required_unit', ingredient.unit)
-                
-                # Create the product-ingredient relation
-                product_ingredient = ProductIngredient.objects.create(
-                    product=product,
-                    ingredient=ingredient,
-                    quantity=quantity,
-                    required_unit=required_unit
-                )
-                created_items.append(ProductIngredientSerializer(product_ingredient).data)
-            
-            except Exception as e:
-                errors.append({"error": str(e), "item": item})
+        results, missing = sync_product_recipes(recipes) if recipes else ({}, [])
+        errors += missing
         
         return Response({
-            "created": created_items,
+            "products": [
+                {
+                    "product": product_id,
+                    "product_name": products[product_id].name,
+                    "created": ProductIngredientSerializer(result['created'], many=True).data,
+                    "updated": ProductIngredientSerializer(result['updated'], many=True).data,
+                    "deleted": result['deleted'],
+                }
+                for product_id, result in results.items()
+            ],
             "errors": errors if errors else None,
-            "message": f"Added {len(created_items)} ingredients to product {product.name}"
-        }, status=status.HTTP_201_CREATED if not errors else status.HTTP_207_MULTI_STATUS)
+            "message": f"Updated recipes for {len(results)} products"
+        }, status=status.HTTP_200_OK if not errors else status.HTTP_207_MULTI_STATUS)
+
+
+def parse_recipe_rows(items):
+    """
+    Validate submitted recipe rows into [{'ingredient', 'quantity', 'required_unit'}]
+    plus a list of errors for the rows that were skipped
+    """
+    rows = []
+    errors = []
+    seen = set()
+    for item in items:
+        if not isinstance(item, dict):
+            errors.append({"error": "Invalid ingredient entry", "item": item})
+            continue
+        ingredient_id = item.get('ingredient')
+        quantity = item.get('quantity')
+        
+        if not ingredient_id or not quantity:
+            errors.append({"error": "Missing ingredient_id, quantity, or required_unit", "item": item})
+            continue
+        
+        # Convert quantity to Decimal
+        try:
+            quantity = Decimal(str(quantity))
+        except InvalidOperation:
+            errors.append({"error": "Invalid quantity format", "item": item})
+            continue
+        if not quantity.is_finite() or quantity <= 0:
+            errors.append({"error": "Invalid quantity format", "item": item})
+            continue
+        
+        try:
+            ingredient_id = int(ingredient_id)
+        except (TypeError, ValueError):
+            errors.append({"error": f"Ingredient with ID {ingredient_id} not found", "item": item})
+            continue
+        if ingredient_id in seen:
+            errors.append({"error": f"Ingredient with ID {ingredient_id} listed more than once", "item": item})
+            continue
+        seen.add(ingredient_id)
+        
+        rows.append({'ingredient': ingredient_id, 'quantity': quantity, 'required_unit': item.get('required_unit'), 'item': item})
+    return rows, errors
@@ -8,6 +8,9 @@ from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from datetime import datetime
+from coffeeshop_backend.log import get_logger
+
+logger = get_logger(__name__)
 
 class CustomerViewSet(viewsets.ModelViewSet):
     queryset = Customer.objects.all()
@@ -157,8 +160,9 @@ class LogoutView(APIView):
 
 class RegisterView(APIView):
     def post(self, request):
-        print("Registration request data:", request.data)  # Debug log
         username = request.data.get('username')
+        # Never log the raw request data, it contains the password
+        logger.debug("Registration request for username %r", username)
         email = request.data.get('email')
         password = request.data.get('password')
         
@@ -199,7 +203,7 @@ class RegisterView(APIView):
             )
             
         except Exception as e:
-            print("Registration error:", str(e))  # Debug log
+            logger.exception("Registration failed for username %r", username)
             return Response(
                 {"error": str(e)}, 
                 status=status.HTTP_400_BAD_REQUEST
@@ -1,9 +1,28 @@
-import React, { createContext, useContext, useState, useCallback } from 'react';
+import React, { createContext, useContext, useState, useCallback, useEffect, useRef } from 'react';
 import { useUser } from '@/hooks/useUser';
 import { toast } from 'sonner';
 
 const CartContext = createContext();
 
+// Orders taken while the server was unreachable, uploaded by syncOfflineOrders
+const OFFLINE_QUEUE_KEY = 'offlineOrders';
+
+const loadOfflineOrders = () => {
+  try {
+    return JSON.parse(localStorage.getItem(OFFLINE_QUEUE_KEY)) || [];
+  } catch {
+    return [];
+  }
+};
+
+const saveOfflineOrders = (orders) => {
+  if (orders.length) {
+    localStorage.setItem(OFFLINE_QUEUE_KEY, JSON.stringify(orders));
+  } else {
+    localStorage.removeItem(OFFLINE_QUEUE_KEY);
+  }
+};
+
 export const useCart = () => {
   const context = useContext(CartContext);
   if (!context) {
@@ -15,7 +34,31 @@ export const useCart = () => {
 export function CartProvider({ children }) {
   const [cart, setCart] = useState([]);
   const [isCartOpen, setIsCartOpen] = useState(false);
+  const [quote, setQuote] = useState(null);
   const { apiCallWithTokenRefresh } = useUser();
+  const syncing = useRef(false);
+
+  // Validate the whole cart against shared ingredient stock with one call per change
+  useEffect(() => {
+    if (cart.length === 0) {
+      setQuote(null);
+      return;
+    }
+
+    let cancelled = false;
+    const items = cart.map(item => ({ product: item.id, quantity: item.quantity }));
+    apiCallWithTokenRefresh('/api/orders/quote/', 'post', { items })
+      .then(response => {
+        if (!cancelled) setQuote(response.data);
+      })
+      .catch(error => {
+        console.error('Error quoting cart:', error);
+      });
+
+    return () => {
+      cancelled = true;
+    };
+  }, [cart, apiCallWithTokenRefresh]);
 
   const removeFromCart = useCallback((productId) => {
     setCart(prevCart => prevCart.filter(item => item.id !== productId));
@@ -64,31 +107,77 @@ export function CartProvider({ children }) {
     setCart([]);
   }, []);
 
+  // Upload the orders queued while offline; the server skips any it already has
+  const syncOfflineOrders = useCallback(async () => {
+    const queued = loadOfflineOrders();
+    if (queued.length === 0 || syncing.current || !navigator.onLine) return;
+
+    syncing.current = true;
+    try {
+      const response = await apiCallWithTokenRefresh('/api/orders/orders/sync/', 'post', { orders: queued });
+      const { results, created, rejected } = response.data;
+      // Orders queued while this upload was running stay in the queue
+      saveOfflineOrders(loadOfflineOrders().filter(order => !results[order.client_id]));
+
+      if (created) toast.success(`Uploaded ${created} order(s) taken offline`);
+      if (rejected) {
+        Object.values(results)
+          .filter(result => result.outcome === 'rejected')
+          .forEach(result => toast.error(`Offline order rejected: ${result.error}`));
+      }
+    } catch (error) {
+      console.error('Error uploading offline orders:', error);
+    } finally {
+      syncing.current = false;
+    }
+  }, [apiCallWithTokenRefresh]);
+
+  useEffect(() => {
+    syncOfflineOrders();
+    window.addEventListener('online', syncOfflineOrders);
+    return () => window.removeEventListener('online', syncOfflineOrders);
+  }, [syncOfflineOrders]);
+
   const createOrder = useCallback(async () => {
+    const order = {
+      client_id: crypto.randomUUID(),
+      ordered_at: new Date().toISOString(),
+      order_items: cart.map(item => ({
+        product: item.id,
+        quantity: item.quantity
+      }))
+    };
+
     try {
-      const orderData = {
-        order_items: cart.map(item => ({
-          product: item.id,
-          quantity: item.quantity,
-          price: item.price
-        }))
-      };
-      
-      await apiCallWithTokenRefresh('/api/orders/orders/', 'post', orderData);
+      // The key lets the server answer a retried request without creating a second order,
+      // and client_id stops a later offline upload of the same order from duplicating it
+      await apiCallWithTokenRefresh('/api/orders/orders/', 'post', {
+        client_id: order.client_id,
+        order_items: order.order_items
+      }, {
+        'Idempotency-Key': order.client_id
+      });
       
       toast.success('Order created successfully!');
-      setCart([]);
-      setIsCartOpen(false);
-      return true;
     } catch (error) {
-      console.error('Error creating order:', error);
-      toast.error('Failed to create order');
-      return false;
+      if (error.response) {
+        console.error('Error creating order:', error);
+        toast.error('Failed to create order');
+        return false;
+      }
+      // No response: the server is unreachable, keep the order and upload it later
+      saveOfflineOrders([...loadOfflineOrders(), order]);
+      toast.warning('You are offline. The order was saved and will be uploaded when the connection is back.');
     }
+    
+    setCart([]);
+    setIsCartOpen(false);
+    return true;
   }, [cart, apiCallWithTokenRefresh]);
 
   const value = {
     cart,
+    quote,
     isCartOpen,
     setIsCartOpen,
     addToCart,
@@ -97,7 +186,8 @@ export function CartProvider({ children }) {
     getTotalPrice,
     getTotalItems,
     clearCart,
-    createOrder
+    createOrder,
+    syncOfflineOrders
   };
 
   return (
@@ -81,11 +81,12 @@ export function UserProvider({ children }) {
   }, [refreshTimerRef]);
 
   // Create a reusable function for API calls that handles token refresh
-  const apiCallWithTokenRefresh = async (url, method = "get", data = null) => {
+  const apiCallWithTokenRefresh = async (url, method = "get", data = null, headers = undefined) => {
     try {
       const config = {
         method,
-        url
+        url,
+        headers
       };
       
       if (data && (method === "post" || method === "put" || method === "patch")) {
@@ -104,6 +105,7 @@ export function UserProvider({ children }) {
           return await api({
             method,
             url,
+            headers,
             data: data && (method === "post" || method === "put" || method === "patch") ? data : undefined
           });
         } catch (refreshError) {
@@ -90,7 +90,7 @@ export function OrderDetailsModal({ isOpen, onClose, order, onStatusChange }) {
     try {
       setIsLoadingItems(true);
       const response = await apiCallWithTokenRefresh(`/api/orders/order-items/?order_id=${orderId}`);
-      setOrderItems(response.data);
+      setOrderItems(response.data.results);
     } catch (error) {
       console.error("Error fetching order items:", error);
       toast.error("Failed to load order items");
@@ -320,8 +320,12 @@ export function OrderDetailsModal({ isOpen, onClose, order, onStatusChange }) {
     if (isOpen && order?.id) {
       fetchOrderItems(order.id);
       fetchProducts();
+      // List rows leave out the status history, load it with the full order
+      fetchUpdatedOrder(order.id).then((fullOrder) => {
+        if (fullOrder) setCurrentOrder(fullOrder);
+      });
     }
-  }, [isOpen, order?.id, fetchOrderItems, fetchProducts, apiCallWithTokenRefresh]);
+  }, [isOpen, order?.id, fetchOrderItems, fetchProducts, fetchUpdatedOrder, apiCallWithTokenRefresh]);
 
   // Don't render if no current order
   if (!currentOrder) return null;
@@ -340,7 +344,8 @@ export function OrderDetailsModal({ isOpen, onClose, order, onStatusChange }) {
       const response = await apiCallWithTokenRefresh(
         `/api/orders/orders/${order.id}/update_status/`, 
         "patch", 
-        { status: newStatus }
+        { status: newStatus },
+        { 'Idempotency-Key': crypto.randomUUID() }
       );
 
       // Fetch the updated order with new status history
@@ -753,14 +758,14 @@ export function OrderDetailsModal({ isOpen, onClose, order, onStatusChange }) {
         </div>
 
         {/* Status history */}
-        {order.status_history && order.status_history.length > 0 && (
+        {currentOrder.status_history && currentOrder.status_history.length > 0 && (
           <Card className="mt-4">
             <CardHeader>
               <CardTitle className="text-md">Status History</CardTitle>
             </CardHeader>
             <CardContent>
               <div className="space-y-3">
-                {order.status_history.map((history, index) => (
+                {currentOrder.status_history.map((history, index) => (
                   <div key={index} className="flex items-center gap-3">
                     <div className="flex-shrink-0">
                       <Badge className={`px-2 py-1 ${getStatusClasses(history.status)}`}>
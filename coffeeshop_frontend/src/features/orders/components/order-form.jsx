@@ -182,7 +182,7 @@ export function OrderForm({ isOpen, onClose, onSuccess }) {
         customer: customer || null,
         customer_name: customer || null,  // Send customer name for display
         total_price: calculateTotal()
-      });
+      }, { 'Idempotency-Key': crypto.randomUUID() });
       
       const orderId = orderResponse.data.id;
       
@@ -1,5 +1,6 @@
 import React, { useState, useEffect, useCallback } from "react";
 import { useUser } from "@/hooks/useUser";
+import api from "@/services/api";
 import { Card, CardContent, CardHeader, CardTitle } from "@/components/ui/card";
 import { Button } from "@/components/ui/button";
 import { toast } from "sonner";
@@ -14,6 +15,8 @@ export default function Orders() {
   const [orders, setOrders] = useState([]);
   const [filteredOrders, setFilteredOrders] = useState([]);
   const [loading, setLoading] = useState(true);
+  const [nextPage, setNextPage] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [error, setError] = useState(null);
   const [isFormOpen, setIsFormOpen] = useState(false);
   const [selectedOrder, setSelectedOrder] = useState(null);
@@ -31,12 +34,10 @@ export default function Orders() {
   const fetchOrders = useCallback(async () => {
     try {
       setLoading(true);
+      // Orders come newest first, one page at a time
       const response = await apiCallWithTokenRefresh('/api/orders/orders/');
-      // Sort orders by ordered_at date in descending order (newest first)
-      const sortedOrders = response.data.sort((a, b) => {
-        return new Date(b.ordered_at) - new Date(a.ordered_at);
-      });
-      setOrders(sortedOrders);
+      setOrders(response.data.results);
+      setNextPage(response.data.next);
       setError(null);
     } catch (err) {
       console.error('Error fetching orders:', err);
@@ -47,10 +48,45 @@ export default function Orders() {
     }
   }, [apiCallWithTokenRefresh]);
 
+  const fetchMoreOrders = useCallback(async () => {
+    if (!nextPage) return;
+    try {
+      setLoadingMore(true);
+      const response = await apiCallWithTokenRefresh(nextPage);
+      setOrders(prev => [...prev, ...response.data.results]);
+      setNextPage(response.data.next);
+    } catch (err) {
+      console.error('Error fetching more orders:', err);
+      toast.error('Could not load more orders');
+    } finally {
+      setLoadingMore(false);
+    }
+  }, [apiCallWithTokenRefresh, nextPage]);
+
   useEffect(() => {
     // Fetch orders when component mounts
     fetchOrders();
   }, [fetchOrders]);
+
+  // Apply live changes pushed by the server instead of polling
+  useEffect(() => {
+    const stream = new EventSource(`${api.defaults.baseURL}/api/orders/stream/`, { withCredentials: true });
+    const upsert = (event) => {
+      const { order } = JSON.parse(event.data);
+      setOrders(prev => prev.some(o => o.id === order.id)
+        ? prev.map(o => (o.id === order.id ? { ...o, ...order } : o))
+        : [order, ...prev]);
+    };
+    const remove = (event) => {
+      const { order } = JSON.parse(event.data);
+      setOrders(prev => prev.filter(o => o.id !== order.id));
+    };
+    stream.addEventListener('order.created', upsert);
+    stream.addEventListener('order.items_changed', upsert);
+    stream.addEventListener('order.status_changed', upsert);
+    stream.addEventListener('order.deleted', remove);
+    return () => stream.close();
+  }, []);
   
   // Apply filters to orders
   useEffect(() => {
@@ -180,6 +216,13 @@ export default function Orders() {
                 desc: true
               }}
             />
+            {nextPage && (
+              <div className="flex justify-center mt-4">
+                <Button variant="outline" onClick={fetchMoreOrders} disabled={loadingMore}>
+                  {loadingMore ? 'Loading...' : 'Load older orders'}
+                </Button>
+              </div>
+            )}
           </CardContent>
         </Card>
       )}